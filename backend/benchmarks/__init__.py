@@ -0,0 +1,5 @@
+"""
+Micro-benchmarks for the backend
+
+Run from the backend directory, e.g. `python -m benchmarks.docx_extract`.
+"""
@@ -0,0 +1,214 @@
+"""Synthetic documents for benchmarks"""
+
+import array
+import csv
+import io
+import json
+import math
+import random
+import wave
+import zipfile
+from xml.sax.saxutils import escape
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+_WORDS = (
+    "padi jagung pupuk urea npk tanam panen hektar irigasi hama wereng benih "
+    "lahan musim hujan kemarau dosis kg minggu setelah pemupukan"
+).split()
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _paragraph(text: str) -> str:
+    return f'<w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+
+def make_docx(paragraphs: int = 1000, tables: int = 20, rows: int = 20, seed: int = 0) -> bytes:
+    """
+    Build a DOCX with paragraphs and tables interleaved
+
+    Args:
+        paragraphs: Number of body paragraphs
+        tables: Number of 4-column tables spread through the text
+        rows: Rows per table
+
+    Returns:
+        DOCX file content
+    """
+    rng = random.Random(seed)
+    body = []
+    every = max(1, paragraphs // max(1, tables))
+    for index in range(paragraphs):
+        body.append(_paragraph(_sentence(rng, rng.randint(8, 30))))
+        if tables and index % every == every - 1 and index // every < tables:
+            table = ["<w:tbl>"]
+            for row in range(rows):
+                cells = [f"Minggu {row + 1}", rng.choice(_WORDS), f"{rng.randint(10, 300)} kg", _sentence(rng, 4)]
+                table.append("<w:tr>" + "".join(f"<w:tc>{_paragraph(cell)}</w:tc>" for cell in cells) + "</w:tr>")
+            table.append("</w:tbl>")
+            body.append("".join(table))
+
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f'<w:body>{"".join(body)}</w:body></w:document>'
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _RELS)
+        archive.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+def make_answer(chars: int = 2000, seed: int = 0) -> str:
+    """A chat answer of roughly `chars` characters: prose with a list and a dosage table"""
+    rng = random.Random(seed)
+    lines = []
+    size = 0
+    while size < chars:
+        kind = rng.random()
+        if kind < 0.6:
+            line = " ".join(_sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(2, 4)))
+        elif kind < 0.85:
+            line = f"- {_sentence(rng, rng.randint(5, 12))}"
+        else:
+            line = f"| Minggu {rng.randint(1, 12)} | {rng.choice(_WORDS)} | {rng.randint(10, 300)} kg/ha |"
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines)[:chars]
+
+
+def make_html(paragraphs: int = 500, seed: int = 0) -> bytes:
+    """An HTML page with navigation, scripts, styles and article text"""
+    rng = random.Random(seed)
+    parts = [
+        "<!DOCTYPE html><html><head><title>Panduan Pemupukan</title>",
+        "<style>body{font-family:sans-serif}.nav{display:flex}</style>",
+        "<script>window.dataLayer=[];function track(){}</script></head><body>",
+        '<nav class="nav"><a href="/">Beranda</a><a href="/artikel">Artikel</a></nav><article>',
+    ]
+    for index in range(paragraphs):
+        if index % 50 == 0:
+            parts.append(f"<h2>Bagian {index // 50 + 1}</h2>")
+        parts.append(f'<p class="text">{escape(_sentence(rng, rng.randint(10, 40)))}</p>')
+    parts.append("</article><footer>&copy; Kangtani</footer></body></html>")
+    return "".join(parts).encode("utf-8")
+
+
+def make_wav(seconds: float = 5.0, rate: int = 16000, seed: int = 0) -> bytes:
+    """Mono 16-bit PCM WAV of tones with a little noise"""
+    rng = random.Random(seed)
+    samples = array.array("h", (
+        int(8000 * math.sin(2 * math.pi * (220 + 110 * (index // rate)) * index / rate) + rng.randint(-500, 500))
+        for index in range(int(seconds * rate))
+    ))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def _pdf_string(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: int = 20, lines: int = 45, seed: int = 0) -> bytes:
+    """A text-only PDF (Helvetica, uncompressed content streams) with `lines` lines per page"""
+    rng = random.Random(seed)
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page ids are known
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_ids = []
+    for _ in range(pages):
+        commands = ["BT", "/F1 10 Tf", "13 TL", "50 800 Td"]
+        for _ in range(lines):
+            commands.append(f"({_pdf_string(_sentence(rng, rng.randint(6, 14)))}) Tj T*")
+        commands.append("ET")
+        stream = "\n".join(commands)
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{page} 0 R' for page in page_ids)}] /Count {pages} >>"
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = output.tell()
+    output.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        output.write(f"{offset:010d} 00000 n \n".encode())
+    output.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return output.getvalue()
+
+
+def make_csv(rows: int = 10000, seed: int = 0) -> bytes:
+    """Field trial records: dates, categorical crop/region columns and numeric measurements"""
+    rng = random.Random(seed)
+    crops = ["padi", "jagung", "kedelai", "cabai", "bawang merah", "tomat"]
+    regions = ["Karawang", "Indramayu", "Subang", "Garut", "Brebes", "Klaten", "Jember"]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["date", "region", "crop", "plot_ha", "urea_kg", "npk_kg", "rainfall_mm", "yield_ton", "notes"])
+    for index in range(rows):
+        plot = round(rng.uniform(0.2, 5.0), 2)
+        writer.writerow([
+            f"2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}",
+            rng.choice(regions),
+            rng.choice(crops),
+            plot,
+            round(plot * rng.uniform(150, 300), 1),
+            round(plot * rng.uniform(100, 250), 1),
+            rng.randint(0, 400),
+            round(plot * rng.uniform(3, 8), 2),
+            _sentence(rng, rng.randint(3, 8)) if rng.random() < 0.3 else "",
+        ])
+    return buffer.getvalue().encode("utf-8")
+
+
+def make_json(records: int = 2000, seed: int = 0) -> bytes:
+    """A JSON export of field observations with nested objects and lists"""
+    rng = random.Random(seed)
+    data = {
+        "source": "kangtani-benchmark",
+        "observations": [
+            {
+                "id": index,
+                "field": {"name": f"Sawah {index % 97}", "area_ha": round(rng.uniform(0.2, 5.0), 2)},
+                "crop": rng.choice(_WORDS),
+                "readings": [{"week": week, "height_cm": rng.randint(5, 120)} for week in range(rng.randint(1, 6))],
+                "note": _sentence(rng, rng.randint(5, 20)),
+            }
+            for index in range(records)
+        ],
+    }
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,66 @@
+"""
+Compare the streaming DOCX extractor with python-docx
+
+    python -m benchmarks.docx_extract --paragraphs 20000 --tables 200
+"""
+
+import argparse
+import io
+import time
+import tracemalloc
+
+from utils.docx_stream import extract_docx_text
+
+from .corpus import make_docx
+
+
+def _python_docx(content: bytes) -> str:
+    from docx import Document
+
+    doc = Document(io.BytesIO(content))
+    return "\n".join(paragraph.text for paragraph in doc.paragraphs)
+
+
+def extract_docx_text_bytes(content: bytes) -> str:
+    return extract_docx_text(io.BytesIO(content))
+
+
+def measure(func, content: bytes, repeat: int):
+    """Best wall time over `repeat` runs and peak traced memory of one run"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = func(content)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, len(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DOCX extraction benchmark")
+    parser.add_argument("--paragraphs", type=int, default=20000)
+    parser.add_argument("--tables", type=int, default=100)
+    parser.add_argument("--rows", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    content = make_docx(args.paragraphs, args.tables, args.rows)
+    print(f"Document: {len(content) / 1024:.0f} KiB, {args.paragraphs} paragraphs, {args.tables} tables x {args.rows} rows")
+
+    candidates = {"docx_stream": extract_docx_text_bytes}
+    try:
+        import docx  # noqa: F401
+        candidates["python-docx"] = _python_docx
+    except ImportError:
+        print("python-docx not installed, benchmarking the streaming extractor only")
+
+    for name, func in candidates.items():
+        seconds, peak, chars = measure(func, content, args.repeat)
+        print(f"{name:>12}: {seconds * 1000:8.1f} ms  peak {peak / 1024 / 1024:6.1f} MiB  {chars} chars")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Tune the resource governor under mixed ASR + parsing load
+
+Runs the same mixed workload through FileParser and AudioProcessor for each
+candidate setting of the `governor` config section and reports per-class
+latency percentiles and throughput. Optionally sends chat requests to a local
+Ollama with the governor's `num_thread` at the same time.
+
+    python -m benchmarks.governor_tuning --parse-concurrency 1 2 4 --asr-concurrency 1 2
+    python -m benchmarks.governor_tuning --cpus 0-7 --ollama --requests 40
+
+Copy the best `classes` block into config.json.
+"""
+
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import time
+from typing import Dict, List
+
+from governor import ResourceGovernor, parse_cpu_list
+from utils.audio import AudioProcessor
+from utils.file_parser import FileParser
+
+from .corpus import make_docx, make_html, make_wav
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def run_mix(governor: ResourceGovernor, documents, audio_base64: str, requests: int,
+                  asr_every: int, llm_every: int) -> Dict[str, List[float]]:
+    parser = FileParser(governor.executor("parse"))
+    audio = AudioProcessor(governor.executor("asr"))
+    latencies: Dict[str, List[float]] = {"parse": [], "asr": [], "llm": []}
+
+    async def timed(kind: str, coroutine) -> None:
+        start = time.perf_counter()
+        await coroutine
+        latencies[kind].append(time.perf_counter() - start)
+
+    async def chat() -> None:
+        from ollama_client import OllamaClient
+        from config import GenerationProfile
+        client = OllamaClient()
+        profile = GenerationProfile(name="bench", model=client.model, num_ctx=2048, num_predict=64,
+                                    num_thread=governor.ollama_num_thread)
+        async with governor.limit("llm"):
+            await client.chat("Berapa dosis urea untuk padi per hektar?", profile=profile)
+
+    tasks = []
+    for index in range(requests):
+        filename, content = documents[index % len(documents)]
+        tasks.append(timed("parse", parser.parse_file(filename, content)))
+        if asr_every and index % asr_every == 0:
+            tasks.append(timed("asr", audio.transcribe_audio_base64(audio_base64)))
+        if llm_every and index % llm_every == 0:
+            tasks.append(timed("llm", chat()))
+    await asyncio.gather(*tasks)
+    governor.shutdown()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resource governor tuning benchmark")
+    parser.add_argument("--cpus", help="CPU set to partition, e.g. 0-7 (default: all available)")
+    parser.add_argument("--parse-concurrency", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--asr-concurrency", type=int, nargs="+", default=[1])
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--asr-every", type=int, default=5, help="One transcription per N parse requests (0 = none)")
+    parser.add_argument("--ollama", action="store_true", help="Also send chats to the local Ollama")
+    parser.add_argument("--llm-every", type=int, default=10)
+    args = parser.parse_args()
+    cpus = parse_cpu_list(args.cpus) if args.cpus else None
+    documents = [("guide.docx", make_docx(2000, 20)), ("page.html", make_html(2000))]
+    audio_base64 = base64.b64encode(make_wav(5.0)).decode("ascii")
+
+    candidates = [{"enabled": False}] + [
+        {"enabled": True, "classes": {"parse": {"concurrency": parse}, "asr": {"concurrency": asr}}}
+        for parse, asr in itertools.product(args.parse_concurrency, args.asr_concurrency)
+    ]
+    for settings in candidates:
+        governor = ResourceGovernor(settings, cpus=cpus)
+        start = time.perf_counter()
+        latencies = asyncio.run(run_mix(governor, documents, audio_base64, args.requests, args.asr_every, args.llm_every if args.ollama else 0))
+        wall = time.perf_counter() - start
+        print(json.dumps(settings.get("classes", "governor disabled")))
+        for kind, values in latencies.items():
+            if values:
+                print(f"  {kind:>5}: n={len(values):3d}  p50 {percentile(values, 0.5):7.3f}s  "
+                      f"p95 {percentile(values, 0.95):7.3f}s  max {max(values):7.3f}s")
+        print(f"  wall {wall:.2f}s, {args.requests / wall:.1f} parses/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Per-request overhead of the request middleware
+
+Drives a bare Starlette app in-process over ASGI (no server, no sockets) with
+no middleware, the old `@app.middleware("http")` logger and the pure ASGI
+RequestContextMiddleware, for a small JSON response and a streaming one.
+
+    python -m benchmarks.middleware_overhead --requests 5000
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from middleware import RequestContextMiddleware
+
+STREAM_CHUNKS = 200
+
+
+async def _json(request):
+    return JSONResponse({"response": "ok", "request_id": getattr(request.state, "request_id", None)})
+
+
+async def _stream(request):
+    async def chunks():
+        for _ in range(STREAM_CHUNKS):
+            yield b"x" * 64
+    return StreamingResponse(chunks(), media_type="text/plain")
+
+
+async def _legacy_log_requests(request, call_next):
+    """The BaseHTTPMiddleware logger main.py used before RequestContextMiddleware"""
+    request_id = str(uuid.uuid4())
+    start_time = time.time()
+    logging.getLogger("bench").info(f"Request ID: {request_id} - {request.method} {request.url}")
+    logging.getLogger("bench").info(f"Request ID: {request_id} - Headers: {dict(request.headers)}")
+    request.state.request_id = request_id
+    response = await call_next(request)
+    processing_time = time.time() - start_time
+    logging.getLogger("bench").info(f"Request ID: {request_id} - Status: {response.status_code} - Time: {processing_time:.3f}s")
+    response.headers["X-Processing-Time"] = str(processing_time)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+def build_app(variant: str):
+    app = Starlette(routes=[Route("/json", _json), Route("/stream", _stream)])
+    if variant == "base_http":
+        app.add_middleware(BaseHTTPMiddleware, dispatch=_legacy_log_requests)
+    elif variant == "pure_asgi":
+        app.add_middleware(RequestContextMiddleware)
+    return app
+
+
+async def _call(app, path: str) -> float:
+    """Run one request; returns seconds until the first body chunk"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "root_path": "", "headers": [(b"host", b"bench"), (b"user-agent", b"bench"), (b"accept", b"*/*")],
+        "client": ("127.0.0.1", 1234), "server": ("bench", 80),
+    }
+    start = time.perf_counter()
+    first_chunk = None
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Like a real server, nothing more arrives until the client disconnects;
+        # returning at once would make disconnect listeners spin without yielding
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal first_chunk
+        if message["type"] == "http.response.body" and first_chunk is None:
+            first_chunk = time.perf_counter() - start
+
+    await app(scope, receive, send)
+    return first_chunk or 0.0
+
+
+async def run(requests: int):
+    for path in ("/json", "/stream"):
+        print(f"{path}:")
+        baseline = None
+        for variant in ("none", "base_http", "pure_asgi"):
+            app = build_app(variant)
+            for _ in range(100):
+                await _call(app, path)
+            first_chunks = []
+            start = time.perf_counter()
+            for _ in range(requests):
+                first_chunks.append(await _call(app, path))
+            per_request = (time.perf_counter() - start) / requests * 1e6
+            first_chunks.sort()
+            if baseline is None:
+                baseline = per_request
+            print(f"  {variant:>10}: {per_request:8.1f} us/request  (+{per_request - baseline:6.1f} us)  "
+                  f"first chunk p50 {first_chunks[len(first_chunks) // 2] * 1e6:6.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Request middleware overhead benchmark")
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    # Log records are created as in production but not written anywhere
+    logging.basicConfig(level=logging.INFO, handlers=[logging.NullHandler()])
+    asyncio.run(run(args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+JSON serialization and response compression on realistic answer sizes
+
+Compares stdlib json with orjson for ChatResponse bodies and Ollama
+/api/chat responses, and gzip/brotli levels for the compressed size and
+cost of the answers the API sends to clients.
+
+    python -m benchmarks.serialization --sizes 500 2000 8000 32000
+"""
+
+import argparse
+import json
+import time
+import zlib
+
+from .corpus import make_answer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def timed(func, repeat: int) -> float:
+    """Mean microseconds per call"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def chat_response(answer: str) -> dict:
+    return {
+        "response": answer,
+        "status": "success",
+        "request_id": "3f1c2a9e-8d47-4b6a-9a51-2c7e0b5f4d11",
+        "processing_time": 12.3456,
+        "profile": "balanced",
+        "stage_timings": {"file": 0.412, "generate": 11.87},
+    }
+
+
+def ollama_response(answer: str) -> dict:
+    return {
+        "model": "gemma3n:e2b", "created_at": "2025-01-01T00:00:00Z",
+        "message": {"role": "assistant", "content": answer},
+        "done": True, "total_duration": 12000000000, "eval_count": len(answer) // 4,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serialization and compression benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 8000, 32000])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    if orjson is None:
+        print("orjson not installed, JSON numbers are stdlib only")
+    if brotli is None:
+        print("brotli not installed, skipping br")
+
+    for size in args.sizes:
+        answer = make_answer(size)
+        response = chat_response(answer)
+        body = json.dumps(response).encode("utf-8")
+        raw_ollama = json.dumps(ollama_response(answer)).encode("utf-8")
+        print(f"\nAnswer {size} chars, response body {len(body)} bytes")
+
+        print(f"  dumps  json   {timed(lambda: json.dumps(response).encode('utf-8'), args.repeat):8.1f} us")
+        if orjson is not None:
+            print(f"  dumps  orjson {timed(lambda: orjson.dumps(response), args.repeat):8.1f} us")
+        print(f"  loads  json   {timed(lambda: json.loads(raw_ollama), args.repeat):8.1f} us  (Ollama reply)")
+        if orjson is not None:
+            print(f"  loads  orjson {timed(lambda: orjson.loads(raw_ollama), args.repeat):8.1f} us  (Ollama reply)")
+
+        codecs = [(f"gzip-{level}", lambda level=level: zlib.compress(body, level)) for level in (1, 6, 9)]
+        if brotli is not None:
+            codecs += [(f"br-{quality}", lambda quality=quality: brotli.compress(body, quality=quality)) for quality in (4, 11)]
+        for name, compress in codecs:
+            compressed = len(compress())
+            micros = timed(compress, max(1, args.repeat // 10))
+            print(f"  {name:>7}: {compressed:7d} bytes ({compressed / len(body):5.1%})  {micros:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
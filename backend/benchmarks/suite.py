@@ -0,0 +1,273 @@
+"""
+Scaling benchmarks for FileParser and AudioProcessor on synthetic corpora
+
+    python -m benchmarks.suite                                  # all cases, table on stdout
+    python -m benchmarks.suite --types pdf,csv --scale 4        # bigger inputs, two parsers
+    python -m benchmarks.suite --output results.json            # machine-readable results
+    python -m benchmarks.suite --baseline baseline.json         # exit 1 on regressions
+
+Every case is measured three ways: wall time over `--repeat` runs, peak RSS
+growth during one untraced run (sampled from a background thread), and the
+peak of Python allocations in one run under tracemalloc. Save a run with
+`--output` on a quiet machine and use it as the baseline for later runs on
+the same machine.
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.audio import AudioProcessor
+from utils.file_parser import FileParser, is_placeholder
+
+from .corpus import make_csv, make_docx, make_html, make_json, make_pdf, make_wav
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Input sizes per type at --scale 1, in the unit of the corpus generator
+SIZES = {
+    "pdf": [10, 50, 200],            # pages
+    "docx": [500, 5000, 20000],      # paragraphs
+    "csv": [1000, 20000, 100000],    # rows
+    "json": [200, 2000, 10000],      # records
+    "html": [200, 2000, 10000],      # paragraphs
+    "wav": [5, 30, 120],             # seconds
+}
+UNITS = {"pdf": "pages", "docx": "paragraphs", "csv": "rows", "json": "records", "html": "paragraphs", "wav": "seconds"}
+
+# Regressions smaller than this are noise, whatever the relative change
+MIN_TIME_DELTA = 0.005
+MIN_MEMORY_DELTA = 256 * 1024
+
+
+def _rss() -> Optional[int]:
+    """Resident set size of this process in bytes"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class RssSampler:
+    """Peak RSS growth while a block runs, sampled every millisecond"""
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.baseline = None
+        self.peak = None
+        self._stop = threading.Event()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            rss = _rss()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+
+    def __enter__(self) -> "RssSampler":
+        self.baseline = self.peak = _rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        rss = _rss()
+        if rss is not None and self.peak is not None:
+            self.peak = max(self.peak, rss)
+
+    @property
+    def growth(self) -> Optional[int]:
+        if self.baseline is None or self.peak is None:
+            return None
+        return self.peak - self.baseline
+
+
+def _make_input(kind: str, size: int) -> bytes:
+    if kind == "pdf":
+        return make_pdf(pages=size)
+    if kind == "docx":
+        return make_docx(paragraphs=size, tables=max(1, size // 100))
+    if kind == "csv":
+        return make_csv(rows=size)
+    if kind == "json":
+        return make_json(records=size)
+    if kind == "html":
+        return make_html(paragraphs=size)
+    if kind == "wav":
+        return make_wav(seconds=size)
+    raise ValueError(f"Unknown input type: {kind}")
+
+
+def _target(kind: str, content: bytes, audio_processor: AudioProcessor) -> Callable[[], str]:
+    """The code path a real upload of this type takes"""
+    if kind == "wav":
+        audio_base64 = base64.b64encode(content).decode("ascii")
+        return lambda: audio_processor.transcribe_base64_sync(audio_base64)
+    # A fresh parser per call, so CSV index caching doesn't flatter repeat runs
+    return lambda: FileParser().parse_file_sync(f"benchmark.{kind}", content)
+
+
+def measure(func: Callable[[], str], repeat: int) -> Dict[str, Any]:
+    """Wall time, RSS growth and traced allocations of one code path"""
+    func()  # warm up imports and model loading
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func()
+        times.append(time.perf_counter() - start)
+
+    with RssSampler() as sampler:
+        func()
+
+    tracemalloc.start()
+    func()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "wall_min": min(times),
+        "wall_median": statistics.median(times),
+        "peak_rss_growth": sampler.growth,
+        "traced_peak": traced_peak,
+        "output_chars": len(output),
+        "failed": is_placeholder(output),
+    }
+
+
+def run(types: List[str], scale: float, repeat: int) -> Dict[str, Any]:
+    audio_processor = AudioProcessor()
+    skipped = []
+    if "wav" in types and not audio_processor.whisper_available:
+        # Without Whisper the audio path only returns a placeholder; timing it would be meaningless
+        print("Skipping wav cases: Whisper is not installed", flush=True)
+        skipped.append("wav")
+    results = []
+    for kind in types:
+        if kind in skipped:
+            continue
+        for base_size in SIZES[kind]:
+            size = max(1, int(base_size * scale))
+            content = _make_input(kind, size)
+            result = {
+                "case": f"{kind}/{size}",
+                "type": kind,
+                "size": size,
+                "unit": UNITS[kind],
+                "input_bytes": len(content),
+                **measure(_target(kind, content, audio_processor), repeat),
+            }
+            results.append(result)
+            _print_row(result)
+    return {
+        "created_at": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "whisper": audio_processor.whisper_available,
+        "scale": scale,
+        "repeat": repeat,
+        "skipped": skipped,
+        "results": results,
+    }
+
+
+def _mib(value: Optional[int]) -> str:
+    return "     n/a" if value is None else f"{value / 1024 / 1024:8.1f}"
+
+
+def _print_row(result: Dict[str, Any]) -> None:
+    print(
+        f"{result['case']:>14} {result['input_bytes'] / 1024:10.0f} KiB"
+        f" {result['wall_median'] * 1000:10.1f} ms"
+        f" {_mib(result['peak_rss_growth'])} MiB rss"
+        f" {_mib(result['traced_peak'])} MiB traced"
+        f" {result['output_chars']:>10} chars"
+        + ("  FAILED" if result["failed"] else ""),
+        flush=True,
+    )
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Regressions of the current run against a baseline run
+
+    A case regresses when its median wall time or traced peak grew by more
+    than `tolerance` (relative) and by more than a small absolute floor.
+    Cases missing from either run are skipped.
+    """
+    previous = {result["case"]: result for result in baseline.get("results", [])}
+    regressions = []
+    for result in current["results"]:
+        before = previous.get(result["case"])
+        if before is None:
+            continue
+        for metric, floor, unit, factor in (
+            ("wall_median", MIN_TIME_DELTA, "ms", 1000),
+            ("traced_peak", MIN_MEMORY_DELTA, "MiB", 1 / 1024 / 1024),
+        ):
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            if new - old > floor and new > old * (1 + tolerance):
+                regressions.append(
+                    f"{result['case']}: {metric} {old * factor:.1f} -> {new * factor:.1f} {unit} "
+                    f"(+{(new / old - 1) * 100:.0f}%)"
+                )
+        if result["failed"] and not before.get("failed"):
+            regressions.append(f"{result['case']}: parsing now fails")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FileParser / AudioProcessor scaling benchmarks")
+    parser.add_argument("--types", default=",".join(SIZES), help=f"Comma-separated subset of {', '.join(SIZES)}")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier for all input sizes")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against a previous --output file; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown / memory growth")
+    args = parser.parse_args()
+
+    # Parsers log every failure; keep the table readable
+    logging.basicConfig(level=logging.WARNING)
+    types = [kind.strip() for kind in args.types.split(",") if kind.strip()]
+    unknown = set(types) - set(SIZES)
+    if unknown:
+        parser.error(f"Unknown types: {', '.join(sorted(unknown))}")
+
+    current = run(types, args.scale, args.repeat)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(current, file, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(current, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
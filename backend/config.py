@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+
+
+class ConfigStore:
+    """
+    JSON configuration file that is re-read whenever it changes on disk
+
+    Each access costs one `os.stat`; the file is only parsed again when its
+    modification time or size changes, so edits apply without a restart.
+    A broken edit is logged and the last good configuration is kept.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("KANGTANI_CONFIG", DEFAULT_CONFIG_PATH)
+        self._data: Dict[str, Any] = {}
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Dict[str, Any]:
+        """Return the current configuration, reloading it if the file changed"""
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            signature = None
+
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    self._reload(signature)
+        return self._data
+
+    def section(self, name: str, default: Any = None) -> Any:
+        """Return one top-level section of the configuration"""
+        return self.get().get(name, {} if default is None else default)
+
+    def _reload(self, signature) -> None:
+        if signature is None:
+            logger.warning(f"Config file {self.path} not found, using defaults")
+            self._data = {}
+            self._signature = None
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                self._data = json.load(file)
+            logger.info(f"Loaded config from {self.path}")
+        except Exception as e:
+            logger.error(f"Failed to load config {self.path}, keeping previous values: {e}")
+        self._signature = signature
+
+
+class GenerationProfile:
+    """Named set of model and Ollama generation options"""
+
+    OPTION_FIELDS = ("temperature", "top_p", "num_ctx", "num_predict", "num_thread")
+
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        quantization: Optional[str] = None,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        num_ctx: int = 4096,
+        num_predict: int = 1024,
+        num_thread: Optional[int] = None,
+        keep_alive: Optional[str] = None,
+        system_prompt: Optional[str] = None,
+        description: str = "",
+    ):
+        self.name = name
+        self.model = model
+        self.quantization = quantization
+        self.temperature = temperature
+        self.top_p = top_p
+        self.num_ctx = num_ctx
+        self.num_predict = num_predict
+        self.num_thread = num_thread
+        self.keep_alive = keep_alive
+        self.system_prompt = system_prompt
+        self.description = description
+
+    @property
+    def model_tag(self) -> str:
+        """Ollama model tag, including the quantized variant if one is set"""
+        if self.quantization:
+            return f"{self.model}-{self.quantization}"
+        return self.model
+
+    def options(self) -> Dict[str, Any]:
+        """Ollama `options` payload for this profile"""
+        options = {}
+        for field in self.OPTION_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                options[field] = value
+        return options
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model_tag,
+            "keep_alive": self.keep_alive,
+            "description": self.description,
+            **self.options(),
+        }
+
+
+class ProfileRegistry:
+    """
+    Look up generation profiles from the `profiles` section of the config
+
+    Profiles are selected explicitly per request, otherwise per route through
+    the `routes` section, otherwise the `default_profile`. Fields a profile
+    does not set fall back to `defaults` (the client's own settings).
+    """
+
+    PROFILE_FIELDS = {
+        "model", "quantization", "temperature", "top_p", "num_ctx", "num_predict",
+        "num_thread", "keep_alive", "system_prompt", "description",
+    }
+
+    def __init__(self, config: ConfigStore, defaults: Dict[str, Any]):
+        self.config = config
+        self.defaults = defaults
+
+    def names(self) -> List[str]:
+        return list(self.config.section("profiles"))
+
+    def get(self, name: Optional[str] = None, route: Optional[str] = None) -> GenerationProfile:
+        """
+        Resolve a profile
+
+        Args:
+            name: Profile requested by the caller
+            route: Request path used to pick a per-route default
+
+        Returns:
+            The resolved GenerationProfile
+        """
+        profiles = self.config.section("profiles")
+        if name and name not in profiles:
+            raise KeyError(f"Unknown profile: {name}. Available: {', '.join(profiles) or 'none'}")
+        if not name and route:
+            name = self.config.section("routes").get(route)
+        if not name:
+            name = self.config.get().get("default_profile")
+
+        settings = dict(self.defaults)
+        settings.update(profiles.get(name, {}) if name else {})
+        if "system_prompt" not in settings and self.config.get().get("system_prompt"):
+            settings["system_prompt"] = self.config.get()["system_prompt"]
+
+        unknown = set(settings) - self.PROFILE_FIELDS
+        if unknown:
+            logger.warning(f"Ignoring unknown settings in profile {name}: {sorted(unknown)}")
+            for key in unknown:
+                settings.pop(key)
+        return GenerationProfile(name=name or "default", **settings)
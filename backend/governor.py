@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from utils.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+RESOURCE_CLASSES = ("asr", "parse", "llm")
+
+# Used when the `governor` config section doesn't set a class
+DEFAULT_CLASSES = {
+    "asr": {"share": 0.25, "concurrency": 1},
+    "parse": {"share": 0.25, "concurrency": 2},
+    "llm": {"share": 0.5, "concurrency": 2},
+}
+
+# Below this many cores partitioning costs more than the contention it avoids
+MIN_CPUS_FOR_AFFINITY = 4
+
+
+def parse_cpu_list(spec) -> List[int]:
+    """Parse a CPU list like "0-3,6" (or a list of ints) into sorted CPU ids"""
+    if isinstance(spec, list):
+        return sorted(int(cpu) for cpu in spec)
+    cpus = set()
+    for part in str(spec).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return sorted(cpus)
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process may run on (respects taskset / container cpusets)"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class ResourceClass:
+    """CPU set, thread count and concurrency cap of one kind of work"""
+
+    def __init__(self, name: str, cpus: Optional[List[int]], threads: Optional[int], concurrency: int):
+        self.name = name
+        self.cpus = cpus
+        self.threads = threads
+        self.concurrency = concurrency
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"cpus": self.cpus, "threads": self.threads, "concurrency": self.concurrency}
+
+
+def _pin_worker(resource: ResourceClass) -> None:
+    """Executor initializer: pin the worker thread and size torch's thread pool"""
+    if resource.cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            # On Linux pid 0 is the calling thread, not the whole process
+            os.sched_setaffinity(0, resource.cpus)
+        except OSError as e:
+            logger.warning(f"Could not pin {resource.name} worker to CPUs {resource.cpus}: {e}")
+    if resource.name == "asr" and resource.threads:
+        try:
+            import torch
+            torch.set_num_threads(resource.threads)
+        except ImportError:
+            pass
+
+
+class ResourceGovernor:
+    """
+    Partition CPU cores between speech recognition, file parsing and the LLM
+
+    Whisper (torch threads), PDF/DOCX parsing and a co-located Ollama server
+    otherwise compete for every core. Each resource class gets a CPU set, a
+    thread count and a concurrency cap from the `governor` section of
+    config.json:
+
+        "governor": {
+          "enabled": true,
+          "classes": {
+            "asr":   {"cpus": "0-1", "threads": 2, "concurrency": 1},
+            "parse": {"cpus": "2-3", "concurrency": 2},
+            "llm":   {"cpus": "4-7", "concurrency": 2}
+          }
+        }
+
+    Classes without `cpus` split the available cores by `share` (only on
+    machines with at least MIN_CPUS_FOR_AFFINITY cores). ASR and parse work
+    runs on dedicated thread pools whose workers are pinned to their CPU set;
+    the LLM runs in Ollama's own process, so its class only sets the
+    `num_thread` passed to Ollama (pin Ollama itself with
+    `taskset -c <llm cpus> ollama serve`). ASR and parse concurrency is
+    capped by the size of their pools, LLM concurrency by `limit("llm")`.
+    Settings apply at startup.
+    """
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None, metrics: Optional[Metrics] = None,
+                 cpus: Optional[List[int]] = None):
+        settings = settings or {}
+        self.enabled = settings.get("enabled", False)
+        self.metrics = metrics
+        self.cpus = cpus or available_cpus()
+        self.classes = self._resolve(settings.get("classes", {}))
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._waiting: Dict[str, int] = {name: 0 for name in RESOURCE_CLASSES}
+        self._lock = threading.Lock()
+        if self.enabled:
+            logger.info("Resource governor: " + ", ".join(
+                f"{name} cpus={resource.cpus} threads={resource.threads} concurrency={resource.concurrency}"
+                for name, resource in self.classes.items()
+            ))
+
+    def _resolve(self, configured: Dict[str, Dict[str, Any]]) -> Dict[str, ResourceClass]:
+        partition = self.enabled and len(self.cpus) >= MIN_CPUS_FOR_AFFINITY
+        classes = {}
+        offset = 0
+        for name in RESOURCE_CLASSES:
+            settings = {**DEFAULT_CLASSES[name], **configured.get(name, {})}
+            if not self.enabled:
+                cpus = None
+            elif "cpus" in settings:
+                cpus = [cpu for cpu in parse_cpu_list(settings["cpus"]) if cpu in self.cpus] or None
+            elif partition:
+                # Contiguous slice of the available cores, at least one each
+                count = max(1, round(len(self.cpus) * settings["share"]))
+                cpus = self.cpus[offset:offset + count] or self.cpus[-1:]
+                offset += count
+            else:
+                cpus = None
+            # Without a CPU set, leave thread counts to torch / Ollama
+            threads = settings.get("threads") or (len(cpus) if cpus else None)
+            classes[name] = ResourceClass(name, cpus, threads, max(1, int(settings["concurrency"])))
+        return classes
+
+    def executor(self, name: str) -> Optional[ThreadPoolExecutor]:
+        """Dedicated pinned thread pool for a class, or None (loop default) when disabled"""
+        if not self.enabled or name == "llm":
+            return None
+        with self._lock:
+            if name not in self._executors:
+                resource = self.classes[name]
+                self._executors[name] = ThreadPoolExecutor(
+                    max_workers=resource.concurrency,
+                    thread_name_prefix=f"{name}-worker",
+                    initializer=_pin_worker,
+                    initargs=(resource,)
+                )
+            return self._executors[name]
+
+    @property
+    def ollama_num_thread(self) -> Optional[int]:
+        """`num_thread` for Ollama requests, unless a profile sets its own"""
+        return self.classes["llm"].threads if self.enabled else None
+
+    @asynccontextmanager
+    async def limit(self, name: str):
+        """Wait for a free slot of the class before running the block"""
+        if not self.enabled:
+            yield
+            return
+        semaphore = self._semaphores.get(name)
+        if semaphore is None:
+            semaphore = self._semaphores[name] = asyncio.Semaphore(self.classes[name].concurrency)
+        start_time = time.perf_counter()
+        self._waiting[name] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting[name] -= 1
+        if self.metrics is not None:
+            self.metrics.observe("governor_wait_seconds", time.perf_counter() - start_time, labels={"class": name})
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "available_cpus": self.cpus,
+            "classes": {
+                name: {**resource.to_dict(), "waiting": self._waiting[name]}
+                for name, resource in self.classes.items()
+            },
+        }
+
+    def backlog(self) -> Dict[str, int]:
+        """Work waiting per class: callers blocked in limit() plus tasks queued on its thread pool"""
+        with self._lock:
+            executors = dict(self._executors)
+        backlog = dict(self._waiting)
+        for name, executor in executors.items():
+            backlog[name] += executor._work_queue.qsize()
+        return backlog
+
+    def shutdown(self) -> None:
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
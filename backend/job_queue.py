@@ -0,0 +1,220 @@
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.db")
+
+JOB_TYPES = ("chat", "file", "audio")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    blob BLOB,
+    callback_url TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, type, created_at);
+"""
+
+
+def check_callback_url(url: str, allowed_hosts: Optional[List[str]] = None) -> None:
+    """
+    Refuse callback URLs that would make the server call into its own network
+
+    The host must resolve only to public addresses (no loopback, private,
+    link-local or reserved ranges, e.g. the cloud metadata service), unless
+    it is listed in `allowed_hosts` (`jobs.callback_allowed_hosts`), which
+    is how an internal receiver is permitted. Resolves DNS, so it blocks;
+    call it off the event loop.
+
+    Raises:
+        ValueError: The URL is not an acceptable callback target
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("callback_url must be an http(s) URL with a host")
+    host = parts.hostname.lower()
+    if host in {allowed.lower() for allowed in allowed_hosts or ()}:
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or 443, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError) as e:
+        raise ValueError(f"callback_url host {host} does not resolve: {e}")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"callback_url host {host} resolves to non-public address {ip}")
+
+
+class JobQueue:
+    """
+    Durable job queue in a local SQLite database (WAL mode)
+
+    Jobs move queued -> running -> done/failed. A running job holds a lease
+    that its worker renews while it works (`extend_lease`); if the worker
+    dies the lease expires and another worker picks the job up again, until
+    `max_attempts` is reached. Several API and worker processes can share
+    the same database file.
+    """
+
+    def __init__(self, path: Optional[str] = None, lease_seconds: float = 900, max_attempts: int = 3):
+        self.path = path or os.getenv("KANGTANI_JOBS_DB", DEFAULT_DB_PATH)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def submit(self, job_type: str, payload: Dict[str, Any], blob: Optional[bytes] = None,
+               callback_url: Optional[str] = None) -> str:
+        """
+        Enqueue a job
+
+        Args:
+            job_type: One of JOB_TYPES
+            payload: JSON-serializable job parameters
+            blob: Optional uploaded file content
+            callback_url: URL to POST the finished job to
+
+        Returns:
+            The new job id
+        """
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"Unknown job type: {job_type}")
+        job_id = str(uuid.uuid4())
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, type, status, payload, blob, callback_url, created_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, job_type, json.dumps(payload), blob, callback_url, time.time())
+            )
+        logger.info(f"Job {job_id} queued ({job_type})")
+        return job_id
+
+    def claim(self, job_types: Iterable[str], worker: str) -> Optional[Dict[str, Any]]:
+        """Atomically take the oldest runnable job of the given types, or None"""
+        job_types = list(job_types)
+        placeholders = ",".join("?" * len(job_types))
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Jobs whose worker died without finishing and ran out of attempts
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Worker lost too many times', blob = NULL, finished_at = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            row = conn.execute(
+                f"SELECT * FROM jobs WHERE type IN ({placeholders}) AND "
+                "(status = 'queued' OR (status = 'running' AND lease_until < ?)) "
+                "ORDER BY created_at LIMIT 1",
+                (*job_types, now)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                "started_at = ?, lease_until = ? WHERE id = ?",
+                (worker, now, now + self.lease_seconds, row["id"])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["attempts"] += 1
+        return job
+
+    def extend_lease(self, job_id: str, worker: str) -> bool:
+        """Renew the lease of a running job; False if the worker no longer holds it"""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, job_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: str, worker: str, result: Dict[str, Any]) -> bool:
+        """Store the result of a running job; False if the worker no longer holds its lease"""
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, blob = NULL, "
+                "finished_at = ?, lease_until = NULL WHERE id = ? AND worker = ? AND status = 'running'",
+                (json.dumps(result), time.time(), job_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id: str, worker: str, error: str, retry: bool = False) -> bool:
+        """
+        Mark a job failed, or put it back in the queue if `retry` and attempts remain
+
+        Returns False if the worker no longer holds the job's lease.
+        """
+        requeue = "? AND attempts < ?"
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET status = CASE WHEN {requeue} THEN 'queued' ELSE 'failed' END, "
+                f"finished_at = CASE WHEN {requeue} THEN NULL ELSE ? END, "
+                f"blob = CASE WHEN {requeue} THEN blob ELSE NULL END, "
+                "error = ?, lease_until = NULL WHERE id = ? AND worker = ? AND status = 'running'",
+                (retry, self.max_attempts, retry, self.max_attempts, time.time(),
+                 retry, self.max_attempts, error, job_id, worker)
+            )
+            return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job status and result, without the uploaded content"""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT id, type, status, result, error, attempts, callback_url, "
+                "created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            if job["status"] == "queued":
+                job["queue_position"] = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND type = ? AND created_at < ?",
+                    (job["type"], job["created_at"])
+                ).fetchone()[0] + 1
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per `type:status`"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT type, status, COUNT(*) FROM jobs GROUP BY type, status").fetchall()
+        return {f"{job_type}:{status}": count for job_type, status, count in rows}
@@ -1,11 +1,12 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
+from fastapi import Depends, FastAPI, Header, HTTPException, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
 import httpx
+import asyncio
 import base64
 import json
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 import logging
 import traceback
 import time
@@ -13,9 +14,20 @@ import os
 from datetime import datetime
 
 # Import our custom modules
-from ollama_client import OllamaClient
-from utils.audio import AudioProcessor
-from utils.file_parser import FileParser
+from config import GenerationProfile
+from job_queue import JobQueue, check_callback_url
+from middleware import CompressionMiddleware, DeadlineMiddleware, RequestContextMiddleware
+from ollama_client import OllamaUnavailableError
+from pipeline import ChatPipeline
+from prewarm import PrewarmScheduler
+from ratelimit import RateLimiter, RateLimitMiddleware, current_client
+from recorder import ResourceRecorder
+from profiling import LoopLagMonitor, MemoryTracer, ProfileStore, ProfilingMiddleware, admin_token, check_admin_token
+from utils import fast_json
+from utils.audit_log import AuditLogReader
+from utils.faq_index import DEFAULT_MIN_CONFIDENCE
+from utils.image import HAS_PIL
+from utils.stages import StageError
 
 # Configure comprehensive logging
 logging.basicConfig(
@@ -34,10 +46,58 @@ import uuid
 app = FastAPI(
     title="Kangtani.ai Backend",
     description="Agricultural chatbot backend powered by Ollama",
-    version="1.0.0"
+    version="1.0.0",
+    # orjson-backed responses when orjson is installed
+    default_response_class=ORJSONResponse if fast_json.HAS_ORJSON else JSONResponse
 )
 
-# Configure CORS with more permissive settings for development
+# Initialize clients
+pipeline = ChatPipeline()
+ollama_client = pipeline.ollama_client
+audio_processor = pipeline.audio_processor
+file_parser = pipeline.file_parser
+config_store = pipeline.config_store
+profiles = pipeline.profiles
+metrics = pipeline.metrics
+document_store = pipeline.document_store
+
+# Negotiated gzip/brotli for large responses (mobile clients on slow links)
+compression_settings = config_store.section("compression")
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=compression_settings.get("minimum_size", 1024),
+    gzip_level=compression_settings.get("gzip_level", 6),
+    brotli_quality=compression_settings.get("brotli_quality", 4),
+)
+
+# Per-request deadline, bounding preprocessing stages and the Ollama call
+app.add_middleware(DeadlineMiddleware, settings=lambda: config_store.section("deadlines"))
+
+# Per-client request/token buckets; also identifies the caller for fair LLM scheduling
+rate_limiter = RateLimiter(lambda: config_store.section("ratelimit"), metrics)
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
+# Header-triggered request profiling, only installed when admin features are enabled
+profiling_settings = config_store.section("profiling")
+profile_store = ProfileStore()
+memory_tracer = MemoryTracer()
+loop_lag_monitor: Optional[LoopLagMonitor] = None
+if admin_token():
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=profile_store,
+        interval=profiling_settings.get("sample_interval_ms", 5) / 1000
+    )
+
+# Resource time series and per-request latencies, for correlating slow requests with load
+resource_recorder = ResourceRecorder(pipeline, lambda: config_store.section("recorder"), metrics)
+
+# Request id / timing headers and access log (pure ASGI, bodies are streamed through)
+app.add_middleware(RequestContextMiddleware, on_finish=resource_recorder.record_request)
+
+# Configure CORS with more permissive settings for development. Added last so it
+# is outermost: preflights are answered before rate limiting, and 401/429
+# responses still carry CORS headers the browser can read
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # More permissive for debugging
@@ -46,60 +106,129 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize clients
-ollama_client = OllamaClient()
-audio_processor = AudioProcessor()
-file_parser = FileParser()
+# Durable queue for the asynchronous job API, drained by worker.py processes
+job_settings = config_store.section("jobs")
+job_queue = JobQueue(
+    path=job_settings.get("database"),
+    lease_seconds=job_settings.get("lease_seconds", 900),
+    max_attempts=job_settings.get("max_attempts", 3)
+)
+resource_recorder.job_queue = job_queue
+
+# Pre-generates answers to popular questions into the response cache while idle
+prewarm_scheduler = PrewarmScheduler(pipeline, lambda: config_store.section("prewarm"), metrics)
+
+@app.on_event("startup")
+async def start_prewarm_scheduler():
+    """Run the idle-time prewarm loop (it checks `prewarm.enabled` on every tick)"""
+    prewarm_scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_prewarm_scheduler():
+    prewarm_scheduler.stop()
+
+@app.on_event("shutdown")
+async def close_audit_log():
+    """Write audit entries still queued in memory"""
+    await pipeline.audit_log.close()
+
+@app.on_event("startup")
+async def start_resource_recorder():
+    """Sample resources every `recorder.interval_seconds` when `recorder.enabled` is set"""
+    resource_recorder.start()
+
+@app.on_event("shutdown")
+async def stop_resource_recorder():
+    resource_recorder.stop()
+
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    """Watch for event loop stalls when `profiling.loop_lag_ms` is set"""
+    global loop_lag_monitor
+    threshold_ms = profiling_settings.get("loop_lag_ms", 0)
+    if threshold_ms:
+        def record_stall(seconds: float) -> None:
+            metrics.increment("event_loop_stalls_total")
+            metrics.observe("event_loop_stall_seconds", seconds)
+        loop_lag_monitor = LoopLagMonitor(threshold=threshold_ms / 1000, on_stall=record_stall)
+        loop_lag_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_loop_lag_monitor():
+    if loop_lag_monitor is not None:
+        loop_lag_monitor.stop()
+
+def error_status(error: Exception) -> int:
+    """HTTP status for a failed chat: 503 while Ollama is down, 504 when the deadline ran out"""
+    if isinstance(error, StageError):
+        error = error.error
+    if isinstance(error, OllamaUnavailableError):
+        return 503
+    if isinstance(error, TimeoutError):
+        return 504
+    return 500
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Gate admin endpoints behind KANGTANI_ADMIN_TOKEN; they don't exist while it is unset"""
+    if not admin_token():
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not check_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail={"error": "Invalid admin token"})
+
+class ChatMessage(BaseModel):
+    role: str
+    content: str
 
 class ChatRequest(BaseModel):
     message: str
     audio_base64: Optional[str] = None
     file_content: Optional[str] = None
+    history: Optional[List[ChatMessage]] = None
+    profile: Optional[str] = None
+    document_ids: Optional[List[str]] = None
+    # Continue a conversation stored server-side (id from POST /sessions), from any worker process
+    session_id: Optional[str] = Field(None, max_length=128)
 
 class ChatResponse(BaseModel):
     response: str
     status: str = "success"
     request_id: Optional[str] = None
     processing_time: Optional[float] = None
+    profile: Optional[str] = None
+    stage_timings: Optional[Dict[str, float]] = None
+    session_id: Optional[str] = None
 
-# Middleware for request logging
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    request_id = str(uuid.uuid4())
-    start_time = time.time()
-    
-    # Log request details
-    logger.info(f"Request ID: {request_id} - {request.method} {request.url}")
-    logger.info(f"Request ID: {request_id} - Headers: {dict(request.headers)}")
-    
-    # Add request ID to request state
-    request.state.request_id = request_id
-    
+class ChatJobRequest(ChatRequest):
+    callback_url: Optional[str] = None
+
+class JobSubmitted(BaseModel):
+    job_id: str
+    status: str = "queued"
+    status_url: str
+
+def resolve_profile(name: Optional[str], req: Optional[Request], route: Optional[str] = None) -> GenerationProfile:
+    """Pick the generation profile requested by the caller or configured for the route"""
     try:
-        response = await call_next(request)
-        processing_time = time.time() - start_time
-        
-        # Log response details
-        logger.info(f"Request ID: {request_id} - Status: {response.status_code} - Time: {processing_time:.3f}s")
-        
-        # Add processing time to response headers
-        response.headers["X-Processing-Time"] = str(processing_time)
-        response.headers["X-Request-ID"] = request_id
-        
-        return response
-    except Exception as e:
-        processing_time = time.time() - start_time
-        logger.error(f"Request ID: {request_id} - Error: {str(e)}")
-        logger.error(f"Request ID: {request_id} - Traceback: {traceback.format_exc()}")
-        
-        return JSONResponse(
-            status_code=500,
-            content={
-                "error": "Internal server error",
-                "request_id": request_id,
-                "processing_time": processing_time,
-                "details": str(e)
-            }
+        return pipeline.resolve_profile(name, route or (req.url.path if req else None))
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail={"error": str(e.args[0])})
+
+def check_documents(document_ids: Optional[List[str]]) -> None:
+    """Reject chats that reference documents which were never uploaded by this client"""
+    owner = current_client().id
+    missing = [document_id for document_id in document_ids or [] if document_store.get(document_id, owner) is None]
+    if missing:
+        raise HTTPException(
+            status_code=404,
+            detail={"error": f"Unknown document ids: {', '.join(missing)}. Upload them to /documents first"}
+        )
+
+async def check_session(session_id: Optional[str]) -> None:
+    """Reject chats in sessions that don't exist or belong to another client"""
+    if session_id and not await asyncio.to_thread(pipeline.sessions.exists, session_id, current_client().id):
+        raise HTTPException(
+            status_code=404,
+            detail={"error": f"Unknown session: {session_id}. Start one with POST /sessions"}
         )
 
 @app.get("/")
@@ -128,6 +257,7 @@ async def health_check():
         health_status = {
             "status": "healthy",
             "ollama": "connected" if ollama_status else "disconnected",
+            "ollama_circuits": ollama_client.breaker_states(),
             "timestamp": datetime.now().isoformat(),
             "system": {
                 "cpu_percent": cpu_percent,
@@ -193,6 +323,26 @@ async def debug_info():
         logger.error(f"Debug info traceback: {traceback.format_exc()}")
         return {"error": str(e)}
 
+@app.get("/metrics")
+async def get_metrics():
+    """In-process counters and latency percentiles"""
+    snapshot = metrics.snapshot()
+    snapshot["jobs"] = await asyncio.to_thread(job_queue.counts)
+    snapshot["governor"] = pipeline.governor.status()
+    snapshot["faq"] = pipeline.faq.status()
+    snapshot["response_cache"] = await asyncio.to_thread(pipeline.response_cache.stats)
+    snapshot["fair_queue"] = pipeline.fair_queue.status()
+    return snapshot
+
+@app.get("/profiles")
+async def list_profiles():
+    """List the generation profiles currently configured"""
+    return {
+        "default_profile": config_store.get().get("default_profile"),
+        "routes": config_store.section("routes"),
+        "profiles": [profiles.get(name).to_dict() for name in profiles.names()]
+    }
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest, req: Request):
     request_id = getattr(req.state, 'request_id', str(uuid.uuid4()))
@@ -202,54 +352,45 @@ async def chat(request: ChatRequest, req: Request):
     logger.info(f"Chat request - Message: {request.message[:100]}...")
     logger.info(f"Chat request - Has audio: {bool(request.audio_base64)}")
     logger.info(f"Chat request - Has file: {bool(request.file_content)}")
+    profile = resolve_profile(request.profile, req)
+    check_documents(request.document_ids)
+    await check_session(request.session_id)
     
     try:
-        # Process audio if provided
-        if request.audio_base64:
-            try:
-                logger.info(f"Processing audio for request {request_id}")
-                audio_text = await audio_processor.transcribe_audio_base64(request.audio_base64)
-                request.message = f"{request.message} [Audio: {audio_text}]"
-                logger.info(f"Audio transcribed for {request_id}: {audio_text}")
-            except Exception as e:
-                logger.error(f"Audio transcription failed for {request_id}: {e}")
-                logger.error(f"Audio transcription traceback: {traceback.format_exc()}")
-                # Continue with original message if audio processing fails
-
-        # Process file content if provided
-        if request.file_content:
-            try:
-                logger.info(f"Processing file content for request {request_id}")
-                parsed_content = await file_parser.parse_content(request.file_content)
-                request.message = f"{request.message}\n\nFile Context:\n{parsed_content}"
-                logger.info(f"File content parsed for {request_id}")
-            except Exception as e:
-                logger.error(f"File parsing failed for {request_id}: {e}")
-                logger.error(f"File parsing traceback: {traceback.format_exc()}")
-                # Continue with original message if file parsing fails
-
-        # Send to Ollama
-        logger.info(f"Sending to Ollama for request {request_id}")
-        response = await ollama_client.chat(request.message)
-        logger.info(f"Ollama response received for {request_id}: {response[:100]}...")
+        # Transcribe audio / parse file content if provided, then send to Ollama
+        result = await pipeline.chat(
+            request.message,
+            request_id,
+            profile,
+            history=[turn.model_dump() for turn in request.history or []],
+            file_content=request.file_content,
+            audio_base64=request.audio_base64,
+            document_ids=request.document_ids,
+            allow_fast_path=request.profile is None,
+            session_id=request.session_id
+        )
+        logger.info(f"Ollama response received for {request_id}: {result.response[:100]}...")
         
         processing_time = time.time() - start_time
         
-        result = ChatResponse(
-            response=response,
+        chat_response = ChatResponse(
+            response=result.response,
             request_id=request_id,
-            processing_time=processing_time
+            processing_time=processing_time,
+            profile=result.profile.name,
+            stage_timings=result.stage_timings,
+            session_id=request.session_id
         )
         
         logger.info(f"Chat request {request_id} completed successfully in {processing_time:.3f}s")
-        return result
+        return chat_response
     
     except Exception as e:
         processing_time = time.time() - start_time
         logger.error(f"Chat error for {request_id}: {e}")
         logger.error(f"Chat error traceback: {traceback.format_exc()}")
         raise HTTPException(
-            status_code=500, 
+            status_code=error_status(e), 
             detail={
                 "error": str(e),
                 "request_id": request_id,
@@ -261,6 +402,7 @@ async def chat(request: ChatRequest, req: Request):
 async def chat_with_file(
     message: str = Form(...),
     file: UploadFile = File(...),
+    profile: Optional[str] = Form(None),
     req: Request = None
 ):
     request_id = getattr(req.state, 'request_id', str(uuid.uuid4())) if req else str(uuid.uuid4())
@@ -268,29 +410,28 @@ async def chat_with_file(
     
     logger.info(f"Chat with file request received - ID: {request_id}")
     logger.info(f"File upload - Name: {file.filename}, Size: {file.size if hasattr(file, 'size') else 'Unknown'}")
+    generation_profile = resolve_profile(profile, req)
     
     try:
         # Read file content
         file_content = await file.read()
         logger.info(f"File read successfully for {request_id}, size: {len(file_content)} bytes")
         
-        # Parse file content
-        parsed_content = await file_parser.parse_file(file.filename, file_content)
-        logger.info(f"File parsed successfully for {request_id}")
-        
-        # Combine message with file context
-        full_message = f"{message}\n\nFile Context:\n{parsed_content}"
-        
-        # Send to Ollama
-        response = await ollama_client.chat(full_message)
+        # Parse file content and send to Ollama with the file as context
+        result = await pipeline.chat_with_file(
+            message, request_id, generation_profile, file.filename, file_content,
+            allow_fast_path=profile is None
+        )
         
         processing_time = time.time() - start_time
         logger.info(f"Chat with file {request_id} completed in {processing_time:.3f}s")
         
         return ChatResponse(
-            response=response,
+            response=result.response,
             request_id=request_id,
-            processing_time=processing_time
+            processing_time=processing_time,
+            profile=result.profile.name,
+            stage_timings=result.stage_timings
         )
     
     except Exception as e:
@@ -298,7 +439,121 @@ async def chat_with_file(
         logger.error(f"Chat with file error for {request_id}: {e}")
         logger.error(f"Chat with file traceback: {traceback.format_exc()}")
         raise HTTPException(
-            status_code=500, 
+            status_code=error_status(e), 
+            detail={
+                "error": str(e),
+                "request_id": request_id,
+                "processing_time": processing_time
+            }
+        )
+
+@app.post("/chat/files")
+async def chat_with_files(
+    message: str = Form(...),
+    files: List[UploadFile] = File(...),
+    profile: Optional[str] = Form(None),
+    req: Request = None
+):
+    """Chat with several documents (e.g. soil report PDF, yield CSV and DOCX notes) at once"""
+    request_id = getattr(req.state, 'request_id', str(uuid.uuid4())) if req else str(uuid.uuid4())
+    start_time = time.time()
+    
+    logger.info(f"Chat with files request received - ID: {request_id}")
+    logger.info(f"Files upload - Names: {[file.filename for file in files]}")
+    generation_profile = resolve_profile(profile, req, route="/chat/file")
+    
+    max_files = config_store.section("multi_file").get("max_files", 10)
+    if len(files) > max_files:
+        raise HTTPException(status_code=400, detail={"error": f"At most {max_files} files per request"})
+    
+    try:
+        uploads = [(file.filename, await file.read()) for file in files]
+        logger.info(f"Files read successfully for {request_id}, total size: {sum(len(content) for _, content in uploads)} bytes")
+        
+        # Parse all files in parallel and send to Ollama with the merged context
+        result = await pipeline.chat_with_files(
+            message, request_id, generation_profile, uploads,
+            allow_fast_path=profile is None
+        )
+        
+        processing_time = time.time() - start_time
+        logger.info(f"Chat with files {request_id} completed in {processing_time:.3f}s")
+        
+        return ChatResponse(
+            response=result.response,
+            request_id=request_id,
+            processing_time=processing_time,
+            profile=result.profile.name,
+            stage_timings=result.stage_timings
+        )
+    
+    except Exception as e:
+        processing_time = time.time() - start_time
+        logger.error(f"Chat with files error for {request_id}: {e}")
+        logger.error(f"Chat with files traceback: {traceback.format_exc()}")
+        raise HTTPException(
+            status_code=error_status(e), 
+            detail={
+                "error": str(e),
+                "request_id": request_id,
+                "processing_time": processing_time
+            }
+        )
+
+@app.post("/chat/image")
+async def chat_with_image(
+    message: str = Form(...),
+    images: List[UploadFile] = File(...),
+    profile: Optional[str] = Form(None),
+    req: Request = None
+):
+    """Chat about photos (e.g. a diseased leaf or a pest) with the multimodal model"""
+    request_id = getattr(req.state, 'request_id', str(uuid.uuid4())) if req else str(uuid.uuid4())
+    start_time = time.time()
+    
+    logger.info(f"Chat with image request received - ID: {request_id}")
+    logger.info(f"Image upload - Names: {[image.filename for image in images]}")
+    generation_profile = resolve_profile(profile, req, route="/chat/image")
+    
+    if not HAS_PIL:
+        raise HTTPException(status_code=501, detail={"error": "Image support requires Pillow (pip install Pillow)"})
+    image_settings = config_store.section("images")
+    max_images = image_settings.get("max_images", 4)
+    if len(images) > max_images:
+        raise HTTPException(status_code=400, detail={"error": f"At most {max_images} images per request"})
+    
+    try:
+        uploads = [await image.read() for image in images]
+        max_bytes = image_settings.get("max_upload_mb", 20) * 1024 * 1024
+        if any(len(content) > max_bytes for content in uploads):
+            raise HTTPException(status_code=413, detail={"error": f"Images are limited to {max_bytes // (1024 * 1024)} MB each"})
+        logger.info(f"Images read successfully for {request_id}, total size: {sum(len(content) for content in uploads)} bytes")
+        
+        # Downscale the photos in the worker pool and send them to Ollama's `images` field
+        result = await pipeline.chat_with_images(
+            message, request_id, generation_profile, uploads,
+            allow_fast_path=profile is None
+        )
+        
+        processing_time = time.time() - start_time
+        logger.info(f"Chat with image {request_id} completed in {processing_time:.3f}s")
+        
+        return ChatResponse(
+            response=result.response,
+            request_id=request_id,
+            processing_time=processing_time,
+            profile=result.profile.name,
+            stage_timings=result.stage_timings
+        )
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        processing_time = time.time() - start_time
+        logger.error(f"Chat with image error for {request_id}: {e}")
+        logger.error(f"Chat with image traceback: {traceback.format_exc()}")
+        raise HTTPException(
+            status_code=400 if isinstance(e, ValueError) else error_status(e), 
             detail={
                 "error": str(e),
                 "request_id": request_id,
@@ -310,6 +565,7 @@ async def chat_with_file(
 async def chat_with_audio(
     message: str = Form(...),
     audio: UploadFile = File(...),
+    profile: Optional[str] = Form(None),
     req: Request = None
 ):
     request_id = getattr(req.state, 'request_id', str(uuid.uuid4())) if req else str(uuid.uuid4())
@@ -317,32 +573,28 @@ async def chat_with_audio(
     
     logger.info(f"Chat with audio request received - ID: {request_id}")
     logger.info(f"Audio upload - Name: {audio.filename}, Size: {audio.size if hasattr(audio, 'size') else 'Unknown'}")
+    generation_profile = resolve_profile(profile, req)
     
     try:
         # Read audio file
         audio_content = await audio.read()
         logger.info(f"Audio read successfully for {request_id}, size: {len(audio_content)} bytes")
         
-        # Convert to base64
-        audio_base64 = base64.b64encode(audio_content).decode('utf-8')
-        
-        # Transcribe audio
-        audio_text = await audio_processor.transcribe_audio_base64(audio_base64)
-        logger.info(f"Audio transcribed for {request_id}: {audio_text}")
-        
-        # Combine message with audio transcription
-        full_message = f"{message} [Audio: {audio_text}]"
-        
-        # Send to Ollama
-        response = await ollama_client.chat(full_message)
+        # Transcribe audio and send to Ollama with the transcription
+        result = await pipeline.chat_with_audio(
+            message, request_id, generation_profile, audio_content,
+            allow_fast_path=profile is None
+        )
         
         processing_time = time.time() - start_time
         logger.info(f"Chat with audio {request_id} completed in {processing_time:.3f}s")
         
         return ChatResponse(
-            response=response,
+            response=result.response,
             request_id=request_id,
-            processing_time=processing_time
+            processing_time=processing_time,
+            profile=result.profile.name,
+            stage_timings=result.stage_timings
         )
     
     except Exception as e:
@@ -350,7 +602,7 @@ async def chat_with_audio(
         logger.error(f"Chat with audio error for {request_id}: {e}")
         logger.error(f"Chat with audio traceback: {traceback.format_exc()}")
         raise HTTPException(
-            status_code=500, 
+            status_code=error_status(e), 
             detail={
                 "error": str(e),
                 "request_id": request_id,
@@ -358,6 +610,295 @@ async def chat_with_audio(
             }
         )
 
+@app.post("/documents")
+async def upload_document(file: UploadFile = File(...)):
+    """Parse a document once and store it; reference the returned document_id in later chats"""
+    if not file_parser.is_supported_file(file.filename):
+        raise HTTPException(status_code=400, detail={"error": f"Unsupported file type: {file.filename}"})
+    
+    file_content = await file.read()
+    logger.info(f"Document upload - Name: {file.filename}, Size: {len(file_content)} bytes")
+    try:
+        return await document_store.ingest(file.filename, file_content, file_parser, current_client().id)
+    except ValueError as e:
+        logger.warning(f"Document {file.filename} could not be parsed: {e}")
+        raise HTTPException(status_code=422, detail={"error": str(e)})
+    except Exception as e:
+        logger.error(f"Document ingest failed for {file.filename}: {e}")
+        logger.error(f"Document ingest traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail={"error": str(e)})
+
+@app.get("/documents/{document_id}")
+async def get_document(document_id: str, include_text: bool = False):
+    """Metadata of a stored document, optionally with its extracted text"""
+    owner = current_client().id
+    meta = document_store.get(document_id, owner)
+    if meta is None:
+        raise HTTPException(status_code=404, detail={"error": f"Unknown document: {document_id}"})
+    if include_text:
+        meta["text"] = document_store.get_text(document_id, owner)
+    return meta
+
+@app.delete("/documents/{document_id}")
+async def delete_document(document_id: str):
+    """Remove a document for this client; other clients' uploads of it are kept"""
+    if not document_store.delete(document_id, current_client().id):
+        raise HTTPException(status_code=404, detail={"error": f"Unknown document: {document_id}"})
+    return {"document_id": document_id, "status": "deleted"}
+
+@app.post("/sessions", status_code=201)
+async def create_session():
+    """Start a server-side chat session owned by the calling client; pass its id as `session_id` to /chat"""
+    session_id = await asyncio.to_thread(pipeline.sessions.create, current_client().id)
+    return {"session_id": session_id, "ttl_seconds": pipeline.sessions.ttl}
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    """Stored turns of a chat session"""
+    try:
+        turns = await asyncio.to_thread(pipeline.sessions.history, session_id, current_client().id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail={"error": f"Unknown session: {session_id}"})
+    return {"session_id": session_id, "turns": turns}
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if not await asyncio.to_thread(pipeline.sessions.delete, session_id, current_client().id):
+        raise HTTPException(status_code=404, detail={"error": f"Unknown session: {session_id}"})
+    return {"session_id": session_id, "status": "deleted"}
+
+@app.get("/files/csv/{index_id}/rows")
+async def lookup_csv_rows(index_id: str, column: str, value: str, limit: int = 20):
+    """Row-level lookup into a CSV that was summarized by a previous chat"""
+    logger.info(f"CSV row lookup - ID: {index_id}, {column}={value}")
+    if limit < 1:
+        raise HTTPException(status_code=400, detail={"error": "limit must be at least 1"})
+    limit = min(limit, 200)
+    async def lookup() -> Optional[List[Dict[str, str]]]:
+        # Scanning a large CSV index blocks, so keep it off the event loop;
+        # KeyError here only means the column doesn't exist
+        try:
+            return await asyncio.to_thread(file_parser.lookup_csv_rows, index_id, column, value, limit)
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail={"error": str(e.args[0])})
+
+    rows = await lookup()
+    if rows is None:
+        # Rebuild the index from the document store if the CSV was uploaded there
+        document_id = await asyncio.to_thread(document_store.find, index_id)
+        if document_id is not None:
+            try:
+                source = await asyncio.to_thread(document_store.get_source, document_id, current_client().id)
+            except KeyError:
+                # Another client's upload, or deleted since find(); the 404 below applies
+                source = None
+            if source is not None:
+                await file_parser.parse_file("document.csv", source)
+                rows = await lookup()
+    
+    if rows is None:
+        raise HTTPException(status_code=404, detail={"error": f"CSV {index_id} is not indexed, upload it again"})
+    
+    return {"index_id": index_id, "column": column, "value": value, "rows": rows}
+
+def _job_submitted(job_id: str) -> JobSubmitted:
+    return JobSubmitted(job_id=job_id, status_url=f"/jobs/{job_id}")
+
+async def validate_callback_url(callback_url: Optional[str]) -> None:
+    """Reject callback URLs pointing at loopback, private or other non-public addresses"""
+    if not callback_url:
+        return
+    allowed_hosts = config_store.section("jobs").get("callback_allowed_hosts")
+    try:
+        await asyncio.to_thread(check_callback_url, callback_url, allowed_hosts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail={"error": str(e)})
+
+@app.post("/jobs/chat", response_model=JobSubmitted, status_code=202)
+async def submit_chat_job(request: ChatJobRequest):
+    """Queue a chat request; poll GET /jobs/{job_id} or receive the result at callback_url"""
+    resolve_profile(request.profile, None, route="/chat")
+    check_documents(request.document_ids)
+    await check_session(request.session_id)
+    await validate_callback_url(request.callback_url)
+    payload = request.model_dump(exclude={"callback_url"})
+    payload["client"] = current_client().to_dict()
+    job_id = await asyncio.to_thread(job_queue.submit, "chat", payload, callback_url=request.callback_url)
+    return _job_submitted(job_id)
+
+@app.post("/jobs/chat/file", response_model=JobSubmitted, status_code=202)
+async def submit_file_job(
+    message: str = Form(...),
+    file: UploadFile = File(...),
+    profile: Optional[str] = Form(None),
+    callback_url: Optional[str] = Form(None)
+):
+    """Queue a chat-with-file request"""
+    resolve_profile(profile, None, route="/chat/file")
+    await validate_callback_url(callback_url)
+    file_content = await file.read()
+    job_id = await asyncio.to_thread(
+        job_queue.submit,
+        "file",
+        {"message": message, "filename": file.filename, "profile": profile, "client": current_client().to_dict()},
+        blob=file_content,
+        callback_url=callback_url
+    )
+    logger.info(f"File job {job_id} queued - Name: {file.filename}, Size: {len(file_content)} bytes")
+    return _job_submitted(job_id)
+
+@app.post("/jobs/chat/audio", response_model=JobSubmitted, status_code=202)
+async def submit_audio_job(
+    message: str = Form(...),
+    audio: UploadFile = File(...),
+    profile: Optional[str] = Form(None),
+    callback_url: Optional[str] = Form(None)
+):
+    """Queue a chat-with-audio request"""
+    resolve_profile(profile, None, route="/chat/audio")
+    await validate_callback_url(callback_url)
+    audio_content = await audio.read()
+    job_id = await asyncio.to_thread(
+        job_queue.submit,
+        "audio",
+        {"message": message, "filename": audio.filename, "profile": profile, "client": current_client().to_dict()},
+        blob=audio_content,
+        callback_url=callback_url
+    )
+    logger.info(f"Audio job {job_id} queued - Name: {audio.filename}, Size: {len(audio_content)} bytes")
+    return _job_submitted(job_id)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status of a queued job, including the chat response once it is done"""
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail={"error": f"Job {job_id} not found"})
+    return job
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_request_profiles():
+    """Recently profiled requests (send `X-Profile: 1` with `X-Admin-Token` to profile one)"""
+    return {"profiles": profile_store.list()}
+
+@app.get("/admin/profiles/{request_id}", dependencies=[Depends(require_admin)])
+async def get_request_profile(request_id: str, format: str = "json"):
+    """Sampling profile of one request; `format=folded` returns flamegraph input"""
+    profile = profile_store.get(request_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail={"error": f"No profile for request {request_id}"})
+    if format == "folded":
+        return PlainTextResponse(profile["folded"])
+    return {key: value for key, value in profile.items() if key != "folded"}
+
+@app.get("/admin/loop-lag", dependencies=[Depends(require_admin)])
+async def get_loop_lag():
+    """Event loop lag monitor status"""
+    if loop_lag_monitor is None:
+        return {"enabled": False}
+    return {"enabled": True, **loop_lag_monitor.status()}
+
+@app.post("/admin/tracemalloc/start", dependencies=[Depends(require_admin)])
+async def start_tracemalloc(frames: int = 25):
+    memory_tracer.start(frames)
+    return {"tracing": memory_tracer.tracing}
+
+@app.post("/admin/tracemalloc/stop", dependencies=[Depends(require_admin)])
+async def stop_tracemalloc():
+    memory_tracer.stop()
+    return {"tracing": memory_tracer.tracing}
+
+@app.post("/admin/tracemalloc/snapshot", dependencies=[Depends(require_admin)])
+async def take_tracemalloc_snapshot(limit: int = 20):
+    """Take a snapshot and return the largest allocation sites"""
+    try:
+        return await asyncio.to_thread(memory_tracer.snapshot, limit)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail={"error": str(e)})
+
+@app.get("/admin/tracemalloc/diff", dependencies=[Depends(require_admin)])
+async def diff_tracemalloc(base: str, target: Optional[str] = None, limit: int = 20):
+    """Allocation growth since snapshot `base` (against `target` or a fresh snapshot)"""
+    try:
+        return await asyncio.to_thread(memory_tracer.diff, base, target, limit)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail={"error": str(e.args[0])})
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail={"error": str(e)})
+
+@app.post("/admin/faq/reload", dependencies=[Depends(require_admin)])
+async def reload_faq():
+    """Re-read and re-index the FAQ file now (edits are also picked up automatically)"""
+    try:
+        return await asyncio.to_thread(pipeline.faq.reload)
+    except Exception as e:
+        logger.error(f"FAQ reload failed: {e}")
+        raise HTTPException(status_code=422, detail={"error": str(e)})
+
+@app.get("/admin/faq/search", dependencies=[Depends(require_admin)])
+async def search_faq(q: str, limit: int = 5):
+    """Scores of the best FAQ entries for a question, for tuning `faq.min_confidence`"""
+    settings = config_store.section("faq")
+    matches = pipeline.faq.index.search(q, limit=limit, lexical_weight=settings.get("lexical_weight", 0.5))
+    return {
+        "min_confidence": settings.get("min_confidence", DEFAULT_MIN_CONFIDENCE),
+        "matches": [match.to_dict() for match in matches]
+    }
+
+@app.get("/admin/recorder", dependencies=[Depends(require_admin)])
+async def get_recorder_samples(seconds: float = 300):
+    """Resource samples of the last `seconds` as columns, oldest first"""
+    return {**resource_recorder.status(), **resource_recorder.series(seconds)}
+
+@app.get("/admin/recorder/slow", dependencies=[Depends(require_admin)])
+async def get_slow_requests(seconds: float = 900, percentile: float = 0.99, path: Optional[str] = None, limit: int = 20):
+    """Requests above the latency percentile and the resource that stood out while each ran"""
+    return resource_recorder.slow_requests(seconds, percentile, path, min(limit, 200))
+
+@app.get("/admin/audit", dependencies=[Depends(require_admin)])
+async def get_audit_log():
+    """Audit log writer state and what is on disk"""
+    reader = AuditLogReader(pipeline.audit_log.directory)
+    return {"writer": pipeline.audit_log.status(), "segments": await asyncio.to_thread(reader.stats)}
+
+@app.get("/admin/audit/{request_id}", dependencies=[Depends(require_admin)])
+async def find_audit_entry(request_id: str):
+    """Logged question and answer of one request"""
+    entry = await asyncio.to_thread(AuditLogReader(pipeline.audit_log.directory).find, request_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail={"error": f"No audit entry for request {request_id}"})
+    return entry
+
+@app.get("/admin/shared-state", dependencies=[Depends(require_admin)])
+async def get_shared_state():
+    """Backend and entry counts per namespace of the cross-process store"""
+    return await asyncio.to_thread(pipeline.shared_state.status)
+
+@app.get("/admin/clients", dependencies=[Depends(require_admin)])
+async def get_clients():
+    """Rate limit bucket levels and the LLM fair queue per client"""
+    return {
+        "ratelimit": rate_limiter.usage(),
+        "fair_queue": pipeline.fair_queue.status()
+    }
+
+@app.get("/admin/prewarm", dependencies=[Depends(require_admin)])
+async def get_prewarm():
+    """Prewarm scheduler status and the questions it would pre-generate next"""
+    return {
+        **await asyncio.to_thread(prewarm_scheduler.status),
+        "busy": await prewarm_scheduler.busy_reason(),
+        "candidates": await asyncio.to_thread(prewarm_scheduler.candidates)
+    }
+
+@app.post("/admin/prewarm/run", dependencies=[Depends(require_admin)])
+async def run_prewarm():
+    """Start a prewarm run now, outside the configured windows (it still yields to live traffic)"""
+    if prewarm_scheduler.running:
+        raise HTTPException(status_code=409, detail={"error": "A prewarm run is already in progress"})
+    prewarm_scheduler.run_now()
+    return {"status": "started"}
+
 if __name__ == "__main__":
     import uvicorn
     
@@ -0,0 +1,264 @@
+import json
+import logging
+import time
+import traceback
+import uuid
+import zlib
+from typing import Callable, Dict, Optional
+
+from utils.deadline import deadline_scope, route_timeout
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = b"x-request-id"
+MAX_REQUEST_ID_LENGTH = 128
+
+
+def _incoming_request_id(headers) -> str:
+    """Caller-supplied X-Request-ID if it is sane, otherwise a fresh UUID"""
+    for name, value in headers:
+        if name == REQUEST_ID_HEADER:
+            request_id = value.decode("latin-1").strip()
+            if 0 < len(request_id) <= MAX_REQUEST_ID_LENGTH and request_id.isprintable():
+                return request_id
+            break
+    return str(uuid.uuid4())
+
+
+class RequestContextMiddleware:
+    """
+    Request id, timing headers and one access log line per request
+
+    Pure ASGI: response bodies (including streaming responses) are passed
+    through untouched, only the `http.response.start` message is amended with
+    `X-Request-ID` and `X-Processing-Time` (seconds until the response
+    started). The id is stored in `request.state.request_id`; an incoming
+    `X-Request-ID` header is honoured so ids can be traced across services.
+    Unhandled errors before the response started become a JSON 500.
+    `on_finish(request_id, method, path, status, seconds)` is called once the
+    request is done, e.g. to keep latency records.
+    """
+
+    def __init__(self, app, on_finish: Optional[Callable[[str, str, str, int, float], None]] = None):
+        self.app = app
+        self.on_finish = on_finish
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        request_id = _incoming_request_id(scope["headers"])
+        scope.setdefault("state", {})["request_id"] = request_id
+        status_code = 500
+        response_started = False
+
+        async def send_wrapper(message):
+            nonlocal status_code, response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER, request_id.encode("latin-1")))
+                headers.append((b"x-processing-time", f"{time.perf_counter() - start_time:.6f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            processing_time = time.perf_counter() - start_time
+            logger.error(f"Request ID: {request_id} - Error: {str(e)}")
+            logger.error(f"Request ID: {request_id} - Traceback: {traceback.format_exc()}")
+            if response_started:
+                raise
+            body = json.dumps({
+                "error": "Internal server error",
+                "request_id": request_id,
+                "processing_time": processing_time,
+                "details": str(e)
+            }).encode("utf-8")
+            await send_wrapper({
+                "type": "http.response.start",
+                "status": 500,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+        finally:
+            processing_time = time.perf_counter() - start_time
+            path = scope.get("path", "")
+            logger.info(f"Request ID: {request_id} - {scope['method']} {path} - Status: {status_code} - Time: {processing_time:.3f}s")
+            if self.on_finish is not None:
+                self.on_finish(request_id, scope["method"], path, status_code, processing_time)
+
+
+# Already-compressed media gains nothing from another pass
+_INCOMPRESSIBLE_TYPES = (b"image/", b"audio/", b"video/", b"application/zip", b"application/gzip")
+
+
+def _accepted_encodings(headers) -> Dict[str, float]:
+    """Accept-Encoding as {coding: q}"""
+    for name, value in headers:
+        if name == b"accept-encoding":
+            accepted = {}
+            for item in value.decode("latin-1").lower().split(","):
+                coding, _, params = item.strip().partition(";")
+                quality = 1.0
+                params = params.strip()
+                if params.startswith("q="):
+                    try:
+                        quality = float(params[2:])
+                    except ValueError:
+                        quality = 0.0
+                if coding:
+                    accepted[coding] = quality
+            return accepted
+    return {}
+
+
+def negotiate_encoding(headers) -> Optional[str]:
+    """Best content coding the client accepts: br (if brotli is installed), then gzip"""
+    accepted = _accepted_encodings(headers)
+    wildcard = accepted.get("*", 0.0)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_quality = None, 0.0
+    for coding in candidates:
+        quality = accepted.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class _Encoder:
+    def __init__(self, coding: str, gzip_level: int, brotli_quality: int):
+        self.coding = coding
+        if coding == "br":
+            self.compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self.compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compress and flush so streamed text reaches the client promptly"""
+        if self.coding == "br":
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.coding == "br":
+            return self.compressor.process(data) + self.compressor.finish()
+        return self.compressor.compress(data) + self.compressor.flush()
+
+
+class CompressionMiddleware:
+    """
+    Negotiated gzip/brotli compression of responses above `minimum_size`
+
+    Pure ASGI like RequestContextMiddleware. Single-body responses smaller
+    than `minimum_size` and responses that already carry a Content-Encoding
+    or an incompressible media type pass through unchanged. Streaming
+    responses are compressed chunk by chunk with a flush after each chunk.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        coding = negotiate_encoding(scope["headers"]) if scope["type"] == "http" else None
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        encoder: Optional[_Encoder] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, encoder, passthrough
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                if any(
+                    name == b"content-encoding"
+                    or (name == b"content-type" and value.lower().startswith(_INCOMPRESSIBLE_TYPES))
+                    for name, value in headers
+                ):
+                    passthrough = True
+                    await send(message)
+                else:
+                    # Hold the start until the first body chunk decides the encoding
+                    start_message = message
+                return
+
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start_message is not None:
+                start, start_message = start_message, None
+                if not more_body and len(body) < self.minimum_size:
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+
+                encoder = _Encoder(coding, self.gzip_level, self.brotli_quality)
+                headers = [(name, value) for name, value in start.get("headers", []) if name != b"content-length"]
+                headers.append((b"content-encoding", coding.encode()))
+                headers.append((b"vary", b"Accept-Encoding"))
+                if not more_body:
+                    body = encoder.finish(body)
+                    headers.append((b"content-length", str(len(body)).encode()))
+                    await send({**start, "headers": headers})
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send({**start, "headers": headers})
+
+            if more_body:
+                await send({"type": "http.response.body", "body": encoder.chunk(body), "more_body": True})
+            else:
+                await send({"type": "http.response.body", "body": encoder.finish(body)})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class DeadlineMiddleware:
+    """
+    Give every HTTP request a deadline (see deadline.py)
+
+    The timeout comes from the `deadlines` config section for the request
+    path, or from an `X-Request-Timeout` header in seconds (capped at the
+    configured maximum). Everything the request awaits, from preprocessing
+    stages to the Ollama call, is bounded by it.
+
+    Args:
+        settings: Callable returning the current `deadlines` section
+    """
+
+    def __init__(self, app, settings: Callable[[], Dict]):
+        self.app = app
+        self.settings = settings
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        requested = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-timeout":
+                try:
+                    requested = float(value)
+                except ValueError:
+                    pass
+                break
+        with deadline_scope(route_timeout(self.settings(), scope.get("path"), requested)):
+            await self.app(scope, receive, send)
@@ -0,0 +1,192 @@
+import logging
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import ConfigStore, GenerationProfile, ProfileRegistry
+from ollama_client import DEFAULT_SYSTEM_PROMPT, OllamaClient, OllamaUnavailableError
+from prompt_builder import PromptBuilder
+from utils.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+ESCALATE_TOKEN = "ESCALATE"
+
+SELF_CHECK_INSTRUCTION = (
+    "\nAnswer briefly. If the question needs a detailed diagnosis, a multi-step plan, "
+    f"or you are not confident in a short factual answer, reply with only the word {ESCALATE_TOKEN}."
+)
+
+# Whole words only, so every form is listed ("plan" must not match "plant")
+DEFAULT_ESCALATE_KEYWORDS = [
+    "diagnose", "diagnosis", "disease", "diseases", "pest", "pests", "symptom", "symptoms",
+    "why", "explain", "plan", "planning", "compare", "comparison",
+    "diagnosa", "penyakit", "hama", "gejala", "mengapa", "kenapa", "jelaskan", "rencana",
+    "bandingkan", "perbandingan",
+]
+
+DEFAULT_HEDGES = [
+    "i'm not sure", "i am not sure", "not certain", "cannot determine",
+    "tidak yakin", "kurang yakin", "tidak tahu",
+]
+
+
+class ModelRouter:
+    """
+    Speculative fast path in front of OllamaClient.chat
+
+    Requests that a cheap classifier considers simple are first answered by
+    the small `fast_profile`. The small model is told to answer only when it
+    is confident and to reply ESCALATE otherwise; escalations (and hedged or
+    empty answers) are re-run on the requested, larger profile. Everything
+    else goes straight to the larger profile. Settings live in the `router`
+    section of the config and are re-read on change.
+    """
+
+    def __init__(self, client: OllamaClient, profiles: ProfileRegistry, prompt_builder: PromptBuilder,
+                 config: ConfigStore, metrics: Metrics):
+        self.client = client
+        self.profiles = profiles
+        self.prompt_builder = prompt_builder
+        self.config = config
+        self.metrics = metrics
+
+    @property
+    def settings(self) -> Dict:
+        return self.config.section("router")
+
+    def classify(self, message: str, file_context: Optional[str], history: List[Dict[str, str]],
+                 images: Optional[List[str]] = None) -> Optional[str]:
+        """Return the reason to skip the fast path, or None if it may be tried"""
+        settings = self.settings
+        if file_context:
+            return "file_context"
+        if images:
+            return "images"
+        if len(message.split()) > settings.get("max_fast_words", 40):
+            return "long_message"
+        if len(history) > settings.get("max_fast_history", 4):
+            return "long_history"
+        lowered = message.lower()
+        for keyword in settings.get("escalate_keywords", DEFAULT_ESCALATE_KEYWORDS):
+            if re.search(rf"\b{re.escape(keyword)}\b", lowered):
+                return f"keyword:{keyword}"
+        return None
+
+    def _needs_escalation(self, answer: str) -> Optional[str]:
+        stripped = answer.strip()
+        if not stripped or stripped.upper().startswith(ESCALATE_TOKEN):
+            return "self_check"
+        if len(stripped) < self.settings.get("min_answer_chars", 20):
+            return "short_answer"
+        lowered = stripped.lower()
+        if any(hedge in lowered for hedge in self.settings.get("hedges", DEFAULT_HEDGES)):
+            return "hedged"
+        return None
+
+    async def _generate(
+        self,
+        request_id: str,
+        profile: GenerationProfile,
+        message: str,
+        history: List[Dict[str, str]],
+        file_context: Optional[str],
+        audio_transcript: Optional[str],
+        extra_instruction: str = "",
+        images: Optional[List[str]] = None
+    ) -> str:
+        plan = self.prompt_builder.build(
+            message,
+            (profile.system_prompt or DEFAULT_SYSTEM_PROMPT) + extra_instruction,
+            history=history,
+            file_context=file_context,
+            audio_transcript=audio_transcript,
+            num_ctx=profile.num_ctx,
+            num_predict=profile.num_predict
+        )
+        logger.info(f"Prompt for {request_id} ({profile.name}): {plan.prompt_tokens} tokens {plan.token_counts}, truncated: {plan.truncated or 'none'}")
+        return await self.client.chat(
+            plan.user_content,
+            system_prompt=plan.system_prompt,
+            history=plan.history,
+            profile=profile,
+            images=images
+        )
+
+    async def reply(
+        self,
+        message: str,
+        request_id: str,
+        profile: GenerationProfile,
+        history: Optional[List[Dict[str, str]]] = None,
+        file_context: Optional[str] = None,
+        audio_transcript: Optional[str] = None,
+        allow_fast_path: bool = True,
+        images: Optional[List[str]] = None
+    ) -> Tuple[str, GenerationProfile]:
+        """
+        Answer a message, trying the fast profile first when appropriate
+
+        Args:
+            message: User message
+            request_id: Request id for logging
+            profile: Profile to use when the fast path is skipped or escalates
+            history: Earlier turns, oldest first
+            file_context: Extracted document text
+            audio_transcript: Transcribed audio
+            allow_fast_path: False when the caller pinned a profile explicitly
+            images: Base64-encoded images for a multimodal profile (never sent to the fast path)
+
+        Returns:
+            Tuple of (answer, profile that produced it)
+        """
+        history = history or []
+        settings = self.settings
+        start_time = time.time()
+
+        fast_name = settings.get("fast_profile")
+        skip_reason = None
+        if not settings.get("enabled", False) or not allow_fast_path or not fast_name:
+            skip_reason = "disabled"
+        elif fast_name == profile.name or fast_name not in self.profiles.names():
+            skip_reason = "same_profile"
+        else:
+            skip_reason = self.classify(message, file_context, history, images)
+
+        if skip_reason is None:
+            fast_profile = self.profiles.get(fast_name)
+            try:
+                answer = await self._generate(
+                    request_id, fast_profile, message, history, file_context, audio_transcript,
+                    extra_instruction=SELF_CHECK_INSTRUCTION
+                )
+                escalation = self._needs_escalation(answer)
+            except (OllamaUnavailableError, TimeoutError):
+                # The larger profile would hit the same dead server or expired deadline
+                raise
+            except Exception as e:
+                logger.error(f"Fast path failed for {request_id}, escalating: {e}")
+                escalation = "fast_error"
+            fast_latency = time.time() - start_time
+            self.metrics.observe("router_fast_latency_seconds", fast_latency)
+
+            if escalation is None:
+                self.metrics.increment("router_decisions_total", labels={"decision": "fast"})
+                self.metrics.observe("router_latency_seconds", fast_latency, labels={"decision": "fast"})
+                logger.info(f"Router answered {request_id} on fast path ({fast_name}) in {fast_latency:.3f}s")
+                return answer, fast_profile
+            decision = f"escalated_{escalation}"
+            logger.info(f"Router escalating {request_id} to {profile.name}: {escalation} after {fast_latency:.3f}s")
+        elif skip_reason in ("disabled", "same_profile"):
+            decision = "direct"
+        else:
+            decision = "escalated_classifier"
+            logger.info(f"Router sending {request_id} straight to {profile.name}: {skip_reason}")
+
+        answer = await self._generate(
+            request_id, profile, message, history, file_context, audio_transcript, images=images
+        )
+        latency = time.time() - start_time
+        self.metrics.increment("router_decisions_total", labels={"decision": decision})
+        self.metrics.observe("router_latency_seconds", latency, labels={"decision": decision})
+        return answer, profile
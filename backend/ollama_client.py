@@ -1,17 +1,287 @@
+import asyncio
+import collections
 import httpx
-import json
 import logging
-from typing import Optional
+import os
+import random
+import time
+from typing import Any, Deque, Dict, List, Optional
+
+from config import GenerationProfile
+from utils import fast_json
+from utils.deadline import DeadlineExceeded, bound
+from utils.metrics import Metrics
 
 logger = logging.getLogger(__name__)
 
+# Default agricultural system prompt
+DEFAULT_SYSTEM_PROMPT = """You are Kangtani.ai, an agricultural assistant designed to help farmers and agricultural professionals.
+You provide expert advice on farming techniques, crop management, pest control, soil health, and sustainable agriculture practices.
+Always provide practical, actionable advice that considers local conditions and best practices.
+If you're unsure about something, acknowledge the limitation and suggest consulting local agricultural experts."""
+
+
+class OllamaError(Exception):
+    """Ollama request failed"""
+
+
+class OllamaTimeoutError(OllamaError, TimeoutError):
+    """Ollama did not answer within the request timeout or deadline"""
+
+
+class OllamaUnavailableError(OllamaError):
+    """Ollama cannot be reached, or its circuit breaker is open"""
+
+
+class OllamaResponseError(OllamaError):
+    """Ollama answered with an error status or an unexpected body"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _is_client_error(error: Optional[BaseException]) -> bool:
+    """Whether `error` is a 4xx answer, which no retry or hedge can fix"""
+    return isinstance(error, OllamaResponseError) and error.status_code is not None and error.status_code < 500
+
+
+class CircuitBreaker:
+    """
+    Fail fast while an Ollama server keeps failing
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    requests are rejected immediately for `reset_timeout` seconds. Then one
+    trial request is let through (half-open): success closes the breaker,
+    failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
 class OllamaClient:
-    def __init__(self, base_url: str = "http://localhost:11434", model: str = "gemma3n:e2b"):
+    """
+    Ollama HTTP client with deadlines, retries, a circuit breaker and hedging
+    
+    - Every request is bounded by `timeout` and by the caller's deadline
+      (utils.deadline), so a wedged server can't hold a worker for long.
+    - Connection failures are retried up to `max_retries` times with
+      exponential backoff and full jitter, within the deadline.
+    - Each server has a CircuitBreaker; while it is open, requests fail fast
+      with OllamaUnavailableError.
+    - With `hedge_urls`, a request that is still running after the
+      `hedge_percentile` latency of recent requests is also sent to the next
+      healthy server, and the first answer wins. Hedging duplicates
+      generation work, so it is off unless hedge URLs are configured.
+    """
+    
+    def __init__(self, base_url: str = "http://localhost:11434", model: str = "gemma3n:e2b",
+                 num_ctx: Optional[int] = None, num_predict: Optional[int] = None,
+                 timeout: Optional[float] = None, max_retries: int = 2,
+                 hedge_urls: Optional[List[str]] = None, hedge_percentile: float = 0.95,
+                 hedge_min_delay: float = 2.0, breaker_threshold: int = 5, breaker_reset: float = 30.0,
+                 metrics: Optional[Metrics] = None):
         self.base_url = base_url
         self.model = model
+        # Ollama reads generation limits from num_ctx/num_predict (max_tokens is ignored)
+        self.num_ctx = num_ctx or int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+        self.num_predict = num_predict or int(os.getenv("OLLAMA_NUM_PREDICT", "1024"))
+        self.default_profile = GenerationProfile(
+            name="default", model=model, num_ctx=self.num_ctx, num_predict=self.num_predict
+        )
         self.chat_url = f"{base_url}/api/chat"
         self.generate_url = f"{base_url}/api/generate"
+        self.timeout = timeout or float(os.getenv("OLLAMA_TIMEOUT", "600"))
+        self.max_retries = max_retries
+        if hedge_urls is None:
+            hedge_urls = [url.strip() for url in os.getenv("OLLAMA_HEDGE_URLS", "").split(",") if url.strip()]
+        self.hedge_urls = hedge_urls
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.breakers = {
+            url: CircuitBreaker(breaker_threshold, breaker_reset) for url in [base_url] + hedge_urls
+        }
+        self.metrics = metrics
+        self.latencies: Deque[float] = collections.deque(maxlen=200)
+    
+    def _payload(self, profile: GenerationProfile, **fields: Any) -> Dict[str, Any]:
+        """Build a non-streaming request body for the given profile"""
+        payload = {
+            "model": profile.model_tag,
+            "stream": False,
+            "options": profile.options(),
+            **fields
+        }
+        if profile.keep_alive is not None:
+            payload["keep_alive"] = profile.keep_alive
+        return payload
+    
+    def _count(self, name: str, **labels: str) -> None:
+        if self.metrics is not None:
+            self.metrics.increment(name, labels=labels or None)
+    
+    def _hedge_delay(self) -> float:
+        """Seconds to wait for the primary before hedging: recent latency percentile"""
+        if len(self.latencies) < 20:
+            return max(self.hedge_min_delay, self.timeout / 4)
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(self.hedge_percentile * len(ordered)))
+        return max(self.hedge_min_delay, ordered[index])
+    
+    async def _post_once(self, base_url: str, path: str, payload: bytes) -> Dict[str, Any]:
+        """POST to one server with retries on connection errors, guarded by its breaker"""
+        breaker = self.breakers[base_url]
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                self._count("ollama_requests_total", outcome="circuit_open")
+                raise OllamaUnavailableError(f"Ollama at {base_url} is unavailable (circuit open), failing fast")
+            try:
+                timeout = bound(self.timeout)
+            except DeadlineExceeded:
+                breaker.trial_in_flight = False
+                raise OllamaTimeoutError("Request deadline exceeded before calling Ollama")
+            
+            start_time = time.monotonic()
+            try:
+                async with httpx.AsyncClient(timeout=timeout) as client:
+                    response = await client.post(
+                        f"{base_url}{path}",
+                        content=payload,
+                        headers={"Content-Type": "application/json"}
+                    )
+                    response.raise_for_status()
+                    result = fast_json.loads(response.content)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                breaker.record_failure()
+                self._count("ollama_requests_total", outcome="connect_error")
+                delay = random.uniform(0, min(2.0, 0.25 * 2 ** attempt))
+                left = bound(None)
+                if attempt >= self.max_retries or (left is not None and left <= delay):
+                    logger.error(f"Cannot connect to Ollama at {base_url} after {attempt + 1} attempts: {e}")
+                    raise OllamaUnavailableError(f"Cannot connect to Ollama at {base_url}: {e}")
+                attempt += 1
+                self._count("ollama_retries_total")
+                logger.warning(f"Connecting to Ollama at {base_url} failed ({e}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            except httpx.TimeoutException:
+                # Generation may simply be slow; a retry would start it over, so don't.
+                # Only a full configured timeout says anything about the server:
+                # one cut short by the caller's deadline is not a failure
+                if timeout >= self.timeout:
+                    breaker.record_failure()
+                else:
+                    breaker.trial_in_flight = False
+                self._count("ollama_requests_total", outcome="timeout")
+                logger.error(f"Ollama request to {base_url} timed out after {timeout:.1f}s")
+                raise OllamaTimeoutError(f"Request to Ollama timed out after {timeout:.0f} seconds. Please try again.")
+            except httpx.HTTPStatusError as e:
+                status_code = e.response.status_code
+                if status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    # The server is healthy, the request is wrong (e.g. unknown model)
+                    breaker.record_success()
+                self._count("ollama_requests_total", outcome=f"http_{status_code}")
+                logger.error(f"Ollama HTTP error: {status_code} - {e.response.text}")
+                raise OllamaResponseError(f"Ollama server error: {status_code}", status_code)
+            except httpx.HTTPError as e:
+                breaker.record_failure()
+                self._count("ollama_requests_total", outcome="error")
+                logger.error(f"Error communicating with Ollama at {base_url}: {e}")
+                raise OllamaUnavailableError(f"Failed to communicate with Ollama: {e}")
+            except ValueError as e:
+                breaker.record_success()
+                raise OllamaResponseError(f"Invalid JSON from Ollama: {e}")
+            except BaseException:
+                # Cancelled (e.g. the losing side of a hedge): the trial proved
+                # nothing, so let the next request try instead of staying blocked
+                breaker.trial_in_flight = False
+                raise
+            
+            breaker.record_success()
+            self.latencies.append(time.monotonic() - start_time)
+            self._count("ollama_requests_total", outcome="ok")
+            return result
+    
+    async def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST to the primary server, hedging to a secondary if it is slow"""
+        body = fast_json.dumps(payload)
+        backups = [url for url in self.hedge_urls if self.breakers[url].state != "open"]
+        if not backups:
+            return await self._post_once(self.base_url, path, body)
         
+        primary = asyncio.ensure_future(self._post_once(self.base_url, path, body))
+        tasks = {primary: self.base_url}
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self._hedge_delay())
+            if done and not primary.cancelled() and _is_client_error(primary.exception()):
+                # The request itself is wrong; another server would reject it too
+                raise primary.exception()
+            if not done or primary.cancelled() or primary.exception() is not None:
+                # Slow or failed primary: race the first healthy backup against it
+                backup = backups[0]
+                logger.info(f"Hedging Ollama request to {backup}")
+                self._count("ollama_hedges_total")
+                tasks[asyncio.ensure_future(self._post_once(backup, path, body))] = backup
+            
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        error = error or OllamaUnavailableError(f"Request to {tasks[task]} was cancelled")
+                        continue
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            self._count("ollama_hedge_wins_total", server="primary" if task is primary else "backup")
+                        return task.result()
+                    if _is_client_error(task.exception()):
+                        raise task.exception()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    def breaker_states(self) -> Dict[str, str]:
+        return {url: breaker.state for url, breaker in self.breakers.items()}
+    
     async def test_connection(self) -> bool:
         """Test connection to Ollama server"""
         try:
@@ -22,113 +292,77 @@ class OllamaClient:
                 return True
         except Exception as e:
             logger.error(f"Ollama connection test failed: {e}")
-            raise Exception(f"Cannot connect to Ollama at {self.base_url}: {e}")
+            raise OllamaUnavailableError(f"Cannot connect to Ollama at {self.base_url}: {e}")
     
-    async def chat(self, message: str, system_prompt: Optional[str] = None) -> str:
+    async def chat(
+        self,
+        message: str,
+        system_prompt: Optional[str] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+        profile: Optional[GenerationProfile] = None,
+        images: Optional[List[str]] = None
+    ) -> str:
         """
         Send a chat message to Ollama and return the response
         
         Args:
             message: User message
             system_prompt: Optional system prompt for agricultural context
-            
+            history: Optional earlier turns as {"role", "content"} dicts, oldest first
+            profile: Generation profile (model and options), defaults to the client settings
+            images: Optional base64-encoded images attached to the message (multimodal models)
+        
         Returns:
             Response from the model
+        
+        Raises:
+            OllamaTimeoutError: Timeout or request deadline reached
+            OllamaUnavailableError: Server unreachable or circuit open
+            OllamaResponseError: Error status or unexpected response
         """
-        # Default agricultural system prompt
+        profile = profile or self.default_profile
         if system_prompt is None:
-            system_prompt = """You are Kangtani.ai, an agricultural assistant designed to help farmers and agricultural professionals. 
-            You provide expert advice on farming techniques, crop management, pest control, soil health, and sustainable agriculture practices.
-            Always provide practical, actionable advice that considers local conditions and best practices.
-            If you're unsure about something, acknowledge the limitation and suggest consulting local agricultural experts."""
+            system_prompt = profile.system_prompt or DEFAULT_SYSTEM_PROMPT
         
-        payload = {
-            "model": self.model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": message}
-            ],
-            "stream": False,
-            "options": {
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "max_tokens": 2048
-            }
-        }
+        messages = [{"role": "system", "content": system_prompt}]
+        messages.extend(history or [])
+        user_message = {"role": "user", "content": message}
+        if images:
+            user_message["images"] = images
+        messages.append(user_message)
         
-        try:
-            # Updated timeout to 10 minutes (600 seconds)
-            async with httpx.AsyncClient(timeout=600.0) as client:
-                logger.info(f"Sending message to Ollama: {message[:100]}...")
-                response = await client.post(
-                    self.chat_url,
-                    json=payload,
-                    headers={"Content-Type": "application/json"}
-                )
-                response.raise_for_status()
-                
-                result = response.json()
-                
-                if "message" in result and "content" in result["message"]:
-                    content = result["message"]["content"]
-                    logger.info(f"Received response from Ollama: {content[:100]}...")
-                    return content
-                else:
-                    logger.error(f"Unexpected Ollama response format: {result}")
-                    raise Exception("Invalid response format from Ollama")
-                    
-        except httpx.TimeoutException:
-            logger.error("Ollama request timed out after 10 minutes")
-            raise Exception("Request to Ollama timed out after 10 minutes. Please try again.")
-        except httpx.HTTPStatusError as e:
-            logger.error(f"Ollama HTTP error: {e.response.status_code} - {e.response.text}")
-            raise Exception(f"Ollama server error: {e.response.status_code}")
-        except Exception as e:
-            logger.error(f"Error communicating with Ollama: {e}")
-            raise Exception(f"Failed to communicate with Ollama: {e}")
+        payload = self._payload(profile, messages=messages)
+        
+        logger.info(f"Sending message to Ollama ({profile.name}/{profile.model_tag}, {len(images or [])} images): {message[:100]}...")
+        result = await self._post("/api/chat", payload)
+        
+        if "message" in result and "content" in result["message"]:
+            content = result["message"]["content"]
+            logger.info(f"Received response from Ollama: {content[:100]}...")
+            return content
+        else:
+            logger.error(f"Unexpected Ollama response format: {result}")
+            raise OllamaResponseError("Invalid response format from Ollama")
     
-    async def generate(self, prompt: str) -> str:
+    async def generate(self, prompt: str, profile: Optional[GenerationProfile] = None) -> str:
         """
         Generate text using Ollama's generate endpoint (alternative to chat)
         
         Args:
             prompt: Input prompt
-            
+            profile: Generation profile (model and options), defaults to the client settings
+        
         Returns:
             Generated text
         """
-        payload = {
-            "model": self.model,
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "max_tokens": 2048
-            }
-        }
+        payload = self._payload(profile or self.default_profile, prompt=prompt)
+        result = await self._post("/api/generate", payload)
         
-        try:
-            # Updated timeout to 10 minutes (600 seconds)
-            async with httpx.AsyncClient(timeout=600.0) as client:
-                response = await client.post(
-                    self.generate_url,
-                    json=payload,
-                    headers={"Content-Type": "application/json"}
-                )
-                response.raise_for_status()
-                
-                result = response.json()
-                
-                if "response" in result:
-                    return result["response"]
-                else:
-                    logger.error(f"Unexpected Ollama generate response: {result}")
-                    raise Exception("Invalid response format from Ollama generate")
-                    
-        except Exception as e:
-            logger.error(f"Error in generate request: {e}")
-            raise Exception(f"Failed to generate text: {e}")
+        if "response" in result:
+            return result["response"]
+        else:
+            logger.error(f"Unexpected Ollama generate response: {result}")
+            raise OllamaResponseError("Invalid response format from Ollama generate")
     
     async def list_models(self) -> list:
         """List available models in Ollama"""
@@ -140,4 +374,11 @@ class OllamaClient:
                 return result.get("models", [])
         except Exception as e:
             logger.error(f"Error listing models: {e}")
-            return []
\ No newline at end of file
+            return []
+    
+    async def running_models(self) -> list:
+        """Models currently loaded by Ollama (`/api/ps`), with their memory use"""
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            response = await client.get(f"{self.base_url}/api/ps")
+            response.raise_for_status()
+            return response.json().get("models", [])
@@ -0,0 +1,519 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import ConfigStore, GenerationProfile, ProfileRegistry
+from governor import ResourceGovernor
+from model_router import ModelRouter
+from ollama_client import OllamaClient
+from prompt_builder import PromptBuilder
+from ratelimit import PREWARM, FairQueue, current_client
+from utils.audio import AudioProcessor
+from utils.audit_log import AuditLog
+from utils.document_store import DocumentStore
+from utils.faq_index import DEFAULT_MIN_CONFIDENCE, FaqMatch, FaqStore
+from utils.file_parser import FileParser, is_placeholder
+from utils.image import ImageProcessor
+from utils.metrics import Metrics
+from utils.response_cache import PromptLog, ResponseCache
+from utils.shared_state import SessionStore, SharedCache, content_key, open_shared_state
+from utils.stages import Stage, StageError, StageGraph
+
+logger = logging.getLogger(__name__)
+
+# Seconds per stage; override in the `stages` section of config.json
+DEFAULT_STAGE_TIMEOUTS = {
+    "asr": 120.0,
+    "file": 60.0,
+    "documents": 10.0,
+    "image": 30.0,
+    "faq": 1.0,
+    "cache": 1.0,
+    "generate": 600.0,
+}
+
+# Parsing a CSV also builds this process' row index for /files/csv lookups,
+# so CSV uploads are always parsed rather than served from the shared cache
+UNCACHED_EXTENSIONS = (".csv",)
+
+# Reported as the profile of answers served from the FAQ index
+FAQ_PROFILE = GenerationProfile(name="faq", model="faq-index", description="Vetted answer from the FAQ index")
+
+
+class ChatResult:
+    """Answer, the profile that produced it and per-stage timings"""
+
+    def __init__(self, response: str, profile: GenerationProfile, stage_timings: Dict[str, float]):
+        self.response = response
+        self.profile = profile
+        self.stage_timings = stage_timings
+
+
+class ChatPipeline:
+    """
+    Preprocessing and generation shared by the HTTP API and job workers
+
+    Owns the Ollama client, audio/file processors, configuration and model
+    router, so `main.py` and `worker.py` process requests identically.
+    """
+
+    def __init__(self, config_store: Optional[ConfigStore] = None):
+        self.config_store = config_store or ConfigStore()
+        self.metrics = Metrics()
+        # Pinned, capped thread pools for ASR and parsing; num_thread for Ollama
+        self.governor = ResourceGovernor(self.config_store.section("governor"), self.metrics)
+        # LLM calls are admitted in weighted fair order across clients
+        fair_queue_settings = self.config_store.section("ratelimit").get("fair_queue", {})
+        self.fair_queue = FairQueue(
+            fair_queue_settings.get("concurrency", self.governor.classes["llm"].concurrency),
+            self.metrics
+        )
+        ollama_settings = self.config_store.section("ollama")
+        self.ollama_client = OllamaClient(
+            base_url=ollama_settings.get("base_url", "http://localhost:11434"),
+            timeout=ollama_settings.get("timeout"),
+            max_retries=ollama_settings.get("max_retries", 2),
+            hedge_urls=ollama_settings.get("hedge_urls"),
+            hedge_percentile=ollama_settings.get("hedge_percentile", 0.95),
+            breaker_threshold=ollama_settings.get("breaker_threshold", 5),
+            breaker_reset=ollama_settings.get("breaker_reset_seconds", 30.0),
+            metrics=self.metrics
+        )
+        self.audio_processor = AudioProcessor(self.governor.executor("asr"))
+        self.file_parser = FileParser(self.governor.executor("parse"))
+        # Photo decoding and resizing is preprocessing too, so it shares the parse pool
+        image_settings = self.config_store.section("images")
+        self.image_processor = ImageProcessor(
+            self.governor.executor("parse"),
+            max_side=image_settings.get("max_side", 768),
+            quality=image_settings.get("quality", 85),
+            cache_entries=image_settings.get("cache_entries", 64)
+        )
+        self.document_store = DocumentStore()
+        # Caches and sessions live in a store shared by all API and worker processes
+        shared_settings = self.config_store.section("shared_state")
+        self.shared_state = open_shared_state(shared_settings)
+        self.parse_cache = SharedCache(
+            self.shared_state, "parsed",
+            ttl=shared_settings.get("parsed", {}).get("ttl_seconds", 604800),
+            max_entries=shared_settings.get("parsed", {}).get("max_entries", 500),
+            metrics=self.metrics
+        )
+        self.transcript_cache = SharedCache(
+            self.shared_state, "transcripts",
+            ttl=shared_settings.get("transcripts", {}).get("ttl_seconds", 604800),
+            max_entries=shared_settings.get("transcripts", {}).get("max_entries", 500),
+            metrics=self.metrics
+        )
+        self.sessions = SessionStore(
+            self.shared_state,
+            ttl=shared_settings.get("sessions", {}).get("ttl_seconds", 86400),
+            max_turns=shared_settings.get("sessions", {}).get("max_turns", 10)
+        )
+        # Curated answers for common questions, re-indexed when the file changes
+        faq_settings = self.config_store.section("faq")
+        self.faq = FaqStore(faq_settings.get("path"), self.metrics)
+        if faq_settings.get("enabled", False):
+            # Build the index now rather than on the first question
+            self.faq.index
+        cache_settings = self.config_store.section("response_cache")
+        self.response_cache = ResponseCache(
+            max_entries=cache_settings.get("max_entries", 2000),
+            ttl=cache_settings.get("ttl_seconds", 86400),
+            metrics=self.metrics,
+            store=self.shared_state
+        )
+        # Every question and answer, written in batches off the request path
+        audit_settings = self.config_store.section("audit_log")
+        self.audit_log = AuditLog(
+            directory=audit_settings.get("directory"),
+            max_queue=audit_settings.get("max_queue", 10000),
+            batch_size=audit_settings.get("batch_size", 500),
+            flush_interval=audit_settings.get("flush_interval_seconds", 2.0),
+            segment_bytes=int(audit_settings.get("segment_mb", 16) * 1024 * 1024),
+            metrics=self.metrics
+        )
+        # Plain questions seen recently, mined by the prewarm scheduler
+        self.prompt_log = PromptLog()
+        # Live requests in flight; background work yields while this is non-zero
+        self.active_requests = 0
+        self.last_request_at = 0.0
+        self.prompt_builder = PromptBuilder(
+            num_ctx=self.ollama_client.num_ctx,
+            num_predict=self.ollama_client.num_predict
+        )
+        self.profiles = ProfileRegistry(
+            self.config_store,
+            defaults={
+                "model": self.ollama_client.model,
+                "num_ctx": self.ollama_client.num_ctx,
+                "num_predict": self.ollama_client.num_predict,
+                "num_thread": self.governor.ollama_num_thread
+            }
+        )
+        self.router = ModelRouter(
+            self.ollama_client, self.profiles, self.prompt_builder, self.config_store, self.metrics
+        )
+
+    def resolve_profile(self, name: Optional[str], route: Optional[str]) -> GenerationProfile:
+        """Profile requested by the caller or configured for the route; KeyError if unknown"""
+        return self.profiles.get(name, route=route)
+
+    def _stage_timeout(self, stage: str) -> Optional[float]:
+        return self.config_store.section("stages").get(stage, DEFAULT_STAGE_TIMEOUTS.get(stage))
+
+    async def _cached_text(self, cache: SharedCache, key: str, compute) -> str:
+        """Text from a shared cache if enabled for it in `shared_state`, else computed; placeholders aren't stored"""
+        if not self.config_store.section("shared_state").get(cache.namespace, {}).get("enabled", True):
+            return await compute()
+        return await cache.get_or_compute(key, compute, cacheable=lambda text: not is_placeholder(text))
+
+    async def parse_file(self, filename: str, content: bytes) -> str:
+        """Parse an upload, reusing text another process already extracted from the same content"""
+        extension = filename.lower().rpartition(".")[2]
+        if f".{extension}" in UNCACHED_EXTENSIONS:
+            return await self.file_parser.parse_file(filename, content)
+        return await self._cached_text(
+            self.parse_cache, content_key(extension, content),
+            lambda: self.file_parser.parse_file(filename, content)
+        )
+
+    async def parse_content(self, content: str) -> str:
+        """Clean up inline text content, shared-cached like parse_file"""
+        return await self._cached_text(
+            self.parse_cache, content_key("inline", content),
+            lambda: self.file_parser.parse_content(content)
+        )
+
+    async def transcribe(self, audio_base64: str) -> str:
+        """Transcribe base64 audio, reusing a transcript of the same recording"""
+        return await self._cached_text(
+            self.transcript_cache, content_key(audio_base64),
+            lambda: self.audio_processor.transcribe_audio_base64(audio_base64)
+        )
+
+    def _generate_stage(
+        self,
+        message: str,
+        request_id: str,
+        profile: GenerationProfile,
+        history: Optional[List[Dict[str, str]]],
+        allow_fast_path: bool,
+        depends_on: List[str],
+        cache_key: Optional[str] = None
+    ) -> Stage:
+        async def generate(results: Dict[str, Any]) -> Tuple[str, GenerationProfile]:
+            faq_match: Optional[FaqMatch] = results.get("faq")
+            if faq_match is not None:
+                return faq_match.entry.answer, FAQ_PROFILE
+            cached = results.get("cache")
+            if cached is not None:
+                logger.info(f"Cached answer for {request_id} ({cached['source']})")
+                return cached["response"], self._cached_profile(cached, profile)
+            contexts = [results[name] for name in ("file", "documents") if results.get(name)]
+            images = [results[name].base64 for name in depends_on if name.startswith("image:") and results.get(name)]
+            async with self.fair_queue.slot(current_client()), self.governor.limit("llm"):
+                response, used_profile = await self.router.reply(
+                    message,
+                    request_id,
+                    profile,
+                    history=history,
+                    file_context="\n\n".join(contexts) or None,
+                    audio_transcript=results.get("asr"),
+                    allow_fast_path=allow_fast_path,
+                    images=images or None
+                )
+            if cache_key is not None:
+                await asyncio.to_thread(self.response_cache.put, cache_key, response, used_profile.name)
+            return response, used_profile
+
+        return Stage("generate", generate, depends_on=depends_on, timeout=self._stage_timeout("generate"))
+
+    def _faq_stage(self, message: str, request_id: str) -> Optional[Stage]:
+        """Lookup of the message in the FAQ index, or None when the index is disabled"""
+        settings = self.config_store.section("faq")
+        if not settings.get("enabled", False):
+            return None
+
+        async def faq(results: Dict[str, Any]) -> Optional[FaqMatch]:
+            match = self.faq.lookup(
+                message,
+                min_confidence=settings.get("min_confidence", DEFAULT_MIN_CONFIDENCE),
+                lexical_weight=settings.get("lexical_weight", 0.5)
+            )
+            if match is not None:
+                logger.info(f"FAQ answer for {request_id}: {match.entry.id} (confidence {match.confidence:.3f})")
+            return match
+
+        return Stage("faq", faq, timeout=self._stage_timeout("faq"), required=False)
+
+    def _cached_profile(self, cached: Dict[str, Any], requested: GenerationProfile) -> GenerationProfile:
+        """Profile that generated a cached answer, or the requested one if it no longer exists"""
+        if cached["profile"] == requested.name:
+            return requested
+        try:
+            return self.profiles.get(cached["profile"])
+        except KeyError:
+            return requested
+
+    def _cache_stage(self, cache_key: str) -> Stage:
+        async def cache(results: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            return await asyncio.to_thread(self.response_cache.get, cache_key)
+
+        return Stage("cache", cache, timeout=self._stage_timeout("cache"), required=False)
+
+    def _audit(self, entry: Dict[str, Any]) -> None:
+        if self.config_store.section("audit_log").get("enabled", False):
+            self.audit_log.record(entry)
+
+    async def _run(self, request_id: str, stages: List[Stage], message: str, route: str,
+                   profile: GenerationProfile, attachments: Optional[List[str]] = None) -> ChatResult:
+        """Run the stage graph, track live traffic and queue an audit log entry"""
+        self.active_requests += 1
+        self.last_request_at = time.time()
+        start_time = time.perf_counter()
+        entry = {
+            "ts": time.time(),
+            "request_id": request_id,
+            "route": route,
+            "client": current_client().label,
+            "message": message,
+            "profile_requested": profile.name,
+        }
+        if attachments:
+            entry["attachments"] = attachments
+        try:
+            results = await StageGraph(stages, self.metrics).run()
+        except StageError as e:
+            self._audit({**entry, "error": str(e.error), "seconds": time.perf_counter() - start_time})
+            if isinstance(e.error, TimeoutError):
+                raise
+            # Surface the original error (e.g. KeyError for unknown documents)
+            raise e.error
+        finally:
+            self.active_requests -= 1
+            self.last_request_at = time.time()
+        timings = results["_timings"]
+        logger.info(f"Stage timings for {request_id}: " + ", ".join(f"{name}={seconds:.3f}s" for name, seconds in timings.items()))
+        response, used_profile = results["generate"]
+        self._audit({
+            **entry,
+            "response": response,
+            "profile": used_profile.name,
+            "transcript": results.get("asr"),
+            "seconds": time.perf_counter() - start_time,
+            "stage_timings": timings,
+        })
+        return ChatResult(response, used_profile, timings)
+
+    async def chat(
+        self,
+        message: str,
+        request_id: str,
+        profile: GenerationProfile,
+        history: Optional[List[Dict[str, str]]] = None,
+        file_content: Optional[str] = None,
+        audio_base64: Optional[str] = None,
+        document_ids: Optional[List[str]] = None,
+        allow_fast_path: bool = True,
+        session_id: Optional[str] = None
+    ) -> ChatResult:
+        """
+        Answer a chat message with optional inline audio, file content and stored documents
+
+        Transcription, file parsing and document loading run concurrently.
+        Audio and file failures or timeouts are logged and the chat continues
+        without them; unknown document ids raise KeyError. Plain questions
+        without history are answered from the FAQ index when it has a
+        confident match, or from the response cache. With a `session_id`,
+        the stored turns of the session come before `history` and the new
+        turn is appended after the answer; the session must belong to the
+        current client, otherwise KeyError is raised.
+        """
+        owner = current_client().id
+        if session_id:
+            stored = await asyncio.to_thread(self.sessions.history, session_id, owner)
+            history = stored + (history or [])
+        stages = []
+
+        if audio_base64:
+            async def asr(results):
+                logger.info(f"Processing audio for request {request_id}")
+                audio_text = await self.transcribe(audio_base64)
+                logger.info(f"Audio transcribed for {request_id}: {audio_text}")
+                return audio_text
+            stages.append(Stage("asr", asr, timeout=self._stage_timeout("asr"), required=False))
+
+        if file_content:
+            async def parse(results):
+                logger.info(f"Processing file content for request {request_id}")
+                parsed_content = await self.parse_content(file_content)
+                logger.info(f"File content parsed for {request_id}")
+                return parsed_content
+            stages.append(Stage("file", parse, timeout=self._stage_timeout("file"), required=False))
+
+        if document_ids:
+            # Previously uploaded documents are already parsed, just load their text
+            async def documents(results):
+                return await asyncio.to_thread(self.document_store.context, document_ids, owner)
+            stages.append(Stage("documents", documents, timeout=self._stage_timeout("documents")))
+
+        cache_key = None
+        if not stages and not history:
+            # Plain questions may already have a vetted or cached answer;
+            # follow-ups and questions about attachments always go to the model
+            self.prompt_log.record(message, profile.name)
+            faq_stage = self._faq_stage(message, request_id) if allow_fast_path else None
+            if faq_stage is not None:
+                stages.append(faq_stage)
+            if self.config_store.section("response_cache").get("enabled", False):
+                cache_key = self.response_cache.key(message, profile.name)
+                stages.append(self._cache_stage(cache_key))
+
+        stages.append(self._generate_stage(
+            message, request_id, profile, history, allow_fast_path, [stage.name for stage in stages],
+            cache_key=cache_key
+        ))
+        result = await self._run(request_id, stages, message, "/chat", profile)
+        if session_id:
+            await asyncio.to_thread(
+                self.sessions.append, session_id, owner,
+                {"role": "user", "content": message},
+                {"role": "assistant", "content": result.response}
+            )
+        return result
+
+    async def chat_with_file(
+        self,
+        message: str,
+        request_id: str,
+        profile: GenerationProfile,
+        filename: str,
+        file_content: bytes,
+        allow_fast_path: bool = True
+    ) -> ChatResult:
+        """Answer a message using an uploaded document as context"""
+        async def parse(results):
+            parsed_content = await self.parse_file(filename, file_content)
+            logger.info(f"File parsed successfully for {request_id}")
+            return parsed_content
+
+        return await self._run(request_id, [
+            Stage("file", parse, timeout=self._stage_timeout("file")),
+            self._generate_stage(message, request_id, profile, None, allow_fast_path, ["file"]),
+        ], message, "/chat/file", profile, attachments=[filename])
+
+    async def chat_with_files(
+        self,
+        message: str,
+        request_id: str,
+        profile: GenerationProfile,
+        files: List[Tuple[str, bytes]],
+        allow_fast_path: bool = True
+    ) -> ChatResult:
+        """
+        Answer a message using several uploaded documents as context
+
+        Identical uploads are parsed once, the files are parsed in parallel and
+        their texts are merged under the `multi_file.max_context_chars` budget.
+        """
+        unique: Dict[str, Tuple[str, bytes]] = {}
+        for filename, content in files:
+            unique.setdefault(hashlib.sha256(content).hexdigest(), (filename, content))
+        if len(unique) < len(files):
+            logger.info(f"Skipped {len(files) - len(unique)} duplicate uploads for {request_id}")
+
+        def parse_stage(name: str, filename: str, content: bytes) -> Stage:
+            async def parse(results):
+                return await self.parse_file(filename, content)
+            return Stage(name, parse, timeout=self._stage_timeout("file"), required=False)
+
+        stages = [
+            parse_stage(f"file:{index}", filename, content)
+            for index, (filename, content) in enumerate(unique.values())
+        ]
+        parse_names = [stage.name for stage in stages]
+        max_chars = self.config_store.section("multi_file").get("max_context_chars", 24000)
+
+        async def merge(results):
+            sections = [
+                (filename, results.get(name) or "[File parsing failed or timed out]")
+                for name, (filename, _) in zip(parse_names, unique.values())
+            ]
+            return self.file_parser.merge_parsed(sections, max_chars)
+
+        stages.append(Stage("file", merge, depends_on=parse_names))
+        stages.append(self._generate_stage(message, request_id, profile, None, allow_fast_path, ["file"]))
+        return await self._run(
+            request_id, stages, message, "/chat/files", profile,
+            attachments=[filename for filename, _ in files]
+        )
+
+    async def chat_with_images(
+        self,
+        message: str,
+        request_id: str,
+        profile: GenerationProfile,
+        images: List[bytes],
+        allow_fast_path: bool = True
+    ) -> ChatResult:
+        """
+        Answer a message about uploaded photos (e.g. a diseased leaf) with a multimodal model
+
+        The photos are downscaled in parallel; any that cannot be decoded
+        fail the request with ValueError.
+        """
+        def image_stage(index: int, content: bytes) -> Stage:
+            async def prepare(results):
+                prepared = await self.image_processor.prepare(content)
+                logger.info(f"Image {index} prepared for {request_id}: {prepared.to_dict()}")
+                return prepared
+            return Stage(f"image:{index}", prepare, timeout=self._stage_timeout("image"))
+
+        stages = [image_stage(index, content) for index, content in enumerate(images)]
+        stages.append(self._generate_stage(
+            message, request_id, profile, None, allow_fast_path, [stage.name for stage in stages]
+        ))
+        return await self._run(
+            request_id, stages, message, "/chat/image", profile,
+            attachments=[stage.name for stage in stages if stage.name.startswith("image:")]
+        )
+
+    async def chat_with_audio(
+        self,
+        message: str,
+        request_id: str,
+        profile: GenerationProfile,
+        audio_content: bytes,
+        allow_fast_path: bool = True
+    ) -> ChatResult:
+        """Answer a message together with the transcription of an uploaded recording"""
+        async def asr(results):
+            audio_base64 = base64.b64encode(audio_content).decode('utf-8')
+            audio_text = await self.transcribe(audio_base64)
+            logger.info(f"Audio transcribed for {request_id}: {audio_text}")
+            return audio_text
+
+        return await self._run(request_id, [
+            Stage("asr", asr, timeout=self._stage_timeout("asr")),
+            self._generate_stage(message, request_id, profile, None, allow_fast_path, ["asr"]),
+        ], message, "/chat/audio", profile)
+
+    async def warm_cache(self, message: str, request_id: str, profile: GenerationProfile) -> str:
+        """
+        Generate an answer into the response cache ahead of demand
+
+        Uses the requested profile directly (no fast path) and does not count
+        as live traffic. It queues for an LLM slot behind every live chat
+        and holds the governor's llm limit like a live request. Cancelling
+        the call abandons the Ollama request.
+        """
+        async with self.fair_queue.slot(PREWARM, background=True), self.governor.limit("llm"):
+            response, used_profile = await self.router.reply(message, request_id, profile, allow_fast_path=False)
+        await asyncio.to_thread(
+            self.response_cache.put, self.response_cache.key(message, profile.name), response, used_profile.name, "prewarm"
+        )
+        return response
@@ -0,0 +1,231 @@
+import asyncio
+import contextvars
+import logging
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.faq_index import DEFAULT_MIN_CONFIDENCE
+from utils.metrics import Metrics
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+# How often a running pre-generation checks for live traffic
+PREEMPT_POLL_SECONDS = 0.05
+
+
+def in_windows(windows: List[str], now: Optional[datetime] = None) -> bool:
+    """Whether the local time falls in one of the "HH:MM-HH:MM" windows (no windows: always)"""
+    if not windows:
+        return True
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    for window in windows:
+        start, _, end = window.partition("-")
+        start_hour, _, start_minute = start.strip().partition(":")
+        end_hour, _, end_minute = end.strip().partition(":")
+        first = int(start_hour) * 60 + int(start_minute or 0)
+        last = int(end_hour) * 60 + int(end_minute or 0)
+        # Windows may wrap around midnight, e.g. "22:00-06:00"
+        if (first <= minute < last) if first <= last else (minute >= first or minute < last):
+            return True
+    return False
+
+
+class PrewarmScheduler:
+    """
+    Fill the response cache with answers to popular questions while idle
+
+    Every `interval_seconds` the scheduler checks for a low-load window: the
+    `prewarm` section is enabled, the local time is inside one of `windows`
+    (if any are set), no live request has run for `quiet_seconds` and system
+    CPU usage is below `idle_cpu_percent`. It then pre-generates answers for
+    the most frequent and trending recent questions plus this month's
+    `seasonal` questions, skipping those with a fresh cache entry or an FAQ
+    answer.
+
+    Pre-generation yields to live traffic: the Ollama call is cancelled as
+    soon as a request starts, and the run stops. `cpu_budget` caps the share
+    of wall time spent generating (0.5 rests as long as each answer took).
+    """
+
+    def __init__(self, pipeline, settings: Callable[[], Dict[str, Any]], metrics: Optional[Metrics] = None):
+        self.pipeline = pipeline
+        self.settings = settings
+        self.metrics = metrics
+        self._task: Optional[asyncio.Task] = None
+        self._manual_task: Optional[asyncio.Task] = None
+        self.running = False
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    def stop(self) -> None:
+        for task in (self._task, self._manual_task):
+            if task is not None:
+                task.cancel()
+
+    def run_now(self) -> None:
+        """
+        Start a run outside the configured windows, in the background
+
+        The task gets a fresh context: created from a request handler it
+        would otherwise inherit that request's deadline and client, and every
+        generation after the deadline would fail. The handle is kept so the
+        task isn't garbage-collected mid-run and is cancelled on shutdown.
+        """
+        self._manual_task = asyncio.get_running_loop().create_task(
+            self.run(check_window=False), context=contextvars.Context()
+        )
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.settings().get("interval_seconds", 60))
+            try:
+                if await self.busy_reason() is None:
+                    await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Prewarm run failed: {e}")
+
+    async def busy_reason(self, check_window: bool = True) -> Optional[str]:
+        """Why pre-generation should not run now, or None when the backend is idle"""
+        settings = self.settings()
+        if not settings.get("enabled", False):
+            return "disabled"
+        if check_window and not in_windows(settings.get("windows", [])):
+            return "outside_window"
+        if self.pipeline.active_requests:
+            return "live_traffic"
+        if time.time() - self.pipeline.last_request_at < settings.get("quiet_seconds", 300):
+            return "recent_traffic"
+        if psutil is not None:
+            cpu_percent = await asyncio.to_thread(psutil.cpu_percent, 0.5)
+            if cpu_percent >= settings.get("idle_cpu_percent", 25):
+                return "cpu_busy"
+        return None
+
+    def candidates(self) -> List[Dict[str, Any]]:
+        """Questions worth pre-generating now, best first"""
+        settings = self.settings()
+        hour = 3600.0
+        trending = self.pipeline.prompt_log.top(
+            history_seconds=settings.get("history_hours", 72) * hour,
+            trend_seconds=settings.get("trend_hours", 6) * hour,
+            min_count=settings.get("min_count", 3),
+            limit=settings.get("max_per_run", 20) * 2
+        )
+        chosen = [{**item, "reason": "trending" if item["trend"] > 1 else "frequent"} for item in trending]
+
+        month = datetime.now().month
+        default_profile = self.pipeline.resolve_profile(None, "/chat").name
+        for season in settings.get("seasonal", []):
+            if month in season.get("months", []):
+                chosen.extend(
+                    {"message": question, "profile": season.get("profile", default_profile), "reason": "seasonal"}
+                    for question in season.get("questions", [])
+                )
+
+        cache = self.pipeline.response_cache
+        refresh_after = cache.ttl * settings.get("refresh_fraction", 0.25)
+        faq_settings = self.pipeline.config_store.section("faq")
+        result, seen = [], set()
+        for item in chosen:
+            key = cache.key(item["message"], item["profile"])
+            if key in seen:
+                continue
+            seen.add(key)
+            remaining = cache.expires_in(key)
+            if remaining is not None and remaining > refresh_after:
+                continue
+            if faq_settings.get("enabled", False):
+                matches = self.pipeline.faq.index.search(item["message"], limit=1)
+                if matches and matches[0].confidence >= faq_settings.get("min_confidence", DEFAULT_MIN_CONFIDENCE):
+                    continue
+            result.append(item)
+        return result[:settings.get("max_per_run", 20)]
+
+    async def _generate(self, item: Dict[str, Any]) -> bool:
+        """Pre-generate one answer; False if live traffic preempted it"""
+        profile = self.pipeline.resolve_profile(item["profile"], "/chat")
+        request_id = f"prewarm-{int(time.time() * 1000)}"
+        task = asyncio.ensure_future(self.pipeline.warm_cache(item["message"], request_id, profile))
+        while not task.done():
+            await asyncio.wait({task}, timeout=PREEMPT_POLL_SECONDS)
+            if not task.done() and self.pipeline.active_requests:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                return False
+        task.result()
+        return True
+
+    async def run(self, check_window: bool = True) -> Dict[str, Any]:
+        """Pre-generate answers until the candidates run out or live traffic arrives"""
+        if self.running:
+            return {"status": "already_running"}
+        self.running = True
+        started_at = time.time()
+        candidates: List[Dict[str, Any]] = []
+        generated, failed, stopped = 0, 0, None
+        try:
+            candidates = self.candidates()
+            budget = min(1.0, max(0.05, self.settings().get("cpu_budget", 0.5)))
+            for index, item in enumerate(candidates):
+                if index:
+                    stopped = await self.busy_reason(check_window)
+                    if stopped is not None:
+                        break
+                start_time = time.perf_counter()
+                try:
+                    completed = await self._generate(item)
+                except Exception as e:
+                    failed += 1
+                    logger.warning(f"Prewarm of {item['message'][:60]!r} failed: {e}")
+                    completed = None
+                elapsed = time.perf_counter() - start_time
+                if self.metrics is not None:
+                    self.metrics.observe("prewarm_generation_seconds", elapsed)
+                if completed is False:
+                    stopped = "preempted"
+                    if self.metrics is not None:
+                        self.metrics.increment("prewarm_preempted_total")
+                    break
+                if completed:
+                    generated += 1
+                    if self.metrics is not None:
+                        self.metrics.increment("prewarm_generated_total", labels={"reason": item["reason"]})
+                # Stay within the CPU budget; live requests don't wait for this sleep
+                await asyncio.sleep(elapsed * (1 / budget - 1))
+        finally:
+            self.running = False
+        self.last_run = {
+            "started_at": started_at,
+            "duration": time.time() - started_at,
+            "candidates": len(candidates),
+            "generated": generated,
+            "failed": failed,
+            "stopped": stopped,
+        }
+        if candidates:
+            logger.info(f"Prewarm run: {self.last_run}")
+        return self.last_run
+
+    def status(self) -> Dict[str, Any]:
+        """Scheduler state with response cache stats; queries the store, so call it off the event loop"""
+        return {
+            "enabled": self.settings().get("enabled", False),
+            "running": self.running,
+            "last_run": self.last_run,
+            "prompt_log": len(self.pipeline.prompt_log),
+            "cache": self.pipeline.response_cache.stats(),
+        }
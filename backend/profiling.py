@@ -0,0 +1,347 @@
+"""
+On-demand diagnostics for the API process
+
+Everything here is off unless switched on, so the normal request path pays
+nothing for it:
+
+- SamplingProfiler / ProfilingMiddleware: sample every thread's stack while a
+  single request runs, triggered by an `X-Profile: 1` header together with a
+  valid `X-Admin-Token`. Results are kept in memory in folded-stack format
+  (one `thread;frame;frame count` line per stack, ready for flamegraph tools).
+- LoopLagMonitor: a watchdog thread that notices when the event loop stops
+  ticking and logs the stack that is blocking it.
+- MemoryTracer: tracemalloc snapshots and diffs.
+
+Admin features require KANGTANI_ADMIN_TOKEN to be set.
+"""
+
+import asyncio
+import collections
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+import uuid
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TOKEN_ENV = "KANGTANI_ADMIN_TOKEN"
+
+
+def admin_token() -> Optional[str]:
+    """Configured admin token, or None when admin features are disabled"""
+    return os.getenv(ADMIN_TOKEN_ENV) or None
+
+
+def check_admin_token(token: Optional[str]) -> bool:
+    expected = admin_token()
+    return expected is not None and token is not None and hmac.compare_digest(token, expected)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _folded_stack(frame) -> Tuple[str, ...]:
+    """Frames of a stack, outermost first"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return tuple(reversed(names))
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler sampling all thread stacks from a background thread
+
+    Unlike cProfile this sees time spent in worker threads (Whisper, PDF
+    parsing) and in blocking calls on the event loop, and costs nothing
+    outside start()/stop().
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: Dict[Tuple[str, ...], int] = collections.Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started_at = 0.0
+        self.duration = 0.0
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                thread_name = names.get(thread_id, str(thread_id))
+                self.samples[(thread_name,) + _folded_stack(frame)] += 1
+            self.sample_count += 1
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def folded(self) -> str:
+        """Collapsed stacks, one `frame;frame;frame count` line each"""
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.samples.items())
+
+    def report(self, limit: int = 20) -> Dict[str, Any]:
+        """Summary with the hottest stacks and functions"""
+        leaf_counts: Dict[str, int] = collections.Counter()
+        for stack, count in self.samples.items():
+            leaf_counts[f"{stack[0]}: {stack[-1]}" if len(stack) > 1 else stack[0]] += count
+        return {
+            "duration": self.duration,
+            "interval": self.interval,
+            "samples": self.sample_count,
+            "top_functions": [
+                {"function": name, "samples": count}
+                for name, count in sorted(leaf_counts.items(), key=lambda item: -item[1])[:limit]
+            ],
+            "top_stacks": [
+                {"stack": list(stack), "samples": count}
+                for stack, count in sorted(self.samples.items(), key=lambda item: -item[1])[:limit]
+            ],
+        }
+
+
+class ProfileStore:
+    """The most recent request profiles, by request id"""
+
+    def __init__(self, max_profiles: int = 20):
+        self.profiles: "collections.OrderedDict[str, Dict[str, Any]]" = collections.OrderedDict()
+        self.max_profiles = max_profiles
+        self.lock = threading.Lock()
+
+    def add(self, request_id: str, path: str, profiler: SamplingProfiler) -> None:
+        with self.lock:
+            self.profiles[request_id] = {
+                "request_id": request_id,
+                "path": path,
+                "created_at": time.time(),
+                **profiler.report(),
+                "folded": profiler.folded(),
+            }
+            while len(self.profiles) > self.max_profiles:
+                self.profiles.popitem(last=False)
+
+    def get(self, request_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return self.profiles.get(request_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [
+                {key: profile[key] for key in ("request_id", "path", "created_at", "duration", "samples")}
+                for profile in self.profiles.values()
+            ]
+
+
+class ProfilingMiddleware:
+    """
+    Profile a request when it carries `X-Profile: 1` and a valid `X-Admin-Token`
+
+    Must run inside RequestContextMiddleware so the profile is stored under the
+    request id; the response gets an `X-Profile-ID` header to fetch it from
+    `/admin/profiles/{id}`. Other requests only pay for one header scan.
+    """
+
+    def __init__(self, app, store: ProfileStore, interval: float = 0.005):
+        self.app = app
+        self.store = store
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile") not in (b"1", b"true") or not check_admin_token(
+            headers.get(b"x-admin-token", b"").decode("latin-1")
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        request_id = scope.get("state", {}).get("request_id") or str(uuid.uuid4())
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", request_id.encode("latin-1"))]}
+            await send(message)
+
+        profiler = SamplingProfiler(self.interval)
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            self.store.add(request_id, scope.get("path", ""), profiler)
+            logger.info(f"Profiled request {request_id}: {profiler.sample_count} samples over {profiler.duration:.3f}s")
+
+
+class LoopLagMonitor:
+    """
+    Detect event loop stalls and log the stack that causes them
+
+    A heartbeat task on the loop records when it last ran; a watchdog thread
+    checks it every `interval` seconds. If the loop has not ticked for longer
+    than `threshold`, the watchdog captures the loop thread's current stack,
+    i.e. the callback that is blocking it, and logs it once per stall.
+
+    Args:
+        threshold: Seconds of lag that count as a stall
+        interval: Heartbeat and watchdog period in seconds
+        on_stall: Optional callback receiving the stall duration in seconds
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.02,
+                 on_stall: Optional[Callable[[float], None]] = None):
+        self.threshold = threshold
+        self.interval = interval
+        self.on_stall = on_stall
+        self.last_beat = time.monotonic()
+        self.stalls = 0
+        self.max_lag = 0.0
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            self.last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self) -> None:
+        stall_beat = None
+        stall_stack = None
+        while not self._stop.wait(self.interval):
+            beat = self.last_beat
+            lag = time.monotonic() - beat - self.interval
+            if lag > self.threshold and stall_beat != beat:
+                # New stall: grab the blocking stack while it is still running
+                stall_beat = beat
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stall_stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>"
+            elif stall_beat is not None and stall_beat != beat:
+                # The loop ticked again; report how long it was blocked
+                stalled_for = beat - stall_beat - self.interval
+                self.stalls += 1
+                self.max_lag = max(self.max_lag, stalled_for)
+                logger.warning(f"Event loop blocked for {stalled_for:.3f}s (threshold {self.threshold:.3f}s), blocking stack:\n{stall_stack}")
+                if self.on_stall is not None:
+                    self.on_stall(stalled_for)
+                stall_beat = stall_stack = None
+
+    def start(self) -> None:
+        """Start monitoring the running event loop"""
+        self._loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Event loop lag monitor started (threshold {self.threshold * 1000:.0f}ms)")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "threshold": self.threshold,
+            "current_lag": max(0.0, time.monotonic() - self.last_beat - self.interval),
+            "stalls": self.stalls,
+            "max_lag": self.max_lag,
+        }
+
+
+class MemoryTracer:
+    """tracemalloc snapshots kept in memory and compared on demand"""
+
+    def __init__(self, max_snapshots: int = 5):
+        self.snapshots: Deque[Tuple[str, float, tracemalloc.Snapshot]] = collections.deque(maxlen=max_snapshots)
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 25) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            logger.info(f"tracemalloc started ({frames} frames)")
+
+    def stop(self) -> None:
+        tracemalloc.stop()
+        self.snapshots.clear()
+        logger.info("tracemalloc stopped")
+
+    def _find(self, snapshot_id: str) -> tracemalloc.Snapshot:
+        for stored_id, _, snapshot in self.snapshots:
+            if stored_id == snapshot_id:
+                return snapshot
+        raise KeyError(f"Unknown snapshot: {snapshot_id}")
+
+    @staticmethod
+    def _stats(stats, limit: int) -> List[Dict[str, Any]]:
+        return [
+            {
+                "location": str(stat.traceback[0]) if stat.traceback else "?",
+                "size": stat.size,
+                "count": stat.count,
+                **({"size_diff": stat.size_diff, "count_diff": stat.count_diff} if hasattr(stat, "size_diff") else {}),
+            }
+            for stat in stats[:limit]
+        ]
+
+    def snapshot(self, limit: int = 20) -> Dict[str, Any]:
+        """Take and keep a snapshot; RuntimeError if tracing is off"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        snapshot_id = uuid.uuid4().hex[:12]
+        self.snapshots.append((snapshot_id, time.time(), snapshot))
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "snapshot_id": snapshot_id,
+            "traced_current": current,
+            "traced_peak": peak,
+            "top": self._stats(snapshot.statistics("lineno"), limit),
+        }
+
+    def diff(self, base_id: str, target_id: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        """Allocation growth between two snapshots (target defaults to a new one)"""
+        base = self._find(base_id)
+        if target_id is None:
+            target_id = self.snapshot(limit=0)["snapshot_id"]
+        target = self._find(target_id)
+        stats = target.compare_to(base, "lineno")
+        return {
+            "base": base_id,
+            "target": target_id,
+            "size_diff": sum(stat.size_diff for stat in stats),
+            "top": self._stats(stats, limit),
+        }
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [{"snapshot_id": snapshot_id, "created_at": created_at} for snapshot_id, created_at, _ in self.snapshots]
@@ -0,0 +1,248 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Rough per-message overhead of the chat template (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+TRUNCATION_MARKER = "\n[... truncated ...]\n"
+
+_APPROX_TOKEN = re.compile(r"\w{1,4}|[^\w\s]")
+
+
+class TokenCounter:
+    """
+    Count tokens with the model's tokenizer, caching results per string
+
+    Uses a HuggingFace `tokenizers` tokenizer when one is configured through
+    `KANGTANI_TOKENIZER` (a tokenizer.json path or hub id), otherwise falls
+    back to a sub-word approximation that errs on the high side. The cache
+    is keyed by a SHA-1 of the text, so it never keeps large documents alive.
+    """
+
+    def __init__(self, tokenizer_name: Optional[str] = None, cache_size: int = 4096):
+        self.tokenizer_name = tokenizer_name or os.getenv("KANGTANI_TOKENIZER")
+        self.tokenizer = self._load_tokenizer(self.tokenizer_name)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load_tokenizer(self, name: Optional[str]):
+        if not name:
+            return None
+        try:
+            from tokenizers import Tokenizer
+            if os.path.exists(name):
+                tokenizer = Tokenizer.from_file(name)
+            else:
+                tokenizer = Tokenizer.from_pretrained(name)
+            logger.info(f"Loaded tokenizer {name} for prompt budgeting")
+            return tokenizer
+        except ImportError:
+            logger.warning("tokenizers not available, using approximate token counts. Install with: pip install tokenizers")
+        except Exception as e:
+            logger.warning(f"Failed to load tokenizer {name}, using approximate token counts: {e}")
+        return None
+
+    def _count(self, text: str) -> int:
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        return len(_APPROX_TOKEN.findall(text))
+
+    def count(self, text: str, cache: bool = True) -> int:
+        """
+        Number of tokens in `text`
+
+        Pass `cache=False` for one-off strings, such as truncation
+        candidates, that would only push useful entries out of the cache.
+        """
+        if not text:
+            return 0
+        if not cache:
+            return self._count(text)
+        key = hashlib.sha1(text.encode("utf-8", "surrogatepass")).digest()
+        with self._lock:
+            tokens = self._cache.get(key)
+            if tokens is not None:
+                self._cache.move_to_end(key)
+                return tokens
+        tokens = self._count(text)
+        with self._lock:
+            self._cache[key] = tokens
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tokens
+
+
+class PromptPlan:
+    """Result of prompt assembly: the pieces to send plus their token costs"""
+
+    def __init__(self, system_prompt: str, user_content: str, history: List[Dict[str, str]],
+                 token_counts: Dict[str, int], truncated: List[str], num_ctx: int, num_predict: int):
+        self.system_prompt = system_prompt
+        self.user_content = user_content
+        self.history = history
+        self.token_counts = token_counts
+        self.truncated = truncated
+        self.num_ctx = num_ctx
+        self.num_predict = num_predict
+
+    @property
+    def prompt_tokens(self) -> int:
+        return sum(self.token_counts.values())
+
+
+class PromptBuilder:
+    """
+    Assemble chat prompts that fit the model context window
+
+    The context window (`num_ctx`) minus the reserved generation length
+    (`num_predict`) is shared between the system prompt, the user message,
+    the audio transcript, file context and conversation history. Each part
+    is capped at a share of the budget; budget a part does not need is
+    passed on to the parts after it.
+    """
+
+    # Maximum share of the prompt budget per part, allocated in this order
+    SHARES = (
+        ("system", 0.20),
+        ("message", 0.25),
+        ("audio", 0.15),
+        ("file", 0.70),
+        ("history", 1.00),
+    )
+
+    def __init__(self, num_ctx: int = 4096, num_predict: int = 1024, counter: Optional[TokenCounter] = None):
+        self.num_ctx = num_ctx
+        self.num_predict = num_predict
+        self.counter = counter or TokenCounter()
+
+    def build(
+        self,
+        message: str,
+        system_prompt: str,
+        history: Optional[List[Dict[str, str]]] = None,
+        file_context: Optional[str] = None,
+        audio_transcript: Optional[str] = None,
+        num_ctx: Optional[int] = None,
+        num_predict: Optional[int] = None,
+    ) -> PromptPlan:
+        """
+        Fit all prompt parts into the context window
+
+        Args:
+            message: User message
+            system_prompt: System prompt
+            history: Earlier turns as {"role", "content"} dicts, oldest first
+            file_context: Extracted document text
+            audio_transcript: Transcribed audio
+            num_ctx: Context window override
+            num_predict: Generation length override
+
+        Returns:
+            PromptPlan with (possibly truncated) parts and token counts
+        """
+        num_ctx = num_ctx or self.num_ctx
+        num_predict = num_predict or self.num_predict
+        history = history or []
+        # System and user messages plus every history turn carry template overhead
+        overhead = MESSAGE_OVERHEAD_TOKENS * (2 + len(history))
+        available = max(num_ctx - num_predict - overhead, 64)
+
+        parts = {
+            "system": system_prompt or "",
+            "message": message or "",
+            "audio": audio_transcript or "",
+            "file": file_context or "",
+        }
+        needs = {name: self.counter.count(text) for name, text in parts.items()}
+        needs["history"] = sum(self.counter.count(turn["content"]) for turn in history)
+
+        remaining = available
+        budgets = {}
+        for name, share in self.SHARES:
+            budgets[name] = min(needs[name], int(available * share), remaining)
+            remaining -= budgets[name]
+        # Hand unused budget back to file context, the part most likely to be cut
+        if remaining > 0 and budgets["file"] < needs["file"]:
+            extra = min(remaining, needs["file"] - budgets["file"])
+            budgets["file"] += extra
+            remaining -= extra
+
+        truncated = []
+        fitted = {}
+        for name, text in parts.items():
+            fitted[name] = self.fit(text, budgets[name])
+            if fitted[name] != text:
+                truncated.append(name)
+
+        kept_history = self._fit_history(history, budgets["history"])
+        if len(kept_history) < len(history):
+            truncated.append("history")
+
+        user_content = fitted["message"]
+        if fitted["audio"]:
+            user_content = f"{user_content} [Audio: {fitted['audio']}]"
+        if fitted["file"]:
+            user_content = f"{user_content}\n\nFile Context:\n{fitted['file']}"
+
+        token_counts = {name: self.counter.count(text) for name, text in fitted.items()}
+        token_counts["history"] = sum(self.counter.count(turn["content"]) for turn in kept_history)
+
+        if truncated:
+            logger.info(f"Prompt parts truncated to fit num_ctx={num_ctx}: {truncated} (needs: {needs}, budgets: {budgets})")
+
+        return PromptPlan(
+            system_prompt=fitted["system"],
+            user_content=user_content,
+            history=kept_history,
+            token_counts=token_counts,
+            truncated=truncated,
+            num_ctx=num_ctx,
+            num_predict=num_predict,
+        )
+
+    def fit(self, text: str, budget: int) -> str:
+        """
+        Shrink `text` to at most `budget` tokens
+
+        Whitespace is compressed first; if that is not enough, the middle of
+        the text is cut, keeping the head and the tail.
+        """
+        if not text or self.counter.count(text) <= budget:
+            return text
+        if budget <= 0:
+            return ""
+
+        text = "\n".join(" ".join(line.split()) for line in text.splitlines() if line.strip())
+        tokens = self.counter.count(text, cache=False)
+        if tokens <= budget:
+            return text
+
+        marker_tokens = self.counter.count(TRUNCATION_MARKER)
+        chars_per_token = len(text) / tokens
+        keep = int((budget - marker_tokens) * chars_per_token)
+        while keep > 0:
+            head = int(keep * 2 / 3)
+            candidate = text[:head] + TRUNCATION_MARKER + text[len(text) - (keep - head):]
+            if self.counter.count(candidate, cache=False) <= budget:
+                return candidate
+            keep = int(keep * 0.9)
+        return text[:max(int(budget * chars_per_token), 0)]
+
+    def _fit_history(self, history: List[Dict[str, str]], budget: int) -> List[Dict[str, str]]:
+        """Keep the most recent turns that fit in `budget`"""
+        kept = []
+        for turn in reversed(history):
+            cost = self.counter.count(turn["content"])
+            if cost > budget:
+                break
+            kept.append(turn)
+            budget -= cost
+        kept.reverse()
+        return kept
@@ -0,0 +1,412 @@
+"""
+Per-client rate limiting and fair scheduling of LLM calls
+
+- Clients are identified by an `X-API-Key` listed in the `ratelimit.api_keys`
+  config, otherwise by IP address (`X-Forwarded-For` only when
+  `trust_forwarded_for` is set).
+- RateLimitMiddleware charges each request on a limited path against two
+  token buckets per client: requests, and estimated LLM tokens (from the
+  request size plus an expected completion). Over-limit requests get a 429
+  with `Retry-After`. Buckets live in memory, or in a SQLite file shared by
+  all API processes when `ratelimit.store` is set.
+- FairQueue admits LLM calls in weighted fair order across clients, so a
+  client flooding the server only delays its own requests.
+
+The middleware stores the caller in a context variable (`current_client`)
+that follows the request into the pipeline.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager, closing, contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils import fast_json
+from utils.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = {
+    "requests_per_minute": 30,
+    "burst_requests": 10,
+    "tokens_per_minute": 60000,
+    "weight": 1.0,
+}
+DEFAULT_ESTIMATE = {"chars_per_token": 4, "max_prompt_tokens": 8192, "completion_tokens": 512}
+DEFAULT_PATHS = ["/chat", "/jobs"]
+
+
+class ClientInfo:
+    """Who is calling, their fair-share weight and the estimated cost of the request"""
+
+    def __init__(self, client_id: str, label: str, weight: float = 1.0, estimated_tokens: int = 0,
+                 limits: Optional[Dict[str, Any]] = None):
+        self.id = client_id
+        # Metric label: the API key's name, or "ip" so addresses don't explode label cardinality
+        self.label = label
+        self.weight = weight
+        self.estimated_tokens = estimated_tokens
+        self.limits = limits or DEFAULT_LIMITS
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "label": self.label, "weight": self.weight, "estimated_tokens": self.estimated_tokens}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ClientInfo":
+        return cls(data["id"], data.get("label", "ip"), data.get("weight", 1.0), data.get("estimated_tokens", 0))
+
+
+ANONYMOUS = ClientInfo("anonymous", "anonymous")
+
+# Background cache prewarming; queued with `background=True`, so it only
+# gets LLM slots that no live client is waiting for
+PREWARM = ClientInfo("prewarm", "prewarm")
+
+_current_client: ContextVar[ClientInfo] = ContextVar("client", default=ANONYMOUS)
+
+
+def current_client() -> ClientInfo:
+    return _current_client.get()
+
+
+@contextmanager
+def client_scope(client: ClientInfo):
+    """Attribute the work in the block to `client` (used by job workers)"""
+    token = _current_client.set(client)
+    try:
+        yield
+    finally:
+        _current_client.reset(token)
+
+
+def _charge(charges: List[Tuple[str, float, float, float]], levels: Dict[str, Tuple[float, float]],
+            now: float) -> Tuple[float, Optional[str], Dict[str, float]]:
+    """Refill buckets to `now` and deduct the charges if every bucket can afford them"""
+    refilled = {}
+    wait, blocked = 0.0, None
+    for key, rate, capacity, amount in charges:
+        tokens, updated = levels[key]
+        refilled[key] = min(capacity, tokens + (now - updated) * rate)
+        if refilled[key] < amount:
+            key_wait = (amount - refilled[key]) / rate if rate > 0 else float("inf")
+            if key_wait > wait:
+                wait, blocked = key_wait, key
+    if blocked is None:
+        for key, _, _, amount in charges:
+            refilled[key] -= amount
+    return wait, blocked, refilled
+
+
+class MemoryBucketStore:
+    """Token buckets in this process"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, charges: List[Tuple[str, float, float, float]], now: float) -> Tuple[float, Optional[str]]:
+        """
+        Take `amount` from every bucket, or from none of them
+
+        Args:
+            charges: (key, rate per second, capacity, amount) per bucket
+            now: Current time
+
+        Returns:
+            (0, None) if all buckets had enough, otherwise the seconds until
+            they will and the key of the emptiest bucket
+        """
+        with self._lock:
+            levels = {key: self._buckets.get(key, (capacity, now)) for key, _, capacity, _ in charges}
+            wait, blocked, levels = _charge(charges, levels, now)
+            self._buckets.update((key, (tokens, now)) for key, tokens in levels.items())
+            if len(self._buckets) > 50000:
+                # Buckets untouched for 10 minutes are full again; dropping them changes nothing
+                self._buckets = {key: value for key, value in self._buckets.items() if value[1] > now - 600}
+            return wait, blocked
+
+    def levels(self, limit: int = 100) -> Dict[str, float]:
+        with self._lock:
+            return {key: tokens for key, (tokens, _) in itertools.islice(self._buckets.items(), limit)}
+
+
+class SqliteBucketStore:
+    """Token buckets in a SQLite file shared by several API processes"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def take(self, charges: List[Tuple[str, float, float, float]], now: float) -> Tuple[float, Optional[str]]:
+        """Same contract as MemoryBucketStore.take, atomic across processes"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = {}
+            for key, _, capacity, _ in charges:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                levels[key] = tuple(row) if row else (capacity, now)
+            wait, blocked, levels = _charge(charges, levels, now)
+            conn.executemany(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                [(key, tokens, now) for key, tokens in levels.items()]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait, blocked
+
+    def levels(self, limit: int = 100) -> Dict[str, float]:
+        rows = self._conn().execute("SELECT key, tokens FROM buckets ORDER BY updated DESC LIMIT ?", (limit,))
+        return {key: tokens for key, tokens in rows}
+
+
+class RateLimiter:
+    """
+    Identify clients and charge their request and token buckets
+
+    Args:
+        settings: Callable returning the current `ratelimit` config section
+        metrics: Metrics to record decisions in
+    """
+
+    def __init__(self, settings: Callable[[], Dict[str, Any]], metrics: Optional[Metrics] = None):
+        self.settings = settings
+        self.metrics = metrics
+        store_path = settings().get("store")
+        self.store = SqliteBucketStore(store_path) if store_path else MemoryBucketStore()
+
+    def identify(self, headers: Dict[bytes, bytes], client_addr: Optional[Tuple[str, int]]) -> Optional[ClientInfo]:
+        """Client of a request; None if an API key is required and missing or unknown"""
+        settings = self.settings()
+        api_key = headers.get(b"x-api-key", b"").decode("latin-1").strip()
+        known = settings.get("api_keys", {})
+        defaults = {**DEFAULT_LIMITS, **settings.get("default", {})}
+        if api_key and api_key in known:
+            limits = {**defaults, **known[api_key]}
+            # Never put the key itself into ids, logs or metric labels
+            name = limits.get("name") or hashlib.sha256(api_key.encode()).hexdigest()[:12]
+            return ClientInfo(f"key:{name}", name, limits["weight"], limits=limits)
+        if settings.get("require_api_key", False):
+            return None
+
+        address = client_addr[0] if client_addr else "unknown"
+        if settings.get("trust_forwarded_for", False) and b"x-forwarded-for" in headers:
+            # The right-most hop was added by our own proxy; anything left of it is client-supplied
+            address = headers[b"x-forwarded-for"].decode("latin-1").split(",")[-1].strip() or address
+        return ClientInfo(f"ip:{address}", "ip", defaults["weight"], limits=defaults)
+
+    def estimate_tokens(self, content_length: int) -> int:
+        """Prompt tokens implied by the request body (capped at the context size) plus a completion"""
+        estimate = {**DEFAULT_ESTIMATE, **self.settings().get("estimate", {})}
+        prompt = min(content_length / estimate["chars_per_token"], estimate["max_prompt_tokens"])
+        return int(prompt + estimate["completion_tokens"])
+
+    def check_sync(self, client: ClientInfo) -> Tuple[float, str]:
+        """Charge one request and its estimated tokens; returns (retry after seconds, bucket that ran out)"""
+        limits = client.limits
+        token_capacity = limits.get("burst_tokens", limits["tokens_per_minute"])
+        # A single request larger than the whole bucket could never pass; charge it the full bucket instead
+        tokens = min(client.estimated_tokens, token_capacity)
+        wait, blocked = self.store.take([
+            (f"{client.id}:requests", limits["requests_per_minute"] / 60, limits["burst_requests"], 1),
+            (f"{client.id}:tokens", limits["tokens_per_minute"] / 60, token_capacity, tokens),
+        ], time.time())
+        return wait, blocked.rsplit(":", 1)[1] if blocked else ""
+
+    async def check(self, client: ClientInfo) -> Tuple[float, str]:
+        if isinstance(self.store, SqliteBucketStore):
+            wait, bucket = await asyncio.to_thread(self.check_sync, client)
+        else:
+            wait, bucket = self.check_sync(client)
+        if self.metrics is not None:
+            outcome = f"limited_{bucket}" if wait else "allowed"
+            self.metrics.increment("ratelimit_requests_total", labels={"client": client.label, "outcome": outcome})
+            if not wait:
+                self.metrics.increment("ratelimit_estimated_tokens_total", client.estimated_tokens, labels={"client": client.label})
+        return wait, bucket
+
+    def usage(self) -> Dict[str, Any]:
+        return {"store": "sqlite" if isinstance(self.store, SqliteBucketStore) else "memory", "buckets": self.store.levels()}
+
+
+def _json_response(status: int, body: Dict[str, Any], headers: List[Tuple[bytes, bytes]]):
+    payload = fast_json.dumps(body)
+    return [
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())] + headers,
+        },
+        {"type": "http.response.body", "body": payload},
+    ]
+
+
+class RateLimitMiddleware:
+    """
+    Identify the caller and enforce their limits on `ratelimit.paths`
+
+    Pure ASGI like the other middlewares. Requests outside the limited paths
+    (health checks, metrics, admin) are never charged but still carry the
+    client in `current_client()`.
+    """
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        settings = self.limiter.settings()
+        if not settings.get("enabled", False) or scope.get("method") == "OPTIONS":
+            # CORS preflights carry no API key and do no work; never reject or charge them
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        client = self.limiter.identify(headers, scope.get("client"))
+        if client is None:
+            for message in _json_response(401, {"error": "A valid X-API-Key header is required"}, []):
+                await send(message)
+            return
+
+        path = scope.get("path", "")
+        if any(path.startswith(prefix) for prefix in settings.get("paths", DEFAULT_PATHS)):
+            try:
+                content_length = int(headers.get(b"content-length", b"0"))
+            except ValueError:
+                content_length = 0
+            client.estimated_tokens = self.limiter.estimate_tokens(content_length)
+            wait, bucket = await self.limiter.check(client)
+            if wait:
+                retry_after = max(1, int(wait + 0.999)) if wait != float("inf") else 3600
+                logger.warning(f"Rate limited {client.id} on {path}: {bucket} bucket empty, retry after {retry_after}s")
+                body = {"error": f"Rate limit exceeded ({bucket})", "client": client.label, "retry_after": retry_after}
+                for message in _json_response(429, body, [(b"retry-after", str(retry_after).encode())]):
+                    await send(message)
+                return
+
+        with client_scope(client):
+            await self.app(scope, receive, send)
+
+
+class FairQueue:
+    """
+    Weighted fair queuing of LLM calls across clients
+
+    Start-time fair queuing: each call gets a virtual start tag of
+    max(virtual time, the client's previous finish tag) and a finish tag
+    cost/weight later; free slots go to the waiting call with the smallest
+    start tag. A client with many queued calls therefore takes turns with
+    everyone else instead of holding the queue, and a client with weight 2
+    gets twice the share. Background calls (`slot(..., background=True)`)
+    wait behind every other call and take no part in the virtual clock.
+    `concurrency` 0 disables queuing.
+    """
+
+    def __init__(self, concurrency: int, metrics: Optional[Metrics] = None):
+        self.concurrency = concurrency
+        self.metrics = metrics
+        self.active = 0
+        self.virtual_time = 0.0
+        self._finish: Dict[str, float] = {}
+        # (background, start tag, sequence, future, client id)
+        self._waiting: List[Tuple[bool, float, int, asyncio.Future, str]] = []
+        self._sequence = itertools.count()
+
+    def _tag(self, client: str, weight: float, cost: float) -> float:
+        start = max(self.virtual_time, self._finish.get(client, 0.0))
+        self._finish[client] = start + cost / max(weight, 0.01)
+        if len(self._finish) > 10000:
+            # Clients whose finish tag is behind the virtual clock have no pending credit
+            self._finish = {key: tag for key, tag in self._finish.items() if tag > self.virtual_time}
+        return start
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for entry in self._waiting if not entry[3].cancelled())
+
+    def _release(self) -> None:
+        self.active -= 1
+        while self._waiting and self.active < self.concurrency:
+            background, start, _, future, _ = heapq.heappop(self._waiting)
+            if future.cancelled():
+                continue
+            if not background:
+                self.virtual_time = max(self.virtual_time, start)
+            self.active += 1
+            future.set_result(None)
+        self._set_gauge()
+
+    def _set_gauge(self) -> None:
+        if self.metrics is not None:
+            self.metrics.set_gauge("fair_queue_waiting", self.waiting)
+
+    @asynccontextmanager
+    async def slot(self, client: ClientInfo, background: bool = False):
+        """Wait for the client's turn, then hold an LLM slot for the block"""
+        if self.concurrency <= 0:
+            yield
+            return
+        start_time = time.perf_counter()
+        if background:
+            start = 0.0
+        else:
+            # Cost in thousands of estimated tokens, at least one unit per call
+            start = self._tag(client.id, client.weight, max(1.0, client.estimated_tokens / 1000))
+        if self.active < self.concurrency and not self._waiting:
+            if not background:
+                self.virtual_time = max(self.virtual_time, start)
+            self.active += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiting, (background, start, next(self._sequence), future, client.id))
+            self._set_gauge()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was granted just as the caller gave up
+                    self._release()
+                else:
+                    future.cancel()
+                    self._set_gauge()
+                raise
+        if self.metrics is not None:
+            self.metrics.observe("fair_queue_wait_seconds", time.perf_counter() - start_time, labels={"client": client.label})
+        try:
+            yield
+        finally:
+            self._release()
+
+    def status(self) -> Dict[str, Any]:
+        waiting: Dict[str, int] = {}
+        for _, _, _, future, client in self._waiting:
+            if not future.cancelled():
+                waiting[client] = waiting.get(client, 0) + 1
+        return {"concurrency": self.concurrency, "active": self.active, "waiting": waiting}
@@ -0,0 +1,332 @@
+"""
+Continuous resource time series, joined with request latencies
+
+ResourceRecorder samples the API process once per `interval_seconds`: CPU,
+RSS, event loop lag, governor backlogs, the fair queue, the job queue and
+what Ollama has loaded (`/api/ps`). Samples go into a fixed-size columnar
+ring buffer (one float array per column, 8 bytes per value, so an hour of
+one-second samples is a few hundred KiB). The request context middleware
+reports every finished request, and `slow_requests` lines each slow
+request up with the samples taken while it ran, to show which resource
+stood out during a p99 spike.
+"""
+
+import array
+import asyncio
+import logging
+import math
+import os
+import statistics
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from utils.metrics import Metrics
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    "time",
+    "process_cpu_percent",
+    "system_cpu_percent",
+    "rss_mb",
+    "loop_lag_ms",
+    "active_requests",
+    "llm_backlog",
+    "parse_backlog",
+    "asr_backlog",
+    "fair_queue_waiting",
+    "jobs_queued",
+    "jobs_running",
+    "ollama_models",
+    "ollama_vram_mb",
+)
+
+# Smallest rise over the median that counts as unusual, per column; keeps
+# a flat baseline (e.g. an always-empty queue) from flagging a +1 blip
+MIN_SPREAD = {
+    "process_cpu_percent": 10.0,
+    "system_cpu_percent": 10.0,
+    "rss_mb": 32.0,
+    "loop_lag_ms": 10.0,
+    "active_requests": 1.0,
+    "llm_backlog": 1.0,
+    "parse_backlog": 1.0,
+    "asr_backlog": 1.0,
+    "fair_queue_waiting": 1.0,
+    "jobs_queued": 1.0,
+    "jobs_running": 1.0,
+    "ollama_models": 1.0,
+    "ollama_vram_mb": 256.0,
+}
+
+# Suspects need a peak this many spreads above the window's median
+SUSPECT_SCORE = 3.0
+
+
+class ColumnRing:
+    """Fixed-size ring of float rows stored column by column; missing values are NaN"""
+
+    def __init__(self, columns: Sequence[str], capacity: int):
+        self.columns = tuple(columns)
+        self.capacity = max(1, capacity)
+        self._data = {name: array.array("d", bytes(8 * self.capacity)) for name in self.columns}
+        self._next = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, row: Dict[str, float]) -> None:
+        with self._lock:
+            for name, column in self._data.items():
+                value = row.get(name)
+                column[self._next] = math.nan if value is None else value
+            self._next = (self._next + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def window(self, start: float = 0.0, end: float = math.inf, key: str = "time") -> Dict[str, List[Optional[float]]]:
+        """Rows with `start <= key <= end`, oldest first, as {column: values} (NaN as None)"""
+        with self._lock:
+            first = (self._next - self._size) % self.capacity
+            order = [(first + offset) % self.capacity for offset in range(self._size)]
+            keys = self._data[key]
+            rows = [index for index in order if start <= keys[index] <= end]
+            return {
+                name: [None if math.isnan(column[index]) else column[index] for index in rows]
+                for name, column in self._data.items()
+            }
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.itemsize * len(column) for column in self._data.values())
+
+
+def _rss_mb(process) -> Optional[float]:
+    if process is not None:
+        return process.memory_info().rss / 1024 / 1024
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return None
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ResourceRecorder:
+    """
+    Sample process and queue state into a ColumnRing and keep recent request latencies
+
+    Args:
+        pipeline: ChatPipeline whose governor, fair queue and Ollama client are sampled
+        settings: Callable returning the current `recorder` config section
+        metrics: Metrics to record the sampler's own cost in
+        job_queue: Optional JobQueue whose queued/running counts are sampled
+    """
+
+    def __init__(self, pipeline, settings: Callable[[], Dict[str, Any]], metrics: Optional[Metrics] = None,
+                 job_queue=None):
+        self.pipeline = pipeline
+        self.settings = settings
+        self.metrics = metrics
+        self.job_queue = job_queue
+        initial = settings()
+        self.samples = ColumnRing(COLUMNS, int(initial.get("capacity", 3600)))
+        # (start, end, seconds, status, method, path, request_id)
+        self.requests: Deque[Tuple[float, float, float, int, str, str, str]] = deque(
+            maxlen=int(initial.get("request_capacity", 20000))
+        )
+        self._process = psutil.Process() if psutil is not None else None
+        self._cpu_times: Optional[Tuple[float, float]] = None
+        self._ollama: Dict[str, Optional[float]] = {"ollama_models": None, "ollama_vram_mb": None}
+        self._ollama_checked = 0.0
+        self._ollama_task: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.settings().get("enabled", False):
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    def stop(self) -> None:
+        for task in (self._task, self._ollama_task):
+            if task is not None:
+                task.cancel()
+
+    def record_request(self, request_id: str, method: str, path: str, status: int, seconds: float) -> None:
+        """Called by the request context middleware when a response finishes"""
+        end = time.time()
+        self.requests.append((end - seconds, end, seconds, status, method, path, request_id))
+
+    async def _loop(self) -> None:
+        while True:
+            interval = max(0.05, self.settings().get("interval_seconds", 1.0))
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            # Oversleep of a plain sleep is the time other callbacks held the loop
+            lag = max(0.0, time.perf_counter() - expected)
+            try:
+                await self.sample(lag)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Resource sample failed: {e}")
+
+    def _process_cpu_percent(self) -> Optional[float]:
+        """Process CPU since the previous sample, in percent of one core"""
+        if self._process is not None:
+            return self._process.cpu_percent(None)
+        now = (time.perf_counter(), time.process_time())
+        previous, self._cpu_times = self._cpu_times, now
+        if previous is None or now[0] <= previous[0]:
+            return None
+        return (now[1] - previous[1]) / (now[0] - previous[0]) * 100
+
+    def _sample_sync(self) -> Dict[str, Optional[float]]:
+        """The blocking part of a sample (psutil, /proc, SQLite), run in a thread"""
+        row: Dict[str, Optional[float]] = {
+            "process_cpu_percent": self._process_cpu_percent(),
+            "system_cpu_percent": psutil.cpu_percent(None) if psutil is not None else None,
+            "rss_mb": _rss_mb(self._process),
+        }
+        if self.job_queue is not None:
+            counts = Counter()
+            for type_status, count in self.job_queue.counts().items():
+                counts[type_status.partition(":")[2]] += count
+            row["jobs_queued"] = counts["queued"]
+            row["jobs_running"] = counts["running"]
+        return row
+
+    def _poll_ollama_due(self) -> None:
+        """Refresh the Ollama columns in the background; a slow /api/ps never delays samples"""
+        period = self.settings().get("ollama_ps_seconds", 10)
+        if not period or time.time() - self._ollama_checked < period:
+            return
+        if self._ollama_task is None or self._ollama_task.done():
+            self._ollama_checked = time.time()
+            self._ollama_task = asyncio.ensure_future(self._poll_ollama())
+
+    async def _poll_ollama(self) -> None:
+        try:
+            models = await self.pipeline.ollama_client.running_models()
+            self._ollama = {
+                "ollama_models": len(models),
+                "ollama_vram_mb": sum(model.get("size_vram", 0) for model in models) / 1024 / 1024,
+            }
+        except Exception as e:
+            logger.debug(f"Ollama /api/ps failed: {e}")
+            self._ollama = {"ollama_models": None, "ollama_vram_mb": None}
+
+    async def sample(self, loop_lag: float = 0.0) -> Dict[str, Optional[float]]:
+        """Take one sample now and append it to the ring"""
+        start_time = time.perf_counter()
+        sampled_at = time.time()
+        row = await asyncio.to_thread(self._sample_sync)
+        self._poll_ollama_due()
+        backlog = self.pipeline.governor.backlog()
+        row.update(self._ollama)
+        row.update({
+            "time": sampled_at,
+            "loop_lag_ms": loop_lag * 1000,
+            "active_requests": self.pipeline.active_requests,
+            "llm_backlog": backlog["llm"],
+            "parse_backlog": backlog["parse"],
+            "asr_backlog": backlog["asr"],
+            "fair_queue_waiting": self.pipeline.fair_queue.waiting,
+        })
+        self.samples.append(row)
+        if self.metrics is not None:
+            self.metrics.observe("recorder_sample_seconds", time.perf_counter() - start_time)
+        return row
+
+    def series(self, seconds: float = 300.0) -> Dict[str, Any]:
+        """Samples of the last `seconds` as columns"""
+        return {"columns": self.samples.window(start=time.time() - seconds)}
+
+    def slow_requests(self, seconds: float = 900.0, percentile: float = 0.99, path: Optional[str] = None,
+                      limit: int = 20) -> Dict[str, Any]:
+        """
+        Requests at or above the latency percentile, with the resources that stood out while they ran
+
+        Every column is summarized over the whole window by its median and
+        spread (scaled median absolute deviation, at least MIN_SPREAD). For a
+        slow request, each column's peak during the request is scored in
+        spreads above the median; the highest score of at least
+        SUSPECT_SCORE names the suspect. No suspect means no resource looked
+        unusual, i.e. the time was most likely spent generating in Ollama.
+
+        Args:
+            seconds: How far back to look
+            percentile: Latency percentile that counts as slow, e.g. 0.99
+            path: Only requests whose path starts with this prefix
+            limit: Maximum number of requests returned, slowest first
+        """
+        since = time.time() - seconds
+        requests = [record for record in list(self.requests) if record[1] >= since and (not path or record[5].startswith(path))]
+        if not requests:
+            return {"requests": 0, "threshold": None, "slow": [], "suspects": {}}
+        threshold = _percentile([record[2] for record in requests], percentile)
+        slow = sorted((record for record in requests if record[2] >= threshold), key=lambda record: -record[2])
+
+        window = self.samples.window(start=since)
+        baseline = {}
+        for name in COLUMNS[1:]:
+            values = [value for value in window[name] if value is not None]
+            if values:
+                median = statistics.median(values)
+                deviation = statistics.median(abs(value - median) for value in values) * 1.4826
+                baseline[name] = (median, max(deviation, MIN_SPREAD[name]))
+
+        interval = self.settings().get("interval_seconds", 1.0)
+        times = window["time"]
+        results, suspects = [], Counter()
+        for start, end, duration, status, method, request_path, request_id in slow[:limit]:
+            # Include the sample taken just after the request ended; it covers its last interval
+            rows = [index for index, sample_time in enumerate(times) if start <= sample_time <= end + interval]
+            peaks, scores = {}, {}
+            for name, (median, spread) in baseline.items():
+                values = [window[name][index] for index in rows if window[name][index] is not None]
+                if values:
+                    peaks[name] = max(values)
+                    scores[name] = round((peaks[name] - median) / spread, 2)
+            ranked = sorted(scores.items(), key=lambda item: -item[1])
+            suspect = ranked[0][0] if ranked and ranked[0][1] >= SUSPECT_SCORE else None
+            suspects[suspect or "none"] += 1
+            results.append({
+                "request_id": request_id,
+                "method": method,
+                "path": request_path,
+                "status": status,
+                "seconds": duration,
+                "started_at": start,
+                "samples": len(rows),
+                "suspect": suspect,
+                "scores": dict(ranked[:3]),
+                "peaks": peaks,
+            })
+        return {
+            "requests": len(requests),
+            "threshold": threshold,
+            "baseline": {name: {"median": median, "spread": spread} for name, (median, spread) in baseline.items()},
+            "slow": results,
+            "suspects": dict(suspects),
+        }
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": self._task is not None and not self._task.done(),
+            "samples": len(self.samples),
+            "capacity": self.samples.capacity,
+            "buffer_bytes": self.samples.nbytes,
+            "requests": len(self.requests),
+        }
@@ -1,15 +1,26 @@
+import asyncio
 import base64
 import io
 import logging
 import tempfile
 import os
+import threading
+from concurrent.futures import Executor
 from typing import Optional
 import wave
 
 logger = logging.getLogger(__name__)
 
 class AudioProcessor:
-    def __init__(self):
+    # Whisper models are loaded once per process and shared by all instances
+    _whisper_models = {}
+    _whisper_lock = threading.Lock()
+    
+    def __init__(self, executor: Optional[Executor] = None):
+        # Decoding and transcription block, so they run on this executor
+        # (None means the loop's default thread pool)
+        self.executor = executor
+        self.whisper_model_name = os.getenv("WHISPER_MODEL", "base")
         self.whisper_available = self._check_whisper_availability()
         
     def _check_whisper_availability(self) -> bool:
@@ -22,6 +33,11 @@ class AudioProcessor:
             return False
     
     async def transcribe_audio_base64(self, audio_base64: str) -> str:
+        """Transcribe base64 audio in a worker thread, see transcribe_base64_sync"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.transcribe_base64_sync, audio_base64)
+    
+    def transcribe_base64_sync(self, audio_base64: str) -> str:
         """
         Transcribe audio from base64 string
         
@@ -43,10 +59,10 @@ class AudioProcessor:
             try:
                 # Transcribe using available methods
                 if self.whisper_available:
-                    return await self._transcribe_with_whisper(temp_file_path)
+                    return self._transcribe_with_whisper(temp_file_path)
                 else:
                     # Fallback to simple audio validation
-                    return await self._validate_audio_file(temp_file_path)
+                    return self._validate_audio_file(temp_file_path)
             finally:
                 # Clean up temporary file
                 if os.path.exists(temp_file_path):
@@ -56,13 +72,23 @@ class AudioProcessor:
             logger.error(f"Audio transcription failed: {e}")
             return "[Audio transcription failed]"
     
-    async def _transcribe_with_whisper(self, audio_file_path: str) -> str:
+    def _load_whisper_model(self):
+        """Load the Whisper model on first use (downloads it if needed), then reuse it"""
+        model = self._whisper_models.get(self.whisper_model_name)
+        if model is None:
+            with self._whisper_lock:
+                model = self._whisper_models.get(self.whisper_model_name)
+                if model is None:
+                    import whisper
+                    logger.info(f"Loading Whisper model '{self.whisper_model_name}'")
+                    model = whisper.load_model(self.whisper_model_name)
+                    self._whisper_models[self.whisper_model_name] = model
+        return model
+    
+    def _transcribe_with_whisper(self, audio_file_path: str) -> str:
         """Transcribe audio using OpenAI Whisper"""
         try:
-            import whisper
-            
-            # Load model (this will download on first use)
-            model = whisper.load_model("base")
+            model = self._load_whisper_model()
             
             # Transcribe
             result = model.transcribe(audio_file_path)
@@ -73,7 +99,7 @@ class AudioProcessor:
             logger.error(f"Whisper transcription failed: {e}")
             return "[Whisper transcription failed]"
     
-    async def _validate_audio_file(self, audio_file_path: str) -> str:
+    def _validate_audio_file(self, audio_file_path: str) -> str:
         """Validate audio file and return placeholder text"""
         try:
             with wave.open(audio_file_path, 'rb') as wav_file:
@@ -99,10 +125,11 @@ class AudioProcessor:
             Transcribed text
         """
         try:
+            loop = asyncio.get_running_loop()
             if self.whisper_available:
-                return await self._transcribe_with_whisper(audio_file_path)
+                return await loop.run_in_executor(self.executor, self._transcribe_with_whisper, audio_file_path)
             else:
-                return await self._validate_audio_file(audio_file_path)
+                return await loop.run_in_executor(self.executor, self._validate_audio_file, audio_file_path)
                 
         except Exception as e:
             logger.error(f"Audio file transcription failed: {e}")
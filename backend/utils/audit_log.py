@@ -0,0 +1,310 @@
+"""
+Append-only log of every question and answer, for agronomist review and replay
+
+    python -m utils.audit_log export --since 2026-10-01 > conversations.jsonl
+    python -m utils.audit_log find <request_id>
+    python -m utils.audit_log stats
+
+Requests only put their entry on a bounded in-memory queue; a background
+task writes batches to gzip-compressed JSONL segments. Each batch is one
+gzip member appended to the current segment, which rotates once it
+reaches `segment_bytes`. Next to every segment a small `.idx` file gets
+one line per batch with its byte range, time range and request ids, so
+readers can seek straight to the batches they need. Segment names carry
+the writer's pid, so API and worker processes can share one directory.
+
+When the queue is full (the disk can't keep up), new entries are dropped
+and counted rather than slowing requests down.
+"""
+
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from . import fast_json
+from .metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AUDIT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "audit")
+
+SEGMENT_SUFFIX = ".jsonl.gz"
+INDEX_SUFFIX = ".idx"
+
+
+class AuditLog:
+    """
+    Batched, asynchronous writer of conversation entries
+
+    Args:
+        directory: Where segments are written (created if missing)
+        max_queue: Entries held in memory before new ones are dropped
+        batch_size: Most entries written per gzip member
+        flush_interval: Seconds between flushes of a partial batch
+        segment_bytes: Compressed size at which a new segment is started
+        compress_level: gzip level; 6 compresses chat text about 4x
+        metrics: Metrics to record written, dropped and flush timings in
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_queue: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 2.0, segment_bytes: int = 16 * 1024 * 1024, compress_level: int = 6,
+                 metrics: Optional[Metrics] = None):
+        self.directory = directory or os.getenv("KANGTANI_AUDIT_DIR", DEFAULT_AUDIT_DIR)
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.compress_level = compress_level
+        self.metrics = metrics
+        self.written = 0
+        self.dropped = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._segment: Optional[str] = None
+        self._segment_size = 0
+
+    def record(self, entry: Dict[str, Any]) -> bool:
+        """
+        Queue an entry without waiting; False if it was dropped because the queue is full
+
+        Starts the writer task on first use, so it must be called from the event loop.
+        """
+        if self._task is None or self._task.done():
+            self._queue = self._queue or asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.get_running_loop().create_task(self._writer())
+        entry.setdefault("ts", time.time())
+        try:
+            self._queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.metrics is not None:
+                self.metrics.increment("audit_log_dropped_total")
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"Audit log queue full, {self.dropped} entries dropped so far")
+            return False
+        return True
+
+    async def _writer(self) -> None:
+        batch: List[Dict[str, Any]] = []
+        flushing: Optional[asyncio.Future] = None
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                flushing, batch = asyncio.ensure_future(self._flush(batch)), []
+                await asyncio.shield(flushing)
+        except asyncio.CancelledError:
+            # Stopping: finish the write in progress and keep the batch being collected
+            if flushing is not None and not flushing.done():
+                await flushing
+            if batch:
+                await self._flush(batch)
+            raise
+
+    async def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        start_time = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._write_batch, batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.error(f"Audit log write of {len(batch)} entries failed: {e}")
+            if self.metrics is not None:
+                self.metrics.increment("audit_log_dropped_total", len(batch))
+            return
+        if self.metrics is not None:
+            self.metrics.increment("audit_log_entries_total", len(batch))
+            self.metrics.observe("audit_log_flush_seconds", time.perf_counter() - start_time)
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        """Append one gzip member to the current segment and its index line"""
+        if self._segment is None or self._segment_size >= self.segment_bytes:
+            os.makedirs(self.directory, exist_ok=True)
+            stamp = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+            self._segment = os.path.join(self.directory, f"audit-{stamp}-{os.getpid()}{SEGMENT_SUFFIX}")
+            self._segment_size = 0
+        payload = b"".join(fast_json.dumps(entry) + b"\n" for entry in batch)
+        member = gzip.compress(payload, compresslevel=self.compress_level)
+        with open(self._segment, "ab") as file:
+            offset = file.tell()
+            file.write(member)
+        self._segment_size = offset + len(member)
+        timestamps = [entry["ts"] for entry in batch]
+        index_line = {
+            "offset": offset,
+            "length": len(member),
+            "count": len(batch),
+            "first": min(timestamps),
+            "last": max(timestamps),
+            "ids": [entry["request_id"] for entry in batch if entry.get("request_id")],
+        }
+        with open(self._segment[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX, "ab") as file:
+            file.write(fast_json.dumps(index_line) + b"\n")
+
+    async def close(self) -> None:
+        """Write everything still queued and stop the writer"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._queue is not None and not self._queue.empty():
+            batch = []
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            for start in range(0, len(batch), self.batch_size):
+                await self._flush(batch[start:start + self.batch_size])
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "segment": self._segment,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+
+class AuditLogReader:
+    """
+    Stream entries back out of a directory of audit segments
+
+    Uses the `.idx` files to decompress only the batches that can match a
+    time range or request id. A batch cut short by a crash is skipped.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or os.getenv("KANGTANI_AUDIT_DIR", DEFAULT_AUDIT_DIR)
+
+    def segments(self) -> List[str]:
+        """Segment paths, oldest first"""
+        return sorted(glob.glob(os.path.join(self.directory, f"audit-*{SEGMENT_SUFFIX}")))
+
+    @staticmethod
+    def _batches(segment: str) -> List[Dict[str, Any]]:
+        batches = []
+        try:
+            with open(segment[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX, "rb") as file:
+                for line in file:
+                    try:
+                        batches.append(fast_json.loads(line))
+                    except ValueError:
+                        # Line cut short by a crash; the other batches are still usable
+                        continue
+        except FileNotFoundError:
+            pass
+        return batches
+
+    @staticmethod
+    def _read_batch(file, batch: Dict[str, Any]) -> List[Dict[str, Any]]:
+        file.seek(batch["offset"])
+        try:
+            payload = gzip.decompress(file.read(batch["length"]))
+        except (OSError, EOFError) as e:
+            logger.warning(f"Skipping unreadable audit batch at {batch['offset']} in {file.name}: {e}")
+            return []
+        return [fast_json.loads(line) for line in payload.splitlines() if line]
+
+    def read(self, since: Optional[float] = None, until: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """Entries with `since <= ts <= until`, in write order per segment"""
+        since = since if since is not None else float("-inf")
+        until = until if until is not None else float("inf")
+        for segment in self.segments():
+            batches = [batch for batch in self._batches(segment) if batch["last"] >= since and batch["first"] <= until]
+            if not batches:
+                continue
+            with open(segment, "rb") as file:
+                for batch in batches:
+                    for entry in self._read_batch(file, batch):
+                        if since <= entry.get("ts", 0) <= until:
+                            yield entry
+
+    def find(self, request_id: str) -> Optional[Dict[str, Any]]:
+        """The entry of one request, or None"""
+        for segment in reversed(self.segments()):
+            for batch in self._batches(segment):
+                if request_id in batch["ids"]:
+                    with open(segment, "rb") as file:
+                        for entry in self._read_batch(file, batch):
+                            if entry.get("request_id") == request_id:
+                                return entry
+        return None
+
+    def replay_requests(self, since: Optional[float] = None, until: Optional[float] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """(route, JSON body) of logged plain chats, to re-send against a server for benchmarks"""
+        for entry in self.read(since, until):
+            if entry.get("route") == "/chat" and not entry.get("error"):
+                body = {"message": entry["message"]}
+                if entry.get("profile_requested"):
+                    body["profile"] = entry["profile_requested"]
+                yield entry["route"], body
+
+    def stats(self) -> Dict[str, Any]:
+        segments = self.segments()
+        batches = [batch for segment in segments for batch in self._batches(segment)]
+        return {
+            "directory": self.directory,
+            "segments": len(segments),
+            "bytes": sum(os.path.getsize(segment) for segment in segments),
+            "entries": sum(batch["count"] for batch in batches),
+            "first": min((batch["first"] for batch in batches), default=None),
+            "last": max((batch["last"] for batch in batches), default=None),
+        }
+
+
+def _timestamp(value: Optional[str]) -> Optional[float]:
+    """Seconds since the epoch from a number or an ISO date/time"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read the Kangtani.ai conversation audit log")
+    parser.add_argument("--dir", help=f"Audit directory (default: $KANGTANI_AUDIT_DIR or {DEFAULT_AUDIT_DIR})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Write entries as JSONL to stdout")
+    export.add_argument("--since", help="Epoch seconds or ISO date/time")
+    export.add_argument("--until", help="Epoch seconds or ISO date/time")
+    find = commands.add_parser("find", help="Print the entry of one request")
+    find.add_argument("request_id")
+    commands.add_parser("stats", help="Segment and entry counts")
+    args = parser.parse_args()
+
+    reader = AuditLogReader(args.dir)
+    if args.command == "export":
+        for entry in reader.read(_timestamp(args.since), _timestamp(args.until)):
+            sys.stdout.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    elif args.command == "find":
+        entry = reader.find(args.request_id)
+        if entry is None:
+            sys.exit(f"Request {args.request_id} not found")
+        print(json.dumps(entry, ensure_ascii=False, indent=2))
+    else:
+        print(json.dumps(reader.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+import csv
+import io
+import logging
+import re
+import threading
+from array import array
+from collections import Counter, OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Values treated as missing when inferring column types
+NULL_VALUES = {'', 'na', 'n/a', 'nan', 'null', 'none', '-'}
+
+_THOUSANDS_COMMA = re.compile(r'^-?\d{1,3}(,\d{3})+$')
+
+
+def _to_number(value: str) -> Optional[float]:
+    """Parse a numeric cell, accepting thousands separators and decimal commas"""
+    text = value.strip().replace(' ', '')
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    # "1,234.5" or "1.234,5" (common in Indonesian spreadsheets)
+    if ',' in text:
+        if _THOUSANDS_COMMA.match(text) or ('.' in text and text.rfind('.') > text.rfind(',')):
+            text = text.replace(',', '')
+        elif text.count(',') == 1 and '.' not in text:
+            text = text.replace(',', '.')
+        else:
+            text = text.replace('.', '').replace(',', '.')
+        try:
+            return float(text)
+        except ValueError:
+            return None
+    return None
+
+
+class ColumnStats:
+    """Streaming statistics and type inference for a single CSV column"""
+
+    def __init__(self, name: str, max_distinct: int = 50):
+        self.name = name
+        self.max_distinct = max_distinct
+        self.count = 0
+        self.nulls = 0
+        self.numeric = 0
+        self.integer = True
+        self.minimum: Optional[float] = None
+        self.maximum: Optional[float] = None
+        self.total = 0.0
+        self.max_length = 0
+        self.values: Counter = Counter()
+        self.distinct_overflow = False
+
+    def update(self, cells, numbers) -> None:
+        """Update the statistics with a chunk of cells and their parsed numbers"""
+        for cell, number in zip(cells, numbers):
+            self.count += 1
+            value = cell.strip()
+            if value.lower() in NULL_VALUES:
+                self.nulls += 1
+                continue
+
+            if len(value) > self.max_length:
+                self.max_length = len(value)
+
+            if not self.distinct_overflow:
+                self.values[value] += 1
+                if len(self.values) > self.max_distinct:
+                    self.distinct_overflow = True
+                    self.values = Counter(dict(self.values.most_common(10)))
+            elif value in self.values:
+                self.values[value] += 1
+
+            if number is None:
+                continue
+            self.numeric += 1
+            if self.integer and not number.is_integer():
+                self.integer = False
+            self.total += number
+            if self.minimum is None or number < self.minimum:
+                self.minimum = number
+            if self.maximum is None or number > self.maximum:
+                self.maximum = number
+
+    @property
+    def non_null(self) -> int:
+        return self.count - self.nulls
+
+    @property
+    def dtype(self) -> str:
+        """Inferred type: integer, float, categorical, text or empty"""
+        if self.non_null == 0:
+            return 'empty'
+        # Allow a few stray non-numeric cells (e.g. "approx.") in numeric columns
+        if self.numeric / self.non_null >= 0.95:
+            return 'integer' if self.integer else 'float'
+        if not self.distinct_overflow:
+            return 'categorical'
+        return 'text'
+
+    def describe(self) -> str:
+        """Render a one-line description of the column"""
+        parts = [f"{self.name} ({self.dtype})"]
+        if self.nulls:
+            parts.append(f"missing={self.nulls}")
+        if self.dtype in ('integer', 'float') and self.numeric:
+            mean = self.total / self.numeric
+            parts.append(
+                f"min={_fmt(self.minimum)} max={_fmt(self.maximum)} "
+                f"mean={_fmt(mean)} sum={_fmt(self.total)}"
+            )
+        elif self.dtype == 'categorical':
+            top = ', '.join(f"{value} ({count})" for value, count in self.values.most_common(5))
+            parts.append(f"distinct={len(self.values)} top: {top}")
+        elif self.dtype == 'text':
+            top = ', '.join(value for value, _ in self.values.most_common(3))
+            parts.append(f"distinct>{self.max_distinct} max_len={self.max_length} e.g. {top}")
+        return ' - '.join(parts)
+
+
+def _fmt(value: Optional[float]) -> str:
+    if value is None:
+        return '-'
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return f"{value:.2f}"
+
+
+class _OffsetTracker:
+    """Line iterator over CSV bytes that remembers how far it has read"""
+
+    def __init__(self, data: bytes, encoding: str):
+        self.stream = io.BytesIO(data)
+        self.encoding = encoding
+        self.position = 0
+
+    def __iter__(self):
+        for line in self.stream:
+            self.position += len(line)
+            yield line.decode(self.encoding, errors='replace')
+
+
+class CsvRowIndex:
+    """Row-level lookups over an ingested CSV without keeping rows in memory
+
+    Only the raw bytes and one offset per row are stored. Per-column value
+    indexes are built lazily on the first lookup of that column.
+    """
+
+    def __init__(self, index_id: str, data: bytes, encoding: str, dialect,
+                 header: List[str], offsets: array):
+        self.index_id = index_id
+        self.data = data
+        self.encoding = encoding
+        self.dialect = dialect
+        self.header = header
+        self.offsets = offsets
+        self._column_indexes: Dict[int, Dict[str, array]] = {}
+
+    @property
+    def row_count(self) -> int:
+        return len(self.offsets) - 1
+
+    def _read_row(self, row_number: int) -> List[str]:
+        start, end = self.offsets[row_number], self.offsets[row_number + 1]
+        text = self.data[start:end].decode(self.encoding, errors='replace')
+        return next(csv.reader(io.StringIO(text), self.dialect), [])
+
+    def _column_index(self, column: int) -> Dict[str, array]:
+        if column not in self._column_indexes:
+            index: Dict[str, array] = {}
+            tracker = _OffsetTracker(self.data[self.offsets[0]:], self.encoding)
+            row_number = 0
+            for row in csv.reader(tracker, self.dialect):
+                if not row:
+                    continue
+                key = row[column].strip().lower() if column < len(row) else ''
+                index.setdefault(key, array('I')).append(row_number)
+                row_number += 1
+            self._column_indexes[column] = index
+        return self._column_indexes[column]
+
+    def lookup(self, column: str, value: str, limit: int = 20) -> List[Dict[str, str]]:
+        """
+        Return rows whose `column` equals `value` (case-insensitive)
+
+        Args:
+            column: Header name of the column to match
+            value: Value to look for
+            limit: Maximum number of rows to return
+
+        Returns:
+            Matching rows as header -> cell dictionaries
+        """
+        lowered = [name.strip().lower() for name in self.header]
+        if column.strip().lower() not in lowered:
+            raise KeyError(f"Unknown column: {column}")
+        column_number = lowered.index(column.strip().lower())
+
+        matches = self._column_index(column_number).get(value.strip().lower(), ())
+        rows = []
+        for row_number in matches[:limit]:
+            row = self._read_row(row_number)
+            rows.append({name: (row[i] if i < len(row) else '') for i, name in enumerate(self.header)})
+        return rows
+
+
+class CsvSummarizer:
+    """
+    Columnar, chunked CSV ingestion producing a bounded-size text summary
+
+    Rows are read in chunks and transposed into columns so statistics are
+    updated column-at-a-time; only head/tail samples and per-column
+    aggregates are retained, never the full table.
+    """
+
+    def __init__(self, chunk_rows: int = 5000, head_rows: int = 5, tail_rows: int = 5,
+                 max_groups: int = 12, max_group_columns: int = 3, max_chars: int = 6000):
+        self.chunk_rows = chunk_rows
+        self.head_rows = head_rows
+        self.tail_rows = tail_rows
+        self.max_groups = max_groups
+        self.max_group_columns = max_group_columns
+        self.max_chars = max_chars
+
+    @staticmethod
+    def _detect_encoding(data: bytes) -> Tuple[str, int]:
+        if data.startswith(b'\xef\xbb\xbf'):
+            return 'utf-8', 3
+        try:
+            data.decode('utf-8')
+            return 'utf-8', 0
+        except UnicodeDecodeError:
+            return 'cp1252', 0
+
+    @staticmethod
+    def _sniff_dialect(sample: str):
+        try:
+            return csv.Sniffer().sniff(sample, delimiters=',;\t|')
+        except csv.Error:
+            return csv.excel
+
+    def summarize(self, data: bytes, index_id: Optional[str] = None) -> Tuple[str, Optional[CsvRowIndex]]:
+        """
+        Summarize CSV bytes
+
+        Args:
+            data: Raw CSV content
+            index_id: Identifier under which row lookups will be available
+
+        Returns:
+            Tuple of (summary text, row index or None for empty files)
+        """
+        encoding, bom = self._detect_encoding(data)
+        body = data[bom:]
+        dialect = self._sniff_dialect(body[:64 * 1024].decode(encoding, errors='replace'))
+
+        tracker = _OffsetTracker(body, encoding)
+        reader = csv.reader(tracker, dialect)
+        header = next(reader, None)
+        if not header or not any(cell.strip() for cell in header):
+            return "[Empty CSV file]", None
+        header = [name.strip() or f"column_{i + 1}" for i, name in enumerate(header)]
+        width = len(header)
+
+        offsets = array('Q', [tracker.position])
+        columns = [ColumnStats(name) for name in header]
+        head: List[List[str]] = []
+        tail: deque = deque(maxlen=self.tail_rows)
+        # group column -> value -> [row count, per-column numeric sums]
+        groups: Dict[int, Dict[str, List]] = {}
+        group_candidates: Optional[List[int]] = None
+        row_count = 0
+
+        while True:
+            chunk = []
+            for row in reader:
+                if not row:
+                    # Blank line: fold it into the previous row's byte range
+                    offsets[-1] = tracker.position
+                    continue
+                offsets.append(tracker.position)
+                if len(row) < width:
+                    row = row + [''] * (width - len(row))
+                chunk.append(row[:width])
+                if len(chunk) >= self.chunk_rows:
+                    break
+            if not chunk:
+                break
+
+            if group_candidates is None:
+                # Text-looking columns in the first data row are grouping candidates
+                group_candidates = [
+                    i for i, cell in enumerate(chunk[0])
+                    if cell.strip() and _to_number(cell) is None
+                ][:self.max_group_columns]
+                groups = {i: {} for i in group_candidates}
+
+            # Transpose the chunk into columns and parse numbers once per cell
+            cell_columns = list(zip(*chunk))
+            number_columns = [[_to_number(cell) for cell in cells] for cells in cell_columns]
+            for stats, cells, numbers in zip(columns, cell_columns, number_columns):
+                stats.update(cells, numbers)
+            self._update_groups(groups, cell_columns, number_columns)
+
+            if len(head) < self.head_rows:
+                head.extend(chunk[:self.head_rows - len(head)])
+            tail.extend(chunk[-self.tail_rows:])
+            row_count += len(chunk)
+
+        index = CsvRowIndex(index_id, body, encoding, dialect, header, offsets) if index_id else None
+        text = self._render(header, columns, head, tail, groups, row_count, index_id)
+        return text, index
+
+    def _update_groups(self, groups: Dict[int, Dict[str, List]], cell_columns, number_columns) -> None:
+        numeric = [i for i, numbers in enumerate(number_columns) if any(n is not None for n in numbers)]
+        for column in list(groups):
+            table = groups[column]
+            for row_number, key in enumerate(cell_columns[column]):
+                key = key.strip()
+                entry = table.get(key)
+                if entry is None:
+                    if len(table) >= self.max_groups:
+                        # Too many distinct values to be a useful grouping
+                        del groups[column]
+                        break
+                    entry = table[key] = [0, [0.0] * len(cell_columns)]
+                entry[0] += 1
+                sums = entry[1]
+                for i in numeric:
+                    number = number_columns[i][row_number]
+                    if number is not None:
+                        sums[i] += number
+
+    def _render(self, header, columns, head, tail, groups, row_count, index_id) -> str:
+        lines = [f"CSV summary: {row_count} rows x {len(header)} columns"]
+        lines.append("Columns:")
+        lines.extend(f"- {stats.describe()}" for stats in columns)
+
+        numeric_columns = [i for i, stats in enumerate(columns) if stats.dtype in ('integer', 'float')]
+        for column, table in groups.items():
+            if not numeric_columns or len(table) < 2:
+                continue
+            lines.append(f"Totals by {header[column]}:")
+            for key, (count, sums) in sorted(table.items(), key=lambda item: -item[1][0]):
+                totals = ', '.join(f"{header[i]}={_fmt(sums[i])}" for i in numeric_columns)
+                lines.append(f"- {key or '(blank)'}: rows={count}, {totals}")
+
+        lines.append(f"First {len(head)} rows:")
+        lines.append(', '.join(header))
+        lines.extend(', '.join(row) for row in head)
+        if row_count > len(head):
+            shown = list(tail)[-(row_count - len(head)):]
+            lines.append(f"Last {len(shown)} rows:")
+            lines.extend(', '.join(row) for row in shown)
+        if index_id:
+            lines.append(f"[Full rows available via CSV lookup id: {index_id}]")
+
+        text = '\n'.join(lines)
+        if len(text) > self.max_chars:
+            text = text[:self.max_chars].rsplit('\n', 1)[0] + "\n[Summary truncated]"
+        return text
+
+
+class CsvIndexCache:
+    """
+    Small LRU of recent CSV row indexes keyed by content hash
+
+    Lookups run in worker threads while uploads add indexes, so every
+    access to the LRU order holds the lock.
+    """
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CsvRowIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, index: CsvRowIndex) -> None:
+        with self._lock:
+            self._entries[index.index_id] = index
+            self._entries.move_to_end(index.index_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, index_id: str) -> Optional[CsvRowIndex]:
+        with self._lock:
+            index = self._entries.get(index_id)
+            if index is not None:
+                self._entries.move_to_end(index_id)
+            return index
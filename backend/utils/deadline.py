@@ -0,0 +1,71 @@
+"""
+Per-request deadlines
+
+The HTTP layer (or a job worker) opens a `deadline_scope` for each request;
+stage timeouts and the Ollama client read `remaining()` so that no step
+keeps working for a caller that has already given up. The deadline lives in
+a context variable, so it follows the request into tasks it spawns.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+DEFAULT_TIMEOUT = 600.0
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before the work finished"""
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]):
+    """Run the block with a deadline `seconds` from now (never later than an enclosing one)"""
+    if seconds is None:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None if there is none"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def bound(timeout: Optional[float]) -> Optional[float]:
+    """`timeout` capped by the remaining deadline; DeadlineExceeded if it has passed"""
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return left if timeout is None else min(timeout, left)
+
+
+def route_timeout(settings: Dict[str, Any], route: Optional[str], requested: Optional[float] = None) -> float:
+    """
+    Deadline for a request from the `deadlines` config section
+
+    Args:
+        settings: {"default": seconds, "max": seconds, "routes": {path: seconds}}
+        route: Request path
+        requested: Timeout asked for by the client (X-Request-Timeout), capped at `max`
+    """
+    timeout = settings.get("routes", {}).get(route, settings.get("default", DEFAULT_TIMEOUT))
+    if requested is not None and requested > 0:
+        timeout = min(requested, settings.get("max", timeout))
+    return timeout
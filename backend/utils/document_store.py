@@ -0,0 +1,186 @@
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+from .file_parser import is_placeholder
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DOCUMENTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "documents")
+
+
+class DocumentStore:
+    """
+    Content-addressed store of parsed documents
+
+    Each document lives in `<root>/<document_id>/` with the original upload,
+    the extracted text and a `meta.json`. The id is derived from the SHA-256
+    of the content, so uploading the same file twice is a no-op and several
+    processes can share one directory (entries are written to a temporary
+    directory and renamed into place).
+
+    Every client that uploads a document is recorded as one of its
+    `owners`; documents of other owners behave as if they did not exist.
+    Deleting removes the caller's ownership, and the files go with the last
+    owner. Documents stored before owners were recorded have none, so they
+    only become visible again when re-uploaded.
+    """
+
+    ID_LENGTH = 32
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.getenv("KANGTANI_DOCUMENTS_DIR", DEFAULT_DOCUMENTS_DIR)
+        os.makedirs(self.root, exist_ok=True)
+
+    @classmethod
+    def document_id(cls, content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()[:cls.ID_LENGTH]
+
+    def _path(self, document_id: str, name: str = "") -> str:
+        if not document_id.isalnum():
+            raise KeyError(f"Invalid document id: {document_id}")
+        return os.path.join(self.root, document_id, name)
+
+    def _read_meta(self, document_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(document_id, "meta.json"), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (FileNotFoundError, KeyError):
+            return None
+
+    def _write_meta(self, document_id: str, meta: Dict[str, Any]) -> None:
+        handle, temp_path = tempfile.mkstemp(prefix=".meta-", dir=self._path(document_id))
+        with os.fdopen(handle, "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+        os.replace(temp_path, self._path(document_id, "meta.json"))
+
+    @staticmethod
+    def _public(meta: Dict[str, Any]) -> Dict[str, Any]:
+        """Metadata without the owner list, which names other clients"""
+        return {key: value for key, value in meta.items() if key != "owners"}
+
+    def _add_owner(self, document_id: str, owner: str) -> Optional[Dict[str, Any]]:
+        meta = self._read_meta(document_id)
+        if meta is not None and owner not in meta.get("owners", []):
+            meta["owners"] = meta.get("owners", []) + [owner]
+            self._write_meta(document_id, meta)
+        return meta
+
+    async def ingest(self, filename: str, content: bytes, file_parser, owner: str) -> Dict[str, Any]:
+        """
+        Parse and store a document unless the same content is already stored
+
+        Args:
+            filename: Original file name (its extension selects the parser)
+            content: Raw file content
+            file_parser: FileParser used to extract the text
+            owner: Id of the uploading client
+
+        Returns:
+            Document metadata, with `created` False if it was already stored
+
+        Raises:
+            ValueError: The file could not be parsed; nothing is stored
+        """
+        document_id = self.document_id(content)
+        existing = await asyncio.to_thread(self._add_owner, document_id, owner)
+        if existing is not None:
+            logger.info(f"Document {document_id} already stored, skipping parse")
+            return {**self._public(existing), "created": False}
+
+        start_time = time.time()
+        text = await file_parser.parse_file(filename, content)
+        if is_placeholder(text):
+            # Storing it would serve the parse error as the document forever (ids are content hashes)
+            raise ValueError(text.strip("[]"))
+        extension = os.path.splitext(filename.lower())[1]
+        meta = {
+            "document_id": document_id,
+            "filename": filename,
+            "extension": extension,
+            "size": len(content),
+            "chars": len(text),
+            "parse_time": time.time() - start_time,
+            "created_at": time.time(),
+            "owners": [owner],
+        }
+
+        staging = tempfile.mkdtemp(prefix=".ingest-", dir=self.root)
+        try:
+            with open(os.path.join(staging, f"source{extension}"), "wb") as file:
+                file.write(content)
+            with open(os.path.join(staging, "text.txt"), "w", encoding="utf-8") as file:
+                file.write(text)
+            with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as file:
+                json.dump(meta, file)
+            os.rename(staging, self._path(document_id))
+        except OSError:
+            # Another process stored the same document concurrently
+            shutil.rmtree(staging, ignore_errors=True)
+            if self._add_owner(document_id, owner) is None:
+                raise
+
+        logger.info(f"Document {document_id} stored ({filename}, {len(content)} bytes, {len(text)} chars)")
+        return {**self._public(meta), "created": True}
+
+    def get(self, document_id: str, owner: str) -> Optional[Dict[str, Any]]:
+        """Document metadata, or None if unknown or not `owner`'s"""
+        meta = self._read_meta(document_id)
+        if meta is None or owner not in meta.get("owners", []):
+            return None
+        return self._public(meta)
+
+    def get_text(self, document_id: str, owner: str) -> str:
+        """Extracted text of a stored document; KeyError if unknown or not `owner`'s"""
+        if self.get(document_id, owner) is None:
+            raise KeyError(f"Unknown document: {document_id}")
+        try:
+            with open(self._path(document_id, "text.txt"), "r", encoding="utf-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            raise KeyError(f"Unknown document: {document_id}")
+
+    def get_source(self, document_id: str, owner: str) -> bytes:
+        """Original upload of a stored document; KeyError if unknown or not `owner`'s"""
+        meta = self.get(document_id, owner)
+        if meta is None:
+            raise KeyError(f"Unknown document: {document_id}")
+        with open(self._path(document_id, f"source{meta['extension']}"), "rb") as file:
+            return file.read()
+
+    def find(self, prefix: str) -> Optional[str]:
+        """Id of a stored document starting with `prefix` (e.g. a CSV lookup id)"""
+        if not prefix.isalnum():
+            return None
+        for path in glob.glob(os.path.join(self.root, f"{prefix}*", "meta.json")):
+            return os.path.basename(os.path.dirname(path))
+        return None
+
+    def context(self, document_ids: List[str], owner: str) -> str:
+        """Combined text of several of `owner`'s documents for use as chat file context"""
+        sections = []
+        for document_id in dict.fromkeys(document_ids):
+            meta = self.get(document_id, owner)
+            if meta is None:
+                raise KeyError(f"Unknown document: {document_id}")
+            sections.append(f"[Document: {meta['filename']}]\n{self.get_text(document_id, owner)}")
+        return "\n\n".join(sections)
+
+    def delete(self, document_id: str, owner: str) -> bool:
+        """Drop `owner`'s copy of a document; False if unknown or not `owner`'s"""
+        meta = self._read_meta(document_id)
+        if meta is None or owner not in meta.get("owners", []):
+            return False
+        meta["owners"] = [other for other in meta["owners"] if other != owner]
+        if meta["owners"]:
+            self._write_meta(document_id, meta)
+        else:
+            shutil.rmtree(self._path(document_id), ignore_errors=True)
+        return True
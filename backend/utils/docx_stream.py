@@ -0,0 +1,94 @@
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import BinaryIO, List, Optional, Union
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_BODY = f'{W}body'
+_PARAGRAPH = f'{W}p'
+_TEXT = f'{W}t'
+_TAB = f'{W}tab'
+_BREAKS = {f'{W}br', f'{W}cr'}
+_TABLE = f'{W}tbl'
+_ROW = f'{W}tr'
+_CELL = f'{W}tc'
+
+
+def extract_docx_text(source: Union[str, BinaryIO], max_chars: Optional[int] = None) -> str:
+    """
+    Extract paragraphs and tables from a DOCX file in document order
+
+    Streams `word/document.xml` straight out of the zip with an incremental
+    XML parser and discards each top-level block once it has been rendered,
+    so memory stays bounded by the largest paragraph or table rather than
+    the whole document. Table rows are rendered as ``cell | cell | cell``.
+
+    Args:
+        source: Path or binary file object of the .docx
+        max_chars: Stop once this many characters have been extracted
+
+    Returns:
+        Extracted text
+    """
+    lines: List[str] = []
+    size = 0
+    parts: List[str] = []
+    # Open tables, innermost last: table -> rows -> cells -> paragraph texts
+    tables: List[List[List[List[str]]]] = []
+    body = None
+    depth = 0
+    body_depth = None
+
+    with zipfile.ZipFile(source) as archive:
+        with archive.open('word/document.xml') as stream:
+            for event, elem in ET.iterparse(stream, events=('start', 'end')):
+                tag = elem.tag
+                if event == 'start':
+                    depth += 1
+                    if tag == _BODY:
+                        body, body_depth = elem, depth
+                    elif tag == _TABLE:
+                        tables.append([])
+                    elif tag == _ROW and tables:
+                        tables[-1].append([])
+                    elif tag == _CELL and tables and tables[-1]:
+                        tables[-1][-1].append([])
+                    continue
+
+                depth -= 1
+                if tag == _TEXT:
+                    if elem.text:
+                        parts.append(elem.text)
+                elif tag == _TAB:
+                    parts.append('\t')
+                elif tag in _BREAKS:
+                    parts.append('\n')
+                elif tag == _PARAGRAPH:
+                    text = ''.join(parts).strip()
+                    parts = []
+                    if tables and tables[-1] and tables[-1][-1]:
+                        if text:
+                            tables[-1][-1][-1].append(text)
+                    elif text:
+                        lines.append(text)
+                        size += len(text) + 1
+                elif tag == _TABLE and tables:
+                    rows = [
+                        ' | '.join(' '.join(cell) for cell in row)
+                        for row in tables.pop()
+                        if any(cell for cell in row)
+                    ]
+                    if tables and tables[-1] and tables[-1][-1]:
+                        # Nested table: keep it inside the enclosing cell
+                        tables[-1][-1][-1].append('; '.join(rows))
+                    else:
+                        lines.extend(rows)
+                        size += sum(len(row) + 1 for row in rows)
+
+                if body is not None and depth == body_depth:
+                    # A top-level block just ended and has been rendered; drop it
+                    body.clear()
+                if max_chars is not None and size >= max_chars:
+                    lines.append("[DOCX truncated: character budget reached]")
+                    break
+
+    return '\n'.join(lines)
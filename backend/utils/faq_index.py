@@ -0,0 +1,379 @@
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import fast_json
+from .metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAQ_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "faq.json")
+DEFAULT_CHECKS_PATH = os.path.join(os.path.dirname(DEFAULT_FAQ_PATH), "faq_checks.json")
+
+# Function words that carry no meaning for matching (English and Indonesian)
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from how i in is it my of on or should the to what when
+where which who will with you your
+ada adalah agar akan apa apakah atau bagaimana bagi bisa buat dan dari dengan di harus ini itu
+jika kalau ke kapan mana saya untuk yang
+""".split())
+
+# Crops and pests: a question about one of these is never answered by a
+# phrasing about another (pemupukan cabai is not pemupukan padi). Curators
+# can add more with a top-level "subjects" list in the FAQ file
+SUBJECTS = frozenset("""
+padi beras gabah jagung kedelai kacang cabai cabe tomat terong bawang kentang singkong ubi tebu kopi
+kakao sawit karet kelapa pisang jeruk mangga durian melon semangka timun mentimun kangkung bayam
+sawi kubis kol wortel teh tembakau
+wereng walang tikus ulat thrips tungau kutu lalat keong belalang
+rice paddy corn maize soybean soybeans chili chilli pepper tomato tomatoes eggplant onion onions
+garlic potato potatoes cassava sugarcane coffee cocoa cacao banana orange mango cucumber cabbage
+carrot tea tobacco
+planthopper planthoppers rat rats caterpillar caterpillars mite mites aphid aphids snail snails
+""".split())
+
+# Confidence a match needs before its answer is served instead of the model's;
+# `faq.min_confidence` in config.json overrides it
+DEFAULT_MIN_CONFIDENCE = 0.8
+
+# Confidence factor for a phrasing whose subjects differ from the query's;
+# keeps such matches visible in searches but always below min_confidence
+SUBJECT_MISMATCH_PENALTY = 0.5
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    """Lowercase and strip accents"""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def words(text: str) -> List[str]:
+    """Content words of a text"""
+    return [word for word in _WORD_RE.findall(normalize(text)) if len(word) > 1 and word not in STOPWORDS]
+
+
+def trigrams(tokens: List[str]) -> Counter:
+    """Character trigrams of padded words, robust to typos and affixes (pupuk / pemupukan)"""
+    grams: Counter = Counter()
+    for token in tokens:
+        padded = f" {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class FaqEntry:
+    """Curated answer with the question phrasings it answers"""
+
+    def __init__(self, entry_id: str, questions: List[str], answer: str, tags: Optional[List[str]] = None):
+        self.id = entry_id
+        self.questions = questions
+        self.answer = answer
+        self.tags = tags or []
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "FaqEntry":
+        questions = data.get("questions") or [data["question"]]
+        return cls(str(data["id"]), list(questions), data["answer"], data.get("tags"))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "questions": self.questions, "answer": self.answer, "tags": self.tags}
+
+
+class FaqMatch:
+    """Best-matching entry for a query with its scores (0..1)"""
+
+    def __init__(self, entry: FaqEntry, question: str, confidence: float, lexical: float, semantic: float,
+                 mismatched: Optional[List[str]] = None):
+        self.entry = entry
+        self.question = question
+        self.confidence = confidence
+        self.lexical = lexical
+        self.semantic = semantic
+        self.mismatched = mismatched or []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.entry.id,
+            "question": self.question,
+            "confidence": round(self.confidence, 4),
+            "lexical": round(self.lexical, 4),
+            "semantic": round(self.semantic, 4),
+            "mismatched": self.mismatched,
+        }
+
+
+class FaqIndex:
+    """
+    Precomputed BM25 and character-trigram index over FAQ question phrasings
+
+    Every phrasing of every entry is one document. A query is scored two ways
+    against all of them through inverted indexes, so lookups stay in the
+    sub-millisecond range for a few thousand phrasings:
+
+    - lexical: BM25 over content words, divided by the summed IDF of all
+      query words. Query words the FAQ has never seen count against it, so a
+      question that merely shares a few terms with an entry scores low.
+    - semantic: cosine similarity of TF-IDF weighted character-trigram
+      vectors, which tolerates typos, inflection and word order.
+
+    Confidence is their weighted mean; the best phrasing per entry counts.
+    Subjects (crop and pest names, SUBJECTS) must agree: a phrasing that
+    names a subject the query doesn't, or misses one the query names, has
+    its confidence multiplied by SUBJECT_MISMATCH_PENALTY. Trigram overlap
+    alone would otherwise answer "daun tomat keriting" with the entry for
+    "daun cabai keriting".
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, entries: List[FaqEntry], subjects: Optional[List[str]] = None):
+        self.entries = entries
+        self.subjects = SUBJECTS | {normalize(subject) for subject in subjects or ()}
+        self.documents: List[Tuple[int, str]] = [
+            (position, question) for position, entry in enumerate(entries) for question in entry.questions
+        ]
+        count = len(self.documents)
+
+        # BM25 over words
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.lengths: List[int] = []
+        self.document_subjects: List[frozenset] = []
+        for doc, (_, question) in enumerate(self.documents):
+            tokens = words(question)
+            self.lengths.append(len(tokens))
+            self.document_subjects.append(frozenset(tokens) & self.subjects)
+            for term, frequency in Counter(tokens).items():
+                self.postings.setdefault(term, []).append((doc, frequency))
+        self.average_length = sum(self.lengths) / count if count else 0.0
+        self.idf = {term: self._idf(len(postings)) for term, postings in self.postings.items()}
+        self.unseen_idf = self._idf(0)
+
+        # Unit-length TF-IDF trigram vectors, stored as postings
+        gram_counts = [trigrams(words(question)) for _, question in self.documents]
+        document_frequency: Counter = Counter()
+        for grams in gram_counts:
+            document_frequency.update(grams.keys())
+        self.gram_idf = {gram: math.log((count + 1) / (frequency + 1)) + 1 for gram, frequency in document_frequency.items()}
+        self.unseen_gram_idf = math.log(count + 1) + 1
+        self.gram_postings: Dict[str, List[Tuple[int, float]]] = {}
+        for doc, grams in enumerate(gram_counts):
+            weights = {gram: frequency * self.gram_idf[gram] for gram, frequency in grams.items()}
+            norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+            for gram, weight in weights.items():
+                self.gram_postings.setdefault(gram, []).append((doc, weight / norm))
+
+    def _idf(self, document_frequency: int) -> float:
+        count = len(self.documents)
+        return math.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _lexical(self, tokens: List[str]) -> Dict[int, float]:
+        if not tokens:
+            return {}
+        scores: Dict[int, float] = {}
+        for term in set(tokens):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc, frequency in self.postings[term]:
+                length_norm = 1 - self.B + self.B * self.lengths[doc] / (self.average_length or 1.0)
+                scores[doc] = scores.get(doc, 0.0) + idf * frequency * (self.K1 + 1) / (frequency + self.K1 * length_norm)
+        ceiling = sum(self.idf.get(term, self.unseen_idf) for term in set(tokens))
+        return {doc: min(1.0, score / ceiling) for doc, score in scores.items()}
+
+    def _semantic(self, tokens: List[str]) -> Dict[int, float]:
+        grams = trigrams(tokens)
+        if not grams:
+            return {}
+        weights = {gram: frequency * self.gram_idf.get(gram, self.unseen_gram_idf) for gram, frequency in grams.items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        scores: Dict[int, float] = {}
+        for gram, weight in weights.items():
+            for doc, doc_weight in self.gram_postings.get(gram, ()):
+                scores[doc] = scores.get(doc, 0.0) + weight * doc_weight
+        return {doc: score / norm for doc, score in scores.items()}
+
+    def search(self, query: str, limit: int = 3, lexical_weight: float = 0.5) -> List[FaqMatch]:
+        """
+        Rank entries for a query
+
+        Args:
+            query: User question
+            limit: Maximum number of entries returned
+            lexical_weight: Share of the BM25 score in the confidence
+
+        Returns:
+            Matches, best first, at most one per entry
+        """
+        tokens = words(query)
+        query_subjects = frozenset(tokens) & self.subjects
+        lexical = self._lexical(tokens)
+        semantic = self._semantic(tokens)
+        best: Dict[int, FaqMatch] = {}
+        for doc in set(lexical) | set(semantic):
+            lexical_score = lexical.get(doc, 0.0)
+            semantic_score = semantic.get(doc, 0.0)
+            confidence = lexical_weight * lexical_score + (1 - lexical_weight) * semantic_score
+            mismatched = sorted(query_subjects ^ self.document_subjects[doc])
+            if mismatched:
+                confidence *= SUBJECT_MISMATCH_PENALTY
+            position, question = self.documents[doc]
+            if position not in best or confidence > best[position].confidence:
+                best[position] = FaqMatch(
+                    self.entries[position], question, confidence, lexical_score, semantic_score, mismatched
+                )
+        return sorted(best.values(), key=lambda match: -match.confidence)[:limit]
+
+
+class FaqStore:
+    """
+    FAQ file loaded into an FaqIndex and rebuilt whenever the file changes
+
+    The file is JSON with an `entries` list of
+    `{"id", "questions": [...], "answer", "tags"}` objects. Like ConfigStore,
+    each lookup costs one `os.stat`; a changed file is re-indexed and swapped
+    in atomically, and a broken edit keeps the previous index.
+    """
+
+    def __init__(self, path: Optional[str] = None, metrics: Optional[Metrics] = None):
+        self.path = path or os.getenv("KANGTANI_FAQ_PATH", DEFAULT_FAQ_PATH)
+        self.metrics = metrics
+        self._index = FaqIndex([])
+        self._signature = None
+        self.loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _build(self) -> FaqIndex:
+        with open(self.path, "rb") as file:
+            data = fast_json.loads(file.read())
+        entries = [FaqEntry.from_dict(item) for item in data.get("entries", [])]
+        return FaqIndex(entries, data.get("subjects"))
+
+    def reload(self) -> Dict[str, Any]:
+        """Re-read and re-index the FAQ file now; raises if it cannot be loaded"""
+        with self._lock:
+            signature = self._stat()
+            if signature is None:
+                raise FileNotFoundError(f"FAQ file {self.path} not found")
+            start_time = time.perf_counter()
+            self._index = self._build()
+            self._signature = signature
+            self.loaded_at = time.time()
+            build_time = time.perf_counter() - start_time
+        if self.metrics is not None:
+            self.metrics.set_gauge("faq_entries", len(self._index))
+        logger.info(f"Loaded {len(self._index)} FAQ entries from {self.path} in {build_time * 1000:.1f}ms")
+        return self.status()
+
+    @property
+    def index(self) -> FaqIndex:
+        """Current index, rebuilt first if the file changed"""
+        signature = self._stat()
+        if signature != self._signature:
+            if signature is None:
+                if self._signature is not None:
+                    logger.warning(f"FAQ file {self.path} disappeared, keeping the loaded index")
+                self._signature = None
+            else:
+                try:
+                    self.reload()
+                except Exception as e:
+                    logger.error(f"Failed to load FAQ {self.path}, keeping previous index: {e}")
+                    self._signature = signature
+        return self._index
+
+    def lookup(self, message: str, min_confidence: float = DEFAULT_MIN_CONFIDENCE, lexical_weight: float = 0.5) -> Optional[FaqMatch]:
+        """Best match if its confidence reaches `min_confidence`, else None; records hit/miss metrics"""
+        start_time = time.perf_counter()
+        matches = self.index.search(message, limit=1, lexical_weight=lexical_weight)
+        match = matches[0] if matches and matches[0].confidence >= min_confidence else None
+        if self.metrics is not None:
+            self.metrics.observe("faq_lookup_seconds", time.perf_counter() - start_time)
+            self.metrics.increment("faq_lookups_total", labels={"outcome": "hit" if match else "miss"})
+            if matches:
+                self.metrics.observe("faq_confidence", matches[0].confidence)
+        return match
+
+    def status(self) -> Dict[str, Any]:
+        status = {
+            "path": self.path,
+            "entries": len(self._index),
+            "phrasings": len(self._index.documents),
+            "loaded_at": self.loaded_at,
+        }
+        if self.metrics is not None:
+            hits = self.metrics.counter("faq_lookups_total", {"outcome": "hit"})
+            misses = self.metrics.counter("faq_lookups_total", {"outcome": "miss"})
+            status.update(hits=hits, misses=misses, hit_rate=hits / (hits + misses) if hits + misses else None)
+        return status
+
+
+def check(store: FaqStore, cases: List[Dict[str, Any]], min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+          lexical_weight: float = 0.5) -> List[Dict[str, Any]]:
+    """
+    Run regression cases against the FAQ; returns the cases that failed
+
+    Each case is `{"query", "expect"}`, where `expect` is the entry id the
+    query must be answered with, or null if it must go to the model.
+    """
+    failures = []
+    for case in cases:
+        match = store.lookup(case["query"], min_confidence, lexical_weight)
+        matched = match.entry.id if match else None
+        if matched != case.get("expect"):
+            best = store.index.search(case["query"], limit=1, lexical_weight=lexical_weight)
+            failures.append({**case, "matched": matched, "best": best[0].to_dict() if best else None})
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the Kangtani.ai FAQ or run its regression cases")
+    parser.add_argument("--faq", help=f"FAQ file (default: $KANGTANI_FAQ_PATH or {DEFAULT_FAQ_PATH})")
+    parser.add_argument("--min-confidence", type=float, default=DEFAULT_MIN_CONFIDENCE)
+    parser.add_argument("--lexical-weight", type=float, default=0.5)
+    commands = parser.add_subparsers(dest="command", required=True)
+    search = commands.add_parser("search", help="Print the best matches for a question")
+    search.add_argument("query")
+    search.add_argument("--limit", type=int, default=3)
+    run_checks = commands.add_parser("check", help="Run regression cases; exits non-zero on a failure")
+    run_checks.add_argument("--cases", default=DEFAULT_CHECKS_PATH, help=f"Cases file (default: {DEFAULT_CHECKS_PATH})")
+    args = parser.parse_args()
+
+    store = FaqStore(args.faq)
+    if args.command == "search":
+        matches = store.index.search(args.query, limit=args.limit, lexical_weight=args.lexical_weight)
+        print(json.dumps([match.to_dict() for match in matches], ensure_ascii=False, indent=2))
+        return
+    with open(args.cases, "rb") as file:
+        cases = fast_json.loads(file.read())["cases"]
+    failures = check(store, cases, args.min_confidence, args.lexical_weight)
+    for failure in failures:
+        print(json.dumps(failure, ensure_ascii=False))
+    print(f"{len(cases) - len(failures)}/{len(cases)} FAQ cases passed")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
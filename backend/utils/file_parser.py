@@ -1,20 +1,56 @@
+import asyncio
 import logging
 import io
-import tempfile
+import mmap
 import os
-from typing import Optional, Union
+import re
+import hashlib
+from concurrent.futures import Executor
+from typing import Dict, List, Optional, Tuple, Union
 import base64
 
+from .csv_summary import CsvIndexCache, CsvSummarizer
+from .docx_stream import extract_docx_text
+from .json_stream import JsonTextRenderer, iter_events
+from .text_extract import decode_bytes, normalize_whitespace, strip_html, strip_rtf, strip_xml
+
 logger = logging.getLogger(__name__)
 
+# Placeholders the parsers and ASR return instead of raising, e.g. "[PDF parsing failed: ...]"
+PLACEHOLDER = re.compile(r"^\[[^\]\n]*(failed|requires|Unsupported|received)[^\]\n]*\]$")
+
+
+def is_placeholder(text: str) -> bool:
+    """True if a parse or transcription result is an error placeholder rather than content"""
+    return bool(PLACEHOLDER.match(text))
+
 class FileParser:
-    def __init__(self):
+    TEXT_EXTENSIONS = {'.txt', '.md', '.xml', '.html', '.htm', '.rtf', '.doc'}
+    MMAP_THRESHOLD = 8 * 1024 * 1024
+    
+    def __init__(self, executor: Optional[Executor] = None):
+        # Parsing is CPU/IO bound and runs off the event loop on this executor
+        # (None means the loop's default thread pool)
+        self.executor = executor
         self.supported_extensions = {
             '.txt', '.md', '.csv', '.json', '.xml', '.html', '.htm',
             '.pdf', '.docx', '.doc', '.rtf'
         }
+        self.csv_summarizer = CsvSummarizer()
+        self.csv_indexes = CsvIndexCache()
+        self.json_renderer = JsonTextRenderer()
     
     async def parse_file(self, filename: str, file_content: bytes) -> str:
+        """Parse file content in a worker thread, see parse_file_sync"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.parse_file_sync, filename, file_content)
+    
+    async def parse_content(self, content: str) -> str:
+        """Clean up inline text content in a worker thread, see parse_content_sync"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.parse_content_sync, content)
+    
+    def parse_file_sync(self, filename: str, file_content: bytes) -> str:
         """
         Parse file content based on file extension
         
@@ -31,34 +67,37 @@ class FileParser:
             if file_extension not in self.supported_extensions:
                 return f"[Unsupported file type: {file_extension}]"
             
-            # Save to temporary file for processing
-            with tempfile.NamedTemporaryFile(suffix=file_extension, delete=False) as temp_file:
-                temp_file.write(file_content)
-                temp_file_path = temp_file.name
-            
-            try:
-                if file_extension == '.pdf':
-                    return await self._parse_pdf(temp_file_path)
-                elif file_extension == '.csv':
-                    return await self._parse_csv(temp_file_path)
-                elif file_extension == '.docx':
-                    return await self._parse_docx(temp_file_path)
-                elif file_extension == '.json':
-                    return await self._parse_json(temp_file_path)
-                elif file_extension in ['.txt', '.md', '.html', '.htm', '.xml', '.rtf']:
-                    return await self._parse_text(temp_file_path)
-                else:
-                    return await self._parse_text(temp_file_path)
-            finally:
-                # Clean up temporary file
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
+            # Everything is parsed from the in-memory buffer, no temporary files
+            if file_extension == '.csv':
+                return self._parse_csv(file_content)
+            if file_extension == '.json':
+                return self._parse_json(file_content)
+            if file_extension == '.docx':
+                return self._parse_docx(file_content)
+            if file_extension == '.pdf':
+                return self._parse_pdf(file_content)
+            return self._parse_text(file_content, file_extension)
                     
         except Exception as e:
             logger.error(f"File parsing failed for {filename}: {e}")
             return f"[File parsing failed: {str(e)}]"
     
-    async def parse_content(self, content: str) -> str:
+    def parse_path(self, path: str) -> str:
+        """
+        Parse a file on disk
+        
+        Text-like files above MMAP_THRESHOLD bytes are memory-mapped rather
+        than copied into memory; decoding and markup stripping read the
+        mapped buffer directly.
+        """
+        file_extension = self._get_file_extension(path)
+        if file_extension in self.TEXT_EXTENSIONS and os.path.getsize(path) > self.MMAP_THRESHOLD:
+            with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return self._parse_text(mapped, file_extension)
+        with open(path, 'rb') as file:
+            return self.parse_file_sync(os.path.basename(path), file.read())
+    
+    def parse_content_sync(self, content: str) -> str:
         """
         Parse content string (for when content is already provided as text)
         
@@ -81,18 +120,17 @@ class FileParser:
         """Extract file extension from filename"""
         return os.path.splitext(filename.lower())[1]
     
-    async def _parse_pdf(self, file_path: str) -> str:
+    def _parse_pdf(self, file_content: bytes) -> str:
         """Parse PDF file"""
         try:
             # Try PyPDF2 first
             try:
                 import PyPDF2
-                with open(file_path, 'rb') as file:
-                    pdf_reader = PyPDF2.PdfReader(file)
-                    text = ""
-                    for page in pdf_reader.pages:
-                        text += page.extract_text() + "\n"
-                    return text.strip()
+                pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
+                text = ""
+                for page in pdf_reader.pages:
+                    text += (page.extract_text() or "") + "\n"
+                return text.strip()
             except ImportError:
                 pass
             
@@ -100,9 +138,9 @@ class FileParser:
             try:
                 import pdfplumber
                 text = ""
-                with pdfplumber.open(file_path) as pdf:
+                with pdfplumber.open(io.BytesIO(file_content)) as pdf:
                     for page in pdf.pages:
-                        text += page.extract_text() + "\n"
+                        text += (page.extract_text() or "") + "\n"
                 return text.strip()
             except ImportError:
                 pass
@@ -114,116 +152,111 @@ class FileParser:
             logger.error(f"PDF parsing failed: {e}")
             return f"[PDF parsing failed: {str(e)}]"
     
-    async def _parse_csv(self, file_path: str) -> str:
-        """Parse CSV file"""
+    def _parse_csv(self, file_content: bytes) -> str:
+        """Summarize CSV file (schema, stats, head/tail, group totals)"""
         try:
-            import csv
-            
-            with open(file_path, 'r', encoding='utf-8') as file:
-                csv_reader = csv.reader(file)
-                rows = list(csv_reader)
-                
-                if not rows:
-                    return "[Empty CSV file]"
-                
-                # Convert to readable format
-                text_lines = []
-                for i, row in enumerate(rows):
-                    text_lines.append(f"Row {i+1}: {', '.join(row)}")
-                
-                return '\n'.join(text_lines)
+            index_id = hashlib.sha256(file_content).hexdigest()[:16]
+            summary, index = self.csv_summarizer.summarize(file_content, index_id=index_id)
+            if index is not None:
+                self.csv_indexes.put(index)
+                logger.info(f"CSV indexed: {index.row_count} rows, lookup id {index_id}")
+            return summary
                 
         except Exception as e:
             logger.error(f"CSV parsing failed: {e}")
             return f"[CSV parsing failed: {str(e)}]"
     
-    async def _parse_docx(self, file_path: str) -> str:
-        """Parse DOCX file"""
-        try:
-            from docx import Document
+    def lookup_csv_rows(self, index_id: str, column: str, value: str, limit: int = 20) -> Optional[List[Dict[str, str]]]:
+        """
+        Look up full rows of a previously parsed CSV
+        
+        Args:
+            index_id: Lookup id printed in the CSV summary
+            column: Column name to match
+            value: Value to match (case-insensitive)
+            limit: Maximum number of rows
             
-            doc = Document(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text.strip()
+        Returns:
+            Matching rows, or None if the CSV is no longer indexed
+        """
+        index = self.csv_indexes.get(index_id)
+        if index is None:
+            return None
+        return index.lookup(column, value, limit)
+    
+    def _parse_docx(self, file_content: bytes) -> str:
+        """Parse DOCX file, paragraphs and tables in document order"""
+        try:
+            return extract_docx_text(io.BytesIO(file_content))
             
-        except ImportError:
-            return "[DOCX parsing requires python-docx. Install with: pip install python-docx]"
         except Exception as e:
             logger.error(f"DOCX parsing failed: {e}")
             return f"[DOCX parsing failed: {str(e)}]"
     
-    async def _parse_json(self, file_path: str) -> str:
-        """Parse JSON file"""
+    def _parse_json(self, file_content: bytes) -> str:
+        """Render JSON file as text in one streaming pass"""
         try:
-            import json
-            
-            with open(file_path, 'r', encoding='utf-8') as file:
-                data = json.load(file)
-                
-                # Convert JSON to readable text format
-                if isinstance(data, dict):
-                    return self._dict_to_text(data)
-                elif isinstance(data, list):
-                    return self._list_to_text(data)
-                else:
-                    return str(data)
+            return self.json_renderer.render(iter_events(file_content))
                     
         except Exception as e:
             logger.error(f"JSON parsing failed: {e}")
             return f"[JSON parsing failed: {str(e)}]"
     
-    async def _parse_text(self, file_path: str) -> str:
-        """Parse text file"""
+    def _parse_text(self, file_content, file_extension: str = '.txt') -> str:
+        """
+        Parse text-like file from memory
+        
+        The buffer is decoded once with the detected encoding; HTML, XML and
+        RTF markup is stripped to the visible text before normalizing
+        whitespace, so tags don't end up in the prompt.
+        """
         try:
-            # Try different encodings
-            encodings = ['utf-8', 'latin-1', 'cp1252']
-            
-            for encoding in encodings:
-                try:
-                    with open(file_path, 'r', encoding=encoding) as file:
-                        content = file.read()
-                        return content.strip()
-                except UnicodeDecodeError:
-                    continue
-            
-            # If all encodings fail, try binary read
-            with open(file_path, 'rb') as file:
-                content = file.read()
-                return content.decode('utf-8', errors='ignore').strip()
+            if file_extension == '.xml':
+                text = strip_xml(file_content)
+            else:
+                text = decode_bytes(file_content)
+                if file_extension in ('.html', '.htm'):
+                    text = strip_html(text)
+                elif file_extension == '.rtf' or text.startswith('{\\rtf'):
+                    text = strip_rtf(text)
+            return normalize_whitespace(text)
                 
         except Exception as e:
             logger.error(f"Text parsing failed: {e}")
             return f"[Text parsing failed: {str(e)}]"
     
-    def _dict_to_text(self, data: dict, indent: int = 0) -> str:
-        """Convert dictionary to readable text"""
-        lines = []
-        for key, value in data.items():
-            if isinstance(value, dict):
-                lines.append(f"{'  ' * indent}{key}:")
-                lines.append(self._dict_to_text(value, indent + 1))
-            elif isinstance(value, list):
-                lines.append(f"{'  ' * indent}{key}:")
-                lines.append(self._list_to_text(value, indent + 1))
-            else:
-                lines.append(f"{'  ' * indent}{key}: {value}")
-        return '\n'.join(lines)
-    
-    def _list_to_text(self, data: list, indent: int = 0) -> str:
-        """Convert list to readable text"""
-        lines = []
-        for i, item in enumerate(data):
-            if isinstance(item, dict):
-                lines.append(f"{'  ' * indent}Item {i+1}:")
-                lines.append(self._dict_to_text(item, indent + 1))
-            elif isinstance(item, list):
-                lines.append(f"{'  ' * indent}Item {i+1}:")
-                lines.append(self._list_to_text(item, indent + 1))
-            else:
-                lines.append(f"{'  ' * indent}Item {i+1}: {item}")
-        return '\n'.join(lines)
+    def merge_parsed(self, sections: List[Tuple[str, str]], max_chars: int) -> str:
+        """
+        Merge several parsed files into one context under a shared size budget
+        
+        The budget is split fairly: files shorter than an equal share keep all
+        of their text and the unused remainder is shared among longer files,
+        which keep their beginning and end.
+        
+        Args:
+            sections: (filename, parsed text) pairs
+            max_chars: Total character budget for all file texts
+            
+        Returns:
+            Merged context with a header per file
+        """
+        budgets = {}
+        remaining = max_chars
+        pending = sorted(range(len(sections)), key=lambda i: len(sections[i][1]))
+        while pending:
+            share = remaining // len(pending)
+            index = pending.pop(0)
+            budgets[index] = min(len(sections[index][1]), share)
+            remaining -= budgets[index]
+        
+        merged = []
+        for index, (filename, text) in enumerate(sections):
+            budget = budgets[index]
+            if len(text) > budget:
+                head = budget * 2 // 3
+                text = f"{text[:head]}\n[... {len(text) - budget} characters omitted ...]\n{text[len(text) - (budget - head):]}"
+            merged.append(f"[File: {filename}]\n{text}")
+        return '\n\n'.join(merged)
     
     def is_supported_file(self, filename: str) -> bool:
         """Check if file type is supported"""
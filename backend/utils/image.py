@@ -0,0 +1,143 @@
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Dict, Optional
+
+try:
+    from PIL import Image, ImageOps
+    HAS_PIL = True
+except ImportError:
+    Image = ImageOps = None
+    HAS_PIL = False
+
+logger = logging.getLogger(__name__)
+
+# gemma3n's vision encoder works on 768x768 inputs; larger images only cost encode time
+DEFAULT_MAX_SIDE = 768
+DEFAULT_QUALITY = 85
+# Refuse decompression bombs well before they exhaust memory
+MAX_PIXELS = 50_000_000
+
+
+class PreparedImage:
+    """Image re-encoded for the model, with its source size for logging"""
+
+    def __init__(self, data: bytes, width: int, height: int, source_bytes: int, source_size: tuple):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.source_bytes = source_bytes
+        self.source_size = source_size
+
+    @property
+    def base64(self) -> str:
+        """Encoding expected by Ollama's `images` field"""
+        return base64.b64encode(self.data).decode("ascii")
+
+    def to_dict(self) -> Dict:
+        return {
+            "width": self.width,
+            "height": self.height,
+            "bytes": len(self.data),
+            "source_bytes": self.source_bytes,
+            "source_width": self.source_size[0],
+            "source_height": self.source_size[1],
+        }
+
+
+class ImageProcessor:
+    """
+    Decode, orient, downscale and re-encode uploaded photos for a multimodal model
+
+    Phone photos are several megabytes at 12+ megapixels; the model only sees
+    `max_side` pixels on the long edge. Each upload is decoded (JPEGs with
+    draft mode, which lets libjpeg scale down while decoding), rotated
+    according to its EXIF orientation, shrunk to fit `max_side` and stored as
+    a baseline JPEG. The work runs on `executor`; results are cached by the
+    SHA-256 of the upload, and concurrent uploads of the same photo share one
+    conversion.
+    """
+
+    def __init__(self, executor: Optional[Executor] = None, max_side: int = DEFAULT_MAX_SIDE,
+                 quality: int = DEFAULT_QUALITY, cache_entries: int = 64):
+        self.executor = executor
+        self.max_side = max_side
+        self.quality = quality
+        self.cache_entries = cache_entries
+        self._cache: "OrderedDict[str, PreparedImage]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        if not HAS_PIL:
+            logger.warning("Pillow not available, image uploads are disabled. Install with: pip install Pillow")
+
+    def _key(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{digest}:{self.max_side}:{self.quality}"
+
+    def prepare_sync(self, data: bytes) -> PreparedImage:
+        """
+        Convert one image
+
+        Raises:
+            RuntimeError: Pillow is not installed
+            ValueError: Not a decodable image, or too many pixels
+        """
+        if not HAS_PIL:
+            raise RuntimeError("Image support requires Pillow (pip install Pillow)")
+        try:
+            image = Image.open(io.BytesIO(data))
+            source_size = image.size
+            if source_size[0] * source_size[1] > MAX_PIXELS:
+                raise ValueError(f"Image too large: {source_size[0]}x{source_size[1]} pixels")
+            # JPEG only: decode at the smallest 1/2^n scale still above the target
+            image.draft("RGB", (self.max_side, self.max_side))
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+            image.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=self.quality)
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Unsupported or corrupt image ({type(e).__name__})") from e
+        return PreparedImage(output.getvalue(), image.width, image.height, len(data), source_size)
+
+    async def prepare(self, data: bytes) -> PreparedImage:
+        """Convert an image on the executor, reusing cached and in-flight conversions"""
+        key = self._key(data)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self.prepare_sync, data)
+        self._pending[key] = future
+        try:
+            prepared = await asyncio.shield(future)
+        finally:
+            self._pending.pop(key, None)
+        with self._lock:
+            self._cache[key] = prepared
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        logger.info(
+            f"Image {prepared.source_size[0]}x{prepared.source_size[1]} -> {prepared.width}x{prepared.height}, "
+            f"{prepared.source_bytes} -> {len(prepared.data)} bytes"
+        )
+        return prepared
@@ -0,0 +1,260 @@
+import io
+import logging
+import re
+from json.decoder import scanstring
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Event = Tuple[str, Any]
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER = re.compile(r'(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?')
+_CONTAINER_START = {'start_map': 'map', 'start_array': 'array'}
+_CONTAINER_END = {'end_map', 'end_array'}
+_EXPECTED = {'value': "Expected value", 'key': "Expected key", ':': "Expected ':'", 'end': "Extra data"}
+
+
+def _basic_parse(text: str) -> Iterator[Event]:
+    """
+    Minimal ijson-compatible event stream over a JSON document
+
+    Yields the same (event, value) pairs as ``ijson.basic_parse`` without
+    ever materializing the document tree. Each container tracks which token
+    may come next, so a missing or stray separator raises ValueError:
+
+    >>> list(_basic_parse('{"a": [1, true]}'))  # doctest: +NORMALIZE_WHITESPACE
+    [('start_map', None), ('map_key', 'a'), ('start_array', None),
+     ('number', 1), ('boolean', True), ('end_array', None), ('end_map', None)]
+    >>> list(_basic_parse('{"a" 1 "b" 2}'))
+    Traceback (most recent call last):
+    ValueError: Expected ':' at position 5
+    >>> list(_basic_parse('[1,2,,,3 true]'))
+    Traceback (most recent call last):
+    ValueError: Expected value at position 5
+    >>> list(_basic_parse('[1, 2 3]'))
+    Traceback (most recent call last):
+    ValueError: Expected ',' or ']' at position 6
+    >>> list(_basic_parse('{"a": 1,}'))
+    Traceback (most recent call last):
+    ValueError: Expected key at position 8
+    >>> list(_basic_parse('[1] 2'))
+    Traceback (most recent call last):
+    ValueError: Extra data at position 4
+    """
+    pos = 0
+    end = len(text)
+    containers: List[str] = []
+    # What may come next: 'value', 'key', ':', 'comma' (or close), 'end'
+    expect = 'value'
+    # Whether the open container may be closed before its first item
+    empty = False
+
+    def unexpected() -> ValueError:
+        if expect == 'comma':
+            closer = '}' if containers[-1] == 'map' else ']'
+            return ValueError(f"Expected ',' or '{closer}' at position {pos}")
+        return ValueError(f"{_EXPECTED[expect]} at position {pos}")
+
+    while True:
+        pos = _WHITESPACE.match(text, pos).end()
+        if pos >= end:
+            break
+        char = text[pos]
+
+        if char in '}]':
+            kind = 'map' if char == '}' else 'array'
+            if not containers or containers[-1] != kind:
+                raise ValueError(f"Unexpected '{char}' at position {pos}")
+            if expect != 'comma' and not empty:
+                raise unexpected()
+            containers.pop()
+            expect = 'comma' if containers else 'end'
+            empty = False
+            pos += 1
+            yield ('end_map' if char == '}' else 'end_array'), None
+            continue
+        if char == ',':
+            if expect != 'comma':
+                raise unexpected()
+            expect = 'key' if containers[-1] == 'map' else 'value'
+            pos += 1
+            continue
+        if char == ':':
+            if expect != ':':
+                raise unexpected()
+            expect = 'value'
+            pos += 1
+            continue
+        if char == '"' and expect == 'key':
+            value, pos = scanstring(text, pos + 1)
+            expect = ':'
+            empty = False
+            yield 'map_key', value
+            continue
+        if expect != 'value':
+            raise unexpected()
+
+        empty = False
+        expect = 'comma' if containers else 'end'
+        if char == '{':
+            containers.append('map')
+            expect = 'key'
+            empty = True
+            pos += 1
+            yield 'start_map', None
+        elif char == '[':
+            containers.append('array')
+            expect = 'value'
+            empty = True
+            pos += 1
+            yield 'start_array', None
+        elif char == '"':
+            value, pos = scanstring(text, pos + 1)
+            yield 'string', value
+        elif text.startswith('true', pos):
+            pos += 4
+            yield 'boolean', True
+        elif text.startswith('false', pos):
+            pos += 5
+            yield 'boolean', False
+        elif text.startswith('null', pos):
+            pos += 4
+            yield 'null', None
+        else:
+            match = _NUMBER.match(text, pos)
+            if not match:
+                raise ValueError(f"Invalid JSON at position {pos}")
+            integer, fraction, exponent = match.groups()
+            pos = match.end()
+            if fraction or exponent:
+                yield 'number', float(match.group())
+            else:
+                yield 'number', int(integer)
+
+    if expect != 'end':
+        raise ValueError("Unexpected end of JSON document")
+
+
+def iter_events(data: bytes) -> Iterator[Event]:
+    """Stream parse events from JSON bytes, using ijson when it is installed"""
+    try:
+        import ijson
+        return ijson.basic_parse(io.BytesIO(data))
+    except ImportError:
+        return _basic_parse(data.decode('utf-8-sig'))
+
+
+class _Frame:
+    __slots__ = ('kind', 'indent', 'key', 'items', 'hidden', 'numbers', 'minimum', 'maximum', 'total')
+
+    def __init__(self, kind: str, indent: int):
+        self.kind = kind
+        self.indent = indent
+        self.key: Optional[str] = None
+        self.items = 0
+        self.hidden = 0
+        self.numbers = 0
+        self.minimum = None
+        self.maximum = None
+        self.total = 0.0
+
+    def add_number(self, value) -> None:
+        value = float(value)
+        self.numbers += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def summary(self) -> str:
+        text = f"... {self.hidden} more items ({self.items} total)"
+        if self.numbers:
+            text += (f"; numeric values: min={self.minimum:g} max={self.maximum:g} "
+                     f"mean={self.total / self.numbers:g}")
+        return text
+
+
+class JsonTextRenderer:
+    """
+    Render a JSON event stream as indented text in a single pass
+
+    Nesting deeper than `max_depth` is collapsed, arrays longer than
+    `max_array_items` are summarized, and rendering stops as soon as
+    `max_chars` is reached so the rest of the document is never parsed.
+    """
+
+    def __init__(self, max_depth: int = 8, max_chars: int = 8000, max_array_items: int = 10):
+        self.max_depth = max_depth
+        self.max_chars = max_chars
+        self.max_array_items = max_array_items
+
+    def render(self, events: Iterable[Event]) -> str:
+        lines: List[str] = []
+        size = 0
+        stack: List[_Frame] = []
+        skipping = 0
+
+        for event, value in events:
+            if skipping:
+                if event in _CONTAINER_START:
+                    skipping += 1
+                elif event in _CONTAINER_END:
+                    skipping -= 1
+                continue
+
+            if event == 'map_key':
+                stack[-1].key = value
+                continue
+
+            if event in _CONTAINER_END:
+                frame = stack.pop()
+                line = f"{'  ' * frame.indent}{frame.summary()}" if frame.hidden else None
+            else:
+                line = self._child(event, value, stack)
+                if stack and stack[-1].kind == 'skip':
+                    # Collapsed container: consume its events without rendering
+                    stack.pop()
+                    skipping = 1
+
+            if line is not None:
+                lines.append(line)
+                size += len(line) + 1
+                if size > self.max_chars:
+                    lines.append("[JSON truncated: character budget reached]")
+                    break
+
+        return '\n'.join(lines)
+
+    def _child(self, event: str, value, stack: List[_Frame]) -> Optional[str]:
+        """Handle a scalar or container start; returns the line to emit, if any"""
+        label = None
+        indent = 0
+        if stack:
+            parent = stack[-1]
+            indent = parent.indent
+            if parent.kind == 'array':
+                parent.items += 1
+                if event == 'number':
+                    parent.add_number(value)
+                if parent.items > self.max_array_items:
+                    parent.hidden += 1
+                    if event in _CONTAINER_START:
+                        stack.append(_Frame('skip', indent))
+                    return None
+                label = f"Item {parent.items}"
+            else:
+                label = parent.key
+
+        prefix = '  ' * indent
+        if event in _CONTAINER_START:
+            kind = _CONTAINER_START[event]
+            if len(stack) >= self.max_depth:
+                stack.append(_Frame('skip', indent))
+                placeholder = '{...}' if kind == 'map' else '[...]'
+                return f"{prefix}{label}: {placeholder}"
+            stack.append(_Frame(kind, indent + (1 if label is not None else 0)))
+            return f"{prefix}{label}:" if label is not None else None
+
+        return f"{prefix}{label}: {value}" if label is not None else str(value)
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+
+def _key(name: str, labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return name
+    rendered = ",".join(f"{key}={value}" for key, value in sorted(labels.items()))
+    return f"{name}{{{rendered}}}"
+
+
+class _Summary:
+    """Count, sum and a sliding window of recent values for percentiles"""
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.total = 0.0
+        self.recent: deque = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.recent.append(value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+
+class Metrics:
+    """
+    In-process counters, gauges and latency summaries
+
+    Metric names may carry labels, rendered Prometheus-style as
+    `name{label=value}` in snapshots.
+    """
+
+    def __init__(self, window: int = 1024):
+        self.window = window
+        self.started_at = time.time()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._summaries: Dict[str, _Summary] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, labels: Optional[Dict[str, str]] = None) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = _Summary(self.window)
+            summary.observe(value)
+
+    def counter(self, name: str, labels: Optional[Dict[str, str]] = None) -> float:
+        return self._counters.get(_key(name, labels), 0)
+
+    def percentile(self, name: str, q: float, labels: Optional[Dict[str, str]] = None) -> Optional[float]:
+        summary = self._summaries.get(_key(name, labels))
+        return summary.percentile(q) if summary else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "uptime_seconds": time.time() - self.started_at,
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "latency": {key: summary.snapshot() for key, summary in self._summaries.items()},
+            }
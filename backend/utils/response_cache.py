@@ -0,0 +1,149 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .faq_index import normalize
+from .metrics import Metrics
+from .shared_state import MemoryKV
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(message: str) -> str:
+    """Case, accent, whitespace and trailing punctuation insensitive form of a question"""
+    return " ".join(normalize(message).split()).rstrip("?!. ")
+
+
+class ResponseCache:
+    """
+    Generated answers with a time to live, in a (possibly shared) key/value store
+
+    Keys combine the generation profile with the normalized question, so
+    "Kapan pupuk padi?" and "kapan pupuk  padi" share one entry per profile.
+    Values are plain dicts (`response`, `profile`, `source`, `created_at`).
+    With a SqliteKV or RedisKV store every worker process sees the answers
+    the others generated; the default MemoryKV is an LRU of this process.
+    """
+
+    NAMESPACE = "responses"
+
+    def __init__(self, max_entries: int = 2000, ttl: float = 86400.0, metrics: Optional[Metrics] = None, store=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.metrics = metrics
+        self.store = store if store is not None else MemoryKV()
+
+    @staticmethod
+    def key(message: str, profile_name: str) -> str:
+        return hashlib.sha256(f"{profile_name}\n{normalize_question(message)}".encode("utf-8")).hexdigest()[:32]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Cached value, or None if missing or expired; records hit/miss metrics"""
+        value = self.store.get(self.NAMESPACE, key)
+        if self.metrics is not None:
+            outcome = "miss" if value is None else f"hit_{value.get('source', 'live')}"
+            self.metrics.increment("response_cache_lookups_total", labels={"outcome": outcome})
+        return value
+
+    def put(self, key: str, response: str, profile_name: str, source: str = "live") -> None:
+        """Store an answer; store errors are logged, the answer itself is never lost"""
+        value = {"response": response, "profile": profile_name, "source": source, "created_at": time.time()}
+        try:
+            self.store.set(self.NAMESPACE, key, value, self.ttl, self.max_entries)
+        except Exception as e:
+            logger.warning(f"Response cache store failed: {e}")
+            return
+        if self.metrics is not None:
+            self.metrics.increment("response_cache_stores_total", labels={"source": source})
+
+    def expires_in(self, key: str) -> Optional[float]:
+        """Seconds until an entry expires (None if absent); does not count as a lookup"""
+        return self.store.expires_in(self.NAMESPACE, key)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Entry count and hit rate; queries the store, so call it off the event loop
+
+        Only counts entries, never loads them. `stored` is the number of
+        answers this process stored per source (live or prewarm).
+        """
+        stats = {
+            "entries": self.store.count(self.NAMESPACE),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "backend": self.store.backend
+        }
+        if self.metrics is not None:
+            stats["stored"] = {
+                source: self.metrics.counter("response_cache_stores_total", {"source": source})
+                for source in ("live", "prewarm")
+            }
+            misses = self.metrics.counter("response_cache_lookups_total", {"outcome": "miss"})
+            hits = sum(
+                self.metrics.counter("response_cache_lookups_total", {"outcome": f"hit_{source}"})
+                for source in ("live", "prewarm")
+            )
+            stats["hit_rate"] = hits / (hits + misses) if hits + misses else None
+        return stats
+
+
+class PromptLog:
+    """
+    Rolling log of recent plain questions, mined for frequent and trending ones
+
+    Bounded to `max_entries` questions; entries older than the mining window
+    simply stop counting.
+    """
+
+    def __init__(self, max_entries: int = 20000):
+        self._entries: Deque[Tuple[float, str, str, str]] = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def record(self, message: str, profile_name: str, timestamp: Optional[float] = None) -> None:
+        entry = (timestamp or time.time(), normalize_question(message), message, profile_name)
+        with self._lock:
+            self._entries.append(entry)
+
+    def top(self, history_seconds: float, trend_seconds: float, min_count: int = 2, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Most asked questions, boosted when they are trending
+
+        Args:
+            history_seconds: How far back to count questions
+            trend_seconds: Recent window compared with the whole history
+            min_count: Questions asked fewer times are ignored
+            limit: Maximum number of questions returned
+
+        Returns:
+            Dicts with the latest phrasing (`message`), `profile`, `count`,
+            `recent` (asked within the trend window), `trend` (recent rate
+            over the historical rate) and `score` (count times the trend,
+            if above 1), best first
+        """
+        now = time.time()
+        with self._lock:
+            entries = [entry for entry in self._entries if entry[0] >= now - history_seconds]
+        groups: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for timestamp, normalized, message, profile_name in entries:
+            group = groups.setdefault((profile_name, normalized), {"message": message, "profile": profile_name, "count": 0, "recent": 0})
+            group["message"] = message
+            group["count"] += 1
+            if timestamp >= now - trend_seconds:
+                group["recent"] += 1
+
+        ranked = []
+        for group in groups.values():
+            if group["count"] < min_count:
+                continue
+            historical_rate = group["count"] / history_seconds
+            group["trend"] = (group["recent"] / trend_seconds) / historical_rate
+            group["score"] = group["count"] * max(1.0, group["trend"])
+            ranked.append(group)
+        ranked.sort(key=lambda group: -group["score"])
+        return ranked[:limit]
@@ -0,0 +1,408 @@
+"""
+Key/value state shared by all API and worker processes
+
+Several uvicorn workers (or API processes next to job workers) each hold
+their own pipeline. Caches kept in process memory go cold in every new
+worker and the hit rate drops as processes are added. The stores here keep
+JSON values per namespace with an optional time to live:
+
+- `MemoryKV`: a dict, for a single process and for tests
+- `SqliteKV`: a SQLite file in WAL mode, shared by the processes of one host
+- `RedisKV`: a Redis server (needs the `redis` package), shared across hosts
+
+All three have the same methods, so callers don't care which is configured.
+`open_shared_state` picks one from the `shared_state` config section and
+falls back to SQLite when Redis is configured but unavailable.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from . import fast_json
+from .metrics import Metrics
+
+try:
+    import redis
+    HAS_REDIS = True
+except ImportError:
+    redis = None
+    HAS_REDIS = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shared_state.db")
+
+# Sets between sweeps of expired and excess rows in one namespace
+PRUNE_EVERY = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    expires_at REAL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS kv_age ON kv (namespace, updated_at);
+"""
+
+
+class MemoryKV:
+    """Process-local store; each namespace is an LRU bounded by `max_entries`"""
+
+    backend = "memory"
+
+    def __init__(self):
+        self._namespaces: Dict[str, "OrderedDict[str, Tuple[Optional[float], Any]]"] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entries = self._namespaces.get(namespace, {})
+            item = entries.get(key)
+            if item is None:
+                return None
+            if item[0] is not None and item[0] <= now:
+                del entries[key]
+                return None
+            entries.move_to_end(key)
+            return item[1]
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None,
+            max_entries: Optional[int] = None) -> None:
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            entries = self._namespaces.setdefault(namespace, OrderedDict())
+            entries[key] = (expires_at, value)
+            entries.move_to_end(key)
+            while max_entries and len(entries) > max_entries:
+                entries.popitem(last=False)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        with self._lock:
+            return self._namespaces.get(namespace, {}).pop(key, None) is not None
+
+    def expires_in(self, namespace: str, key: str) -> Optional[float]:
+        """Seconds until an entry expires; None if absent, inf if it never expires"""
+        with self._lock:
+            item = self._namespaces.get(namespace, {}).get(key)
+        if item is None:
+            return None
+        if item[0] is None:
+            return float("inf")
+        remaining = item[0] - time.time()
+        return remaining if remaining > 0 else None
+
+    def count(self, namespace: str) -> int:
+        """Live entries in a namespace"""
+        now = time.time()
+        with self._lock:
+            return sum(1 for expires_at, _ in self._namespaces.get(namespace, {}).values()
+                       if expires_at is None or expires_at > now)
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": self.backend, "namespaces": {name: len(entries) for name, entries in self._namespaces.items()}}
+
+
+class SqliteKV:
+    """
+    Store in a SQLite file (WAL mode) shared by the processes of one host
+
+    Readers never block each other or the writer. Values are JSON; expired
+    rows are ignored on read and swept, together with the oldest rows over
+    `max_entries`, every PRUNE_EVERY writes to a namespace.
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("KANGTANI_SHARED_STATE_DB", DEFAULT_DB_PATH)
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+        self._local = threading.local()
+        self._writes: Dict[str, int] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time())
+        ).fetchone()
+        return fast_json.loads(row[0]) if row else None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None,
+            max_entries: Optional[int] = None) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO kv (namespace, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(namespace, key) DO UPDATE SET value = excluded.value, "
+            "expires_at = excluded.expires_at, updated_at = excluded.updated_at",
+            (namespace, key, fast_json.dumps(value), now + ttl if ttl else None, now)
+        )
+        writes = self._writes[namespace] = self._writes.get(namespace, 0) + 1
+        if writes % PRUNE_EVERY == 1:
+            self.prune(namespace, max_entries)
+
+    def prune(self, namespace: str, max_entries: Optional[int] = None) -> int:
+        """Delete expired rows and the least recently written rows over `max_entries`"""
+        conn = self._conn()
+        deleted = conn.execute(
+            "DELETE FROM kv WHERE namespace = ? AND expires_at <= ?", (namespace, time.time())
+        ).rowcount
+        if max_entries:
+            deleted += conn.execute(
+                "DELETE FROM kv WHERE namespace = ? AND key IN ("
+                "SELECT key FROM kv WHERE namespace = ? ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (namespace, namespace, max_entries)
+            ).rowcount
+        return deleted
+
+    def delete(self, namespace: str, key: str) -> bool:
+        return self._conn().execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key)).rowcount > 0
+
+    def expires_in(self, namespace: str, key: str) -> Optional[float]:
+        row = self._conn().execute(
+            "SELECT expires_at FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[0] is None:
+            return float("inf")
+        remaining = row[0] - time.time()
+        return remaining if remaining > 0 else None
+
+    def count(self, namespace: str) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM kv WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, time.time())
+        ).fetchone()[0]
+
+    def status(self) -> Dict[str, Any]:
+        rows = self._conn().execute("SELECT namespace, COUNT(*) FROM kv GROUP BY namespace")
+        return {"backend": self.backend, "path": self.path, "namespaces": dict(rows.fetchall())}
+
+
+class RedisKV:
+    """
+    Store in Redis, shared across hosts
+
+    Keys are `<prefix><namespace>:<key>` with Redis' own expiry; `max_entries`
+    is not enforced, configure `maxmemory-policy` on the server instead.
+    """
+
+    backend = "redis"
+
+    def __init__(self, url: str, prefix: str = "kangtani:"):
+        if not HAS_REDIS:
+            raise RuntimeError("Redis support requires the redis package (pip install redis)")
+        self.url = url
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, socket_timeout=2)
+        self.client.ping()
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}{namespace}:{key}"
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        value = self.client.get(self._key(namespace, key))
+        return fast_json.loads(value) if value is not None else None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None,
+            max_entries: Optional[int] = None) -> None:
+        self.client.set(self._key(namespace, key), fast_json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, namespace: str, key: str) -> bool:
+        return self.client.delete(self._key(namespace, key)) > 0
+
+    def expires_in(self, namespace: str, key: str) -> Optional[float]:
+        milliseconds = self.client.pttl(self._key(namespace, key))
+        if milliseconds == -2:
+            return None
+        return float("inf") if milliseconds == -1 else milliseconds / 1000
+
+    def count(self, namespace: str) -> int:
+        # Key scan only; expired keys are already gone in Redis
+        return sum(1 for _ in self.client.scan_iter(match=self._key(namespace, "*"), count=500))
+
+    def status(self) -> Dict[str, Any]:
+        namespaces: Dict[str, int] = {}
+        for key in self.client.scan_iter(match=f"{self.prefix}*", count=500):
+            namespace = key.decode("utf-8")[len(self.prefix):].partition(":")[0]
+            namespaces[namespace] = namespaces.get(namespace, 0) + 1
+        return {"backend": self.backend, "url": self.url, "namespaces": namespaces}
+
+
+def open_shared_state(settings: Dict[str, Any]):
+    """
+    Store configured by the `shared_state` section
+
+    `backend` is "sqlite" (default), "memory" or "redis". A Redis store that
+    can't be used (package missing, server down) falls back to SQLite, so a
+    misconfigured cache never takes the API down.
+    """
+    backend = settings.get("backend", "sqlite")
+    if backend == "memory":
+        return MemoryKV()
+    if backend == "redis":
+        url = os.getenv("KANGTANI_REDIS_URL") or settings.get("redis_url") or "redis://localhost:6379/0"
+        try:
+            return RedisKV(url, settings.get("prefix", "kangtani:"))
+        except Exception as e:
+            logger.warning(f"Redis shared state unavailable ({e}), falling back to SQLite")
+    elif backend != "sqlite":
+        logger.warning(f"Unknown shared_state backend {backend!r}, using SQLite")
+    return SqliteKV(settings.get("path"))
+
+
+def content_key(*parts) -> str:
+    """Cache key for uploaded content (bytes or text) and any parameters that change the result"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+class SharedCache:
+    """
+    One namespace of a shared store used as a cache of computed values
+
+    Lookups and stores run in a thread, so a slow disk or Redis round trip
+    never blocks the event loop, and store errors only cost a cache miss.
+    Concurrent computations of the same key in one process are shared.
+
+    Records `shared_cache_lookups_total{cache, outcome}`.
+    """
+
+    def __init__(self, store, namespace: str, ttl: Optional[float] = None, max_entries: Optional[int] = None,
+                 metrics: Optional[Metrics] = None):
+        self.store = store
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.metrics = metrics
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    def _record(self, outcome: str) -> None:
+        if self.metrics is not None:
+            self.metrics.increment("shared_cache_lookups_total", labels={"cache": self.namespace, "outcome": outcome})
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]],
+                             cacheable: Callable[[Any], bool] = lambda value: True) -> Any:
+        """
+        Cached value for `key`, or the result of `compute()` (stored if `cacheable`)
+
+        Args:
+            key: Key within the namespace, e.g. from content_key()
+            compute: Coroutine function producing the value on a miss
+            cacheable: Whether a computed value should be stored (e.g. not error placeholders)
+        """
+        try:
+            value = await asyncio.to_thread(self.store.get, self.namespace, key)
+        except Exception as e:
+            logger.warning(f"Shared cache {self.namespace} lookup failed: {e}")
+            value = None
+        if value is not None:
+            self._record("hit")
+            return value
+        pending = self._pending.get(key)
+        if pending is not None:
+            self._record("shared")
+            return await asyncio.shield(pending)
+
+        self._record("miss")
+        future = asyncio.ensure_future(compute())
+        self._pending[key] = future
+        try:
+            value = await asyncio.shield(future)
+        finally:
+            self._pending.pop(key, None)
+        if value is not None and cacheable(value):
+            try:
+                await asyncio.to_thread(self.store.set, self.namespace, key, value, self.ttl, self.max_entries)
+            except Exception as e:
+                logger.warning(f"Shared cache {self.namespace} store failed: {e}")
+        return value
+
+
+class SessionStore:
+    """
+    Conversation history by session id, so any worker can continue a chat
+
+    Session ids are random and issued by `create`, never chosen by clients,
+    and each session belongs to the client that created it: lookups by any
+    other owner behave as if the session did not exist. Keeps the last
+    `max_turns` exchanges (a user message and the answer) of each session
+    for `ttl` seconds after its last message. Two concurrent requests in the
+    same session may both read the same history; the later write wins.
+    """
+
+    NAMESPACE = "sessions"
+
+    def __init__(self, store, ttl: float = 86400.0, max_turns: int = 10):
+        self.store = store
+        self.ttl = ttl
+        self.max_turns = max_turns
+
+    def create(self, owner: str) -> str:
+        """Start an empty session for `owner` and return its id"""
+        session_id = secrets.token_urlsafe(24)
+        now = time.time()
+        self.store.set(self.NAMESPACE, session_id, {"owner": owner, "created_at": now, "updated_at": now, "turns": []}, self.ttl)
+        return session_id
+
+    def _get(self, session_id: str, owner: str) -> Optional[Dict[str, Any]]:
+        session = self.store.get(self.NAMESPACE, session_id)
+        if session is None or session.get("owner") != owner:
+            return None
+        return session
+
+    def exists(self, session_id: str, owner: str) -> bool:
+        return self._get(session_id, owner) is not None
+
+    def history(self, session_id: str, owner: str) -> List[Dict[str, str]]:
+        """Stored turns, oldest first; KeyError if the session is unknown, expired or not `owner`'s"""
+        session = self._get(session_id, owner)
+        if session is None:
+            raise KeyError(f"Unknown session: {session_id}")
+        return session["turns"]
+
+    def append(self, session_id: str, owner: str, *turns: Dict[str, str]) -> None:
+        session = self.store.get(self.NAMESPACE, session_id)
+        if session is None:
+            # Expired while the answer was generated; keep the conversation going
+            session = {"owner": owner, "created_at": time.time(), "turns": []}
+        elif session.get("owner") != owner:
+            raise KeyError(f"Unknown session: {session_id}")
+        session["turns"] = (session["turns"] + list(turns))[-2 * self.max_turns:]
+        session["updated_at"] = time.time()
+        self.store.set(self.NAMESPACE, session_id, session, self.ttl)
+
+    def delete(self, session_id: str, owner: str) -> bool:
+        if self._get(session_id, owner) is None:
+            return False
+        return self.store.delete(self.NAMESPACE, session_id)
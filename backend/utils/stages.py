@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .deadline import DeadlineExceeded, remaining
+from .metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+StageFunc = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+class StageError(Exception):
+    """A required stage failed or timed out"""
+
+    def __init__(self, stage: str, error: BaseException):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.error = error
+
+
+class Stage:
+    """
+    One step of a request pipeline
+
+    Args:
+        name: Stage name, also the key of its result
+        func: Coroutine function receiving the results of completed stages
+        depends_on: Stages that must finish first
+        timeout: Seconds before the stage is abandoned (None for no limit)
+        required: If False, failures and timeouts yield a None result instead of
+            failing the whole request
+    """
+
+    def __init__(self, name: str, func: StageFunc, depends_on: Optional[List[str]] = None,
+                 timeout: Optional[float] = None, required: bool = True):
+        self.name = name
+        self.func = func
+        self.depends_on = depends_on or []
+        self.timeout = timeout
+        self.required = required
+
+
+class StageGraph:
+    """
+    Run stages concurrently as soon as their dependencies are done
+
+    Independent preprocessing (ASR, file parsing, document loading, ...)
+    overlaps, so end-to-end latency follows the slowest path through the
+    graph rather than the sum of all stages. Per-stage wall times are
+    returned and recorded in `metrics` as `stage_latency_seconds`.
+    """
+
+    def __init__(self, stages: List[Stage], metrics: Optional[Metrics] = None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.metrics = metrics
+        for stage in stages:
+            unknown = [name for name in stage.depends_on if name not in self.stages]
+            if unknown:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {unknown}")
+
+    async def _run_stage(self, stage: Stage, results: Dict[str, Any], timings: Dict[str, float]) -> Any:
+        start_time = time.perf_counter()
+        outcome = "ok"
+        # The request deadline (if any) cuts the stage's own timeout short
+        timeout = stage.timeout
+        left = remaining()
+        cut_by_deadline = left is not None and (timeout is None or left < timeout)
+        if cut_by_deadline:
+            timeout = max(0.0, left)
+        try:
+            return await asyncio.wait_for(stage.func(results), timeout)
+        except (asyncio.TimeoutError, TimeoutError) as e:
+            outcome = "timeout"
+            if type(e) not in (asyncio.TimeoutError, TimeoutError):
+                # Raised by the stage itself (e.g. the Ollama client ran out of time)
+                error = e
+            elif cut_by_deadline:
+                outcome = "deadline"
+                error = DeadlineExceeded(f"request deadline reached after {time.perf_counter() - start_time:.1f}s")
+            else:
+                error = TimeoutError(f"timed out after {stage.timeout}s")
+            if stage.required:
+                raise StageError(stage.name, error) from e
+            logger.warning(f"Optional stage '{stage.name}' {error}, continuing without it")
+        except StageError:
+            outcome = "error"
+            raise
+        except Exception as e:
+            outcome = "error"
+            if stage.required:
+                raise StageError(stage.name, e) from e
+            logger.error(f"Optional stage '{stage.name}' failed, continuing without it: {e}")
+        finally:
+            elapsed = time.perf_counter() - start_time
+            timings[stage.name] = elapsed
+            if self.metrics is not None:
+                self.metrics.observe("stage_latency_seconds", elapsed, labels={"stage": stage.name})
+                if outcome != "ok":
+                    self.metrics.increment("stage_failures_total", labels={"stage": stage.name, "outcome": outcome})
+        return None
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Execute the graph
+
+        Returns:
+            Stage results by name, plus per-stage seconds under "_timings"
+        """
+        results: Dict[str, Any] = {}
+        timings: Dict[str, float] = {}
+        pending = dict(self.stages)
+        running: Dict[asyncio.Task, str] = {}
+
+        try:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if all(dependency in results for dependency in stage.depends_on):
+                        task = asyncio.create_task(self._run_stage(stage, results, timings))
+                        running[task] = name
+                        del pending[name]
+                if not running:
+                    raise ValueError(f"Stage graph has a dependency cycle: {list(pending)}")
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    results[running.pop(task)] = task.result()
+        finally:
+            for task in running:
+                task.cancel()
+
+        results["_timings"] = timings
+        return results
@@ -0,0 +1,259 @@
+import codecs
+import re
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+
+# Feed markup parsers in slices so huge single-line files don't need one giant call
+CHUNK_SIZE = 64 * 1024
+
+_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+# Bytes cp1252 leaves undefined; their presence means the text is latin-1
+_CP1252_UNDEFINED = re.compile(rb'[\x81\x8d\x8f\x90\x9d]')
+
+
+def detect_encoding(data) -> Tuple[str, int]:
+    """
+    Detect the encoding of a byte buffer
+
+    Checks for a byte order mark, then NUL patterns of BOM-less UTF-16, then
+    strict UTF-8. Anything else is cp1252 unless it contains bytes cp1252
+    leaves undefined, in which case it is latin-1 (which accepts every byte).
+
+    Args:
+        data: bytes, bytearray, memoryview or mmap
+
+    Returns:
+        (encoding, BOM length to skip)
+    """
+    head = bytes(data[:4])
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding, len(bom)
+
+    sample = bytes(data[:4096])
+    if len(sample) >= 4 and sample.count(b'\x00') > len(sample) // 4:
+        if sample[1::2].count(b'\x00') > sample[0::2].count(b'\x00'):
+            return 'utf-16-le', 0
+        return 'utf-16-be', 0
+
+    try:
+        codecs.decode(data, 'utf-8')
+        return 'utf-8', 0
+    except UnicodeDecodeError:
+        pass
+    if _CP1252_UNDEFINED.search(data):
+        return 'latin-1', 0
+    return 'cp1252', 0
+
+
+def decode_bytes(data) -> str:
+    """Decode a byte buffer with the detected encoding"""
+    encoding, skip = detect_encoding(data)
+    return codecs.decode(memoryview(data)[skip:], encoding, errors='replace')
+
+
+def normalize_whitespace(text: str) -> str:
+    """Collapse runs of spaces/tabs, strip lines and keep at most one blank line"""
+    lines = []
+    blank = False
+    for line in text.splitlines():
+        line = ' '.join(line.split())
+        if line:
+            lines.append(line)
+            blank = False
+        elif lines and not blank:
+            lines.append('')
+            blank = True
+    if blank:
+        lines.pop()
+    return '\n'.join(lines)
+
+
+class _HtmlText(HTMLParser):
+    """
+    Collects visible text, breaking lines at block elements
+
+    The <head> is dropped, so a <title> inside it is kept aside in `title`;
+    a <title> outside a <head> is part of the visible text like any block.
+    """
+
+    SKIP = {'script', 'style', 'noscript', 'template', 'svg', 'head'}
+    BLOCK = {
+        'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt',
+        'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4',
+        'h5', 'h6', 'header', 'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section',
+        'table', 'title', 'tr', 'ul',
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.skip_depth = 0
+        self.head_depth = 0
+        self.title: Optional[str] = None
+        self._title_parts: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'head':
+            self.head_depth += 1
+        elif tag == 'title' and self.head_depth and self.title is None:
+            self._title_parts = []
+        if tag in self.SKIP:
+            self.skip_depth += 1
+        elif tag in self.BLOCK:
+            self.parts.append('\n')
+        elif tag in ('td', 'th'):
+            self.parts.append(' | ')
+
+    def handle_endtag(self, tag):
+        if tag == 'head':
+            self.head_depth = max(0, self.head_depth - 1)
+        elif tag == 'title' and self._title_parts is not None:
+            self.title = ''.join(self._title_parts)
+            self._title_parts = None
+        if tag in self.SKIP:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in self.BLOCK:
+            self.parts.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in self.BLOCK:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+        if not self.skip_depth:
+            self.parts.append(data)
+
+
+def strip_html(text: str) -> str:
+    """Visible text of an HTML document (scripts, styles and <head> dropped)"""
+    parser = _HtmlText()
+    for start in range(0, len(text), CHUNK_SIZE):
+        parser.feed(text[start:start + CHUNK_SIZE])
+    parser.close()
+    body = ''.join(parser.parts)
+    if parser.title:
+        # Only a title from the dropped <head>; any other is already in the body
+        body = f"{parser.title}\n{body}"
+    return body.replace('\n | ', '\n')
+
+
+class _XmlText:
+    """XMLParser target that keeps character data in document order, no tree"""
+
+    def __init__(self):
+        self.parts: List[str] = []
+
+    def start(self, tag, attrib):
+        self.parts.append('\n')
+
+    def end(self, tag):
+        self.parts.append('\n')
+
+    def data(self, data):
+        self.parts.append(data)
+
+    def close(self) -> str:
+        return ''.join(self.parts)
+
+
+def strip_xml(data) -> str:
+    """
+    Text content of an XML document, one element per line
+
+    The raw bytes are fed to an incremental parser so the XML declaration
+    picks the encoding. Malformed XML falls back to the lenient HTML parser.
+    """
+    parser = ET.XMLParser(target=_XmlText())
+    try:
+        view = memoryview(data)
+        for start in range(0, len(view), CHUNK_SIZE):
+            parser.feed(bytes(view[start:start + CHUNK_SIZE]))
+        return parser.close()
+    except ET.ParseError:
+        return strip_html(decode_bytes(data))
+
+
+_RTF_TOKEN = re.compile(
+    r"\\([a-zA-Z]{1,32})(-?\d{1,10})? ?|\\'([0-9a-fA-F]{2})|\\(.)|([{}])|[\r\n]+|([^\\{}\r\n]+)",
+    re.S,
+)
+# Groups whose content is never visible text
+_RTF_DESTINATIONS = {
+    'fonttbl', 'colortbl', 'stylesheet', 'info', 'pict', 'object', 'header', 'footer',
+    'headerl', 'headerr', 'footerl', 'footerr', 'listtable', 'listoverridetable',
+    'rsidtbl', 'generator', 'xmlnstbl', 'themedata', 'colorschememapping', 'datastore',
+    'latentstyles', 'fldinst', 'bkmkstart', 'bkmkend', 'revtbl',
+}
+_RTF_SPECIAL = {
+    'par': '\n', 'line': '\n', 'sect': '\n', 'page': '\n', 'row': '\n', 'cell': ' | ',
+    'tab': '\t', 'emdash': '\u2014', 'endash': '\u2013', 'bullet': '\u2022',
+    'lquote': '\u2018', 'rquote': '\u2019', 'ldblquote': '\u201c', 'rdblquote': '\u201d',
+}
+
+
+def strip_rtf(text: str) -> str:
+    """Visible text of an RTF document in a single regex scan"""
+    parts: List[str] = []
+    stack: List[Tuple[bool, int]] = []
+    ignorable = False
+    uc_skip = 1
+    pending_skip = 0
+
+    for match in _RTF_TOKEN.finditer(text):
+        word, arg, hex_code, symbol, brace, plain = match.groups()
+        if brace == '{':
+            stack.append((ignorable, uc_skip))
+            continue
+        if brace == '}':
+            if stack:
+                ignorable, uc_skip = stack.pop()
+            continue
+        if plain is not None:
+            if pending_skip:
+                # Characters standing in for the preceding \uN
+                skipped = min(pending_skip, len(plain))
+                plain = plain[skipped:]
+                pending_skip -= skipped
+            if not ignorable and plain:
+                parts.append(plain)
+            continue
+        if hex_code is not None:
+            if pending_skip:
+                pending_skip -= 1
+            elif not ignorable:
+                parts.append(bytes([int(hex_code, 16)]).decode('cp1252', errors='replace'))
+            continue
+        if symbol is not None:
+            if symbol == '*':
+                ignorable = True
+            elif not ignorable and symbol in '\\{}':
+                parts.append(symbol)
+            elif not ignorable and symbol == '~':
+                parts.append('\u00a0')
+            continue
+        if word is None:
+            continue
+
+        if word in _RTF_DESTINATIONS:
+            ignorable = True
+        elif word == 'uc':
+            uc_skip = int(arg or 1)
+        elif word == 'u':
+            if not ignorable:
+                code = int(arg)
+                parts.append(chr(code + 65536 if code < 0 else code))
+            pending_skip = uc_skip
+        elif not ignorable and word in _RTF_SPECIAL:
+            parts.append(_RTF_SPECIAL[word])
+
+    return ''.join(parts)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Kangtani.ai job workers
+
+Drains the durable job queue (see job_queue.py) through the same
+FileParser / AudioProcessor / OllamaClient pipeline as the HTTP API.
+
+    python worker.py                  # supervisor: spawn workers per job type
+    python worker.py --type file      # a single worker process for file jobs
+
+Worker counts per job type come from the `jobs.workers` section of
+config.json, or KANGTANI_JOB_WORKERS="chat=1,file=2,audio=1".
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import traceback
+from typing import Dict, List, Optional
+
+import httpx
+
+from config import ConfigStore
+from job_queue import JOB_TYPES, JobQueue, check_callback_url
+from pipeline import ChatPipeline
+from ratelimit import ANONYMOUS, ClientInfo, client_scope
+from utils.deadline import deadline_scope, route_timeout
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('worker.log'),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger("worker")
+
+
+class InvalidJobError(Exception):
+    """Job that can never succeed (bad payload or unknown profile)"""
+
+
+# Route each job type resolves its default profile for, as if sent to the sync API
+JOB_ROUTES = {"chat": "/chat", "file": "/chat/file", "audio": "/chat/audio"}
+
+
+def worker_counts(config_store: ConfigStore) -> Dict[str, int]:
+    """Number of worker processes to run per job type"""
+    counts = {job_type: 1 for job_type in JOB_TYPES}
+    counts.update(config_store.section("jobs").get("workers", {}))
+    override = os.getenv("KANGTANI_JOB_WORKERS")
+    if override:
+        for item in override.split(","):
+            job_type, _, count = item.partition("=")
+            counts[job_type.strip()] = int(count)
+    return {job_type: count for job_type, count in counts.items() if job_type in JOB_TYPES}
+
+
+def create_queue(config_store: ConfigStore) -> JobQueue:
+    settings = config_store.section("jobs")
+    return JobQueue(
+        path=settings.get("database"),
+        lease_seconds=settings.get("lease_seconds", 900),
+        max_attempts=settings.get("max_attempts", 3)
+    )
+
+
+async def run_job(pipeline: ChatPipeline, job: Dict, message: str, profile, allow_fast_path: bool):
+    """Dispatch a job to the pipeline method for its type"""
+    payload = job["payload"]
+    request_id = job["id"]
+    if job["type"] == "chat":
+        return await pipeline.chat(
+            message, request_id, profile,
+            history=payload.get("history"),
+            file_content=payload.get("file_content"),
+            audio_base64=payload.get("audio_base64"),
+            document_ids=payload.get("document_ids"),
+            allow_fast_path=allow_fast_path,
+            session_id=payload.get("session_id")
+        )
+    elif job["type"] == "file":
+        return await pipeline.chat_with_file(
+            message, request_id, profile, payload["filename"], job["blob"],
+            allow_fast_path=allow_fast_path
+        )
+    else:
+        return await pipeline.chat_with_audio(
+            message, request_id, profile, job["blob"],
+            allow_fast_path=allow_fast_path
+        )
+
+
+async def process_job(pipeline: ChatPipeline, job: Dict) -> Dict:
+    """Run one job through the pipeline and return its result payload"""
+    payload = job["payload"]
+    request_id = job["id"]
+    start_time = time.time()
+    try:
+        profile = pipeline.resolve_profile(payload.get("profile"), JOB_ROUTES[job["type"]])
+        message = payload["message"]
+    except KeyError as e:
+        raise InvalidJobError(str(e))
+    allow_fast_path = payload.get("profile") is None
+    timeout = route_timeout(pipeline.config_store.section("deadlines"), JOB_ROUTES[job["type"]])
+    # Queue LLM calls fairly by the client that submitted the job
+    client = ClientInfo.from_dict(payload["client"]) if payload.get("client") else ANONYMOUS
+    with deadline_scope(timeout), client_scope(client):
+        result = await run_job(pipeline, job, message, profile, allow_fast_path)
+
+    return {
+        "response": result.response,
+        "status": "success",
+        "request_id": request_id,
+        "processing_time": time.time() - start_time,
+        "profile": result.profile.name,
+        "stage_timings": result.stage_timings
+    }
+
+
+async def send_callback(job_queue: JobQueue, job_id: str, callback_url: str,
+                        allowed_hosts: Optional[List[str]] = None) -> None:
+    """POST the finished job to the caller's callback URL (best effort)"""
+    try:
+        # Checked at submit time too; again here because DNS may have changed since
+        await asyncio.to_thread(check_callback_url, callback_url, allowed_hosts)
+        job = await asyncio.to_thread(job_queue.get, job_id)
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            response = await client.post(callback_url, json=job)
+            response.raise_for_status()
+        logger.info(f"Callback for job {job_id} delivered to {callback_url}")
+    except Exception as e:
+        logger.error(f"Callback for job {job_id} to {callback_url} failed: {e}")
+
+
+async def keep_lease(job_queue: JobQueue, job_id: str, worker_id: str) -> None:
+    """Renew a running job's lease every third of its length, so long jobs aren't handed to another worker"""
+    interval = max(1.0, job_queue.lease_seconds / 3)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if not await asyncio.to_thread(job_queue.extend_lease, job_id, worker_id):
+                logger.warning(f"Worker {worker_id} lost the lease on job {job_id}")
+                return
+        except Exception as e:
+            # A locked or briefly unavailable database; the lease still has two thirds left
+            logger.warning(f"Renewing the lease on job {job_id} failed: {e}")
+
+
+async def run_worker(job_types: List[str]) -> None:
+    """Claim and process jobs of the given types until interrupted"""
+    config_store = ConfigStore()
+    job_queue = create_queue(config_store)
+    pipeline = ChatPipeline(config_store)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    poll_interval = config_store.section("jobs").get("poll_interval", 0.5)
+    logger.info(f"Worker {worker_id} started for {job_types}")
+    try:
+        await _work(pipeline, job_queue, job_types, worker_id, poll_interval)
+    finally:
+        await pipeline.audit_log.close()
+
+
+async def _work(pipeline: ChatPipeline, job_queue: JobQueue, job_types: List[str], worker_id: str,
+                poll_interval: float) -> None:
+    """Claim and process jobs forever (the body of run_worker)"""
+    while True:
+        job = await asyncio.to_thread(job_queue.claim, job_types, worker_id)
+        if job is None:
+            await asyncio.sleep(poll_interval)
+            continue
+
+        logger.info(f"Worker {worker_id} running job {job['id']} ({job['type']}, attempt {job['attempts']})")
+        heartbeat = asyncio.ensure_future(keep_lease(job_queue, job["id"], worker_id))
+        try:
+            result = await process_job(pipeline, job)
+            recorded = await asyncio.to_thread(job_queue.complete, job["id"], worker_id, result)
+            logger.info(f"Job {job['id']} done in {result['processing_time']:.3f}s")
+        except InvalidJobError as e:
+            # Retrying will not help
+            recorded = await asyncio.to_thread(job_queue.fail, job["id"], worker_id, f"Invalid job: {e}", False)
+        except Exception as e:
+            logger.error(f"Job {job['id']} failed: {e}")
+            logger.error(f"Job traceback: {traceback.format_exc()}")
+            recorded = await asyncio.to_thread(job_queue.fail, job["id"], worker_id, str(e), True)
+        finally:
+            heartbeat.cancel()
+
+        if not recorded:
+            # The lease expired and the job was requeued or claimed by another
+            # worker, whose outcome (and callback) counts instead of this one
+            logger.warning(f"Worker {worker_id} lost the lease on job {job['id']}, discarding its outcome")
+            continue
+
+        if job["callback_url"]:
+            finished = await asyncio.to_thread(job_queue.get, job["id"])
+            if finished and finished["status"] in ("done", "failed"):
+                allowed_hosts = pipeline.config_store.section("jobs").get("callback_allowed_hosts")
+                await send_callback(job_queue, job["id"], job["callback_url"], allowed_hosts)
+
+
+def supervise() -> None:
+    """Spawn and keep alive the configured number of worker processes per job type"""
+    config_store = ConfigStore()
+    counts = worker_counts(config_store)
+    logger.info(f"Starting job workers: {counts}")
+    processes: Dict[subprocess.Popen, str] = {}
+
+    def spawn(job_type: str) -> None:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--type", job_type])
+        processes[process] = job_type
+        logger.info(f"Worker for {job_type} started (PID: {process.pid})")
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    for job_type, count in counts.items():
+        for _ in range(count):
+            spawn(job_type)
+
+    try:
+        while True:
+            time.sleep(2)
+            for process, job_type in list(processes.items()):
+                if process.poll() is not None:
+                    logger.warning(f"Worker for {job_type} exited with {process.returncode}, restarting")
+                    del processes[process]
+                    spawn(job_type)
+    except KeyboardInterrupt:
+        logger.info("Stopping job workers")
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kangtani.ai job workers")
+    parser.add_argument("--type", action="append", choices=JOB_TYPES,
+                        help="Run a single worker for this job type (repeatable)")
+    args = parser.parse_args()
+
+    if args.type:
+        # The supervisor stops workers with SIGTERM; unwind so queued audit entries get written
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            asyncio.run(run_worker(args.type))
+        except KeyboardInterrupt:
+            logger.info("Worker stopped")
+    else:
+        supervise()
+
+
+if __name__ == "__main__":
+    main()
@@ -220,6 +220,10 @@ class KangtaniDebugger:
         """Monitor server status and resources"""
         logger.info("📊 Starting server monitoring...")
         
+        admin_token = os.getenv("KANGTANI_ADMIN_TOKEN")
+        if not admin_token:
+            logger.info("ℹ️ Set KANGTANI_ADMIN_TOKEN to include the server's resource recorder")
+        
         try:
             import psutil
             
@@ -243,6 +247,10 @@ class KangtaniDebugger:
                 # Log status
                 logger.info(f"📊 Status: CPU {cpu_percent}% | Memory {memory.percent}% | API {api_status}")
                 
+                # Server-side samples and slow requests from the resource recorder (admin only)
+                if admin_token:
+                    self.report_recorder(admin_token, seconds=30)
+                
                 time.sleep(30)  # Check every 30 seconds
                 
         except KeyboardInterrupt:
@@ -250,6 +258,41 @@ class KangtaniDebugger:
         except Exception as e:
             logger.error(f"❌ Monitoring error: {e}")
     
+    def report_recorder(self, admin_token, seconds=30):
+        """Summarize the last `seconds` of recorder samples and the slowest requests"""
+        headers = {"X-Admin-Token": admin_token}
+        try:
+            samples = requests.get(
+                f"{self.backend_url}/admin/recorder", params={"seconds": seconds}, headers=headers, timeout=5
+            ).json()
+            slow = requests.get(
+                f"{self.backend_url}/admin/recorder/slow", params={"seconds": seconds * 10}, headers=headers, timeout=5
+            ).json()
+        except Exception as e:
+            logger.warning(f"⚠️ Resource recorder unavailable: {e}")
+            return
+        
+        columns = samples.get("columns", {})
+        if not columns.get("time"):
+            logger.info("📈 Recorder: no samples yet (is recorder.enabled set?)")
+            return
+        
+        def peak(name):
+            values = [value for value in columns.get(name, []) if value is not None]
+            return f"{max(values):.1f}" if values else "n/a"
+        
+        logger.info(
+            f"📈 Recorder ({len(columns['time'])} samples): CPU peak {peak('process_cpu_percent')}% | "
+            f"RSS peak {peak('rss_mb')} MB | loop lag peak {peak('loop_lag_ms')} ms | "
+            f"LLM backlog peak {peak('llm_backlog')} | jobs queued {peak('jobs_queued')} | "
+            f"Ollama models {peak('ollama_models')}"
+        )
+        for request in slow.get("slow", [])[:3]:
+            logger.info(
+                f"🐢 {request['method']} {request['path']} {request['seconds']:.2f}s ({request['request_id']}) "
+                f"suspect: {request['suspect'] or 'model generation'} {request['scores']}"
+            )
+    
     def interactive_chat(self):
         """Interactive chat interface for testing"""
         logger.info("🌾 Starting interactive chat...")